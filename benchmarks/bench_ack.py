@@ -0,0 +1,92 @@
+"""Benchmark for acking deliveries, comparing a basic.Ack per delivery against protocol.AckManager,
+with deliveries handled in order, and out of order (shuffled within windows of --window tags,
+as when several greenlets handle a channel's deliveries at once).
+
+Acks are sent on a stand-in for a Channel, which packs each method's frame and counts it, so this
+measures the client's cost of acking (including encoding) but not of writing to a socket.
+For each, prints the ack frames sent per delivery and the time per delivery.
+
+With the defaults, AckManager sends 0.01 ack frames per delivery both in and out of order, and costs
+about 2-6us per delivery, against about 30-35us for building and packing an Ack for every delivery
+(CPython 2.7 and 3.11).
+
+Run from the repository root:
+	python benchmarks/bench_ack.py [--count N] [--max-pending N] [--window N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+import repo_path
+
+from grabbit.frames import Frame
+from grabbit.methods import basic
+from grabbit.protocol import AckManager
+
+
+class PackingChannel(object):
+	"""Stands in for a Channel, packing and counting each method sent"""
+	def __init__(self):
+		self.id = 1
+		self.error = None
+		self.close_callbacks = []
+		self.frames = 0
+
+	def send(self, method):
+		Frame(Frame.METHOD_TYPE, self.id, method).pack()
+		self.frames += 1
+
+
+def completion_order(count, window):
+	"""Returns the tags 1 to count, shuffled within each window of tags"""
+	rand = random.Random(0)
+	tags = []
+	for start in range(1, count + 1, window):
+		chunk = list(range(start, min(start + window, count + 1)))
+		rand.shuffle(chunk)
+		tags += chunk
+	return tags
+
+
+def individual(tags, max_pending):
+	channel = PackingChannel()
+	for tag in tags:
+		channel.send(basic.Ack(tag, multiple=False))
+	return channel
+
+
+def coalesced(tags, max_pending):
+	channel = PackingChannel()
+	manager = AckManager(channel, max_pending=max_pending, max_delay=60)
+	for tag in tags:
+		manager.ack(tag)
+	manager.flush()
+	return channel
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--count', type=int, default=200000, help='Number of deliveries to ack')
+	parser.add_argument('--max-pending', type=int, default=100, help="AckManager's max_pending")
+	parser.add_argument('--window', type=int, default=10, help='Size of windows shuffled for out of order')
+	args = parser.parse_args()
+	in_order = list(range(1, args.count + 1))
+	shuffled = completion_order(args.count, args.window)
+	for name, ack, tags in (
+		('individual', individual, in_order),
+		('coalesced, in order', coalesced, in_order),
+		('coalesced, out of order', coalesced, shuffled),
+	):
+		start = time.time()
+		channel = ack(tags, args.max_pending)
+		elapsed = time.time() - start
+		print("{:>24}: {:.4f} ack frames per delivery, {:.2f}us per delivery".format(
+			name, channel.frames / float(args.count), elapsed / args.count * 1e6,
+		))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,89 @@
+"""Benchmark for protocol.Cluster, with two FakeServers (as used by the tests) standing in for brokers,
+one of which (the first address) takes --delay seconds to answer each method, like an overloaded node.
+--concurrency greenlets each do --count synchronous operations (a queue.Declare) on leased channels,
+either all on the first node, or on nodes chosen by a Cluster, which probes each node's round trip
+time every 0.1s. Prints the throughput of each and how the Cluster's leases were spread.
+
+With the defaults (2ms delay), pinning everything to the first node manages about 300 operations/s,
+while the Cluster sends over 90% of them to the responsive node and manages about 2600/s (CPython 2.7
+and 3.11). With --delay 0, it spreads them evenly; that isn't faster here only because both FakeServers
+share this process's CPU.
+
+Run from the repository root:
+	python benchmarks/bench_cluster.py [--count N] [--concurrency N] [--delay S]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import gevent
+from gevent.pool import Pool
+
+import repo_path
+
+from grabbit.methods import basic, queue
+from grabbit.protocol import ChannelPool, Cluster
+from grabbit.protocol.tests.common import FakeServer
+
+
+def declare(channel):
+	channel.call(queue.Declare(name='q', passive=False, durable=False, exclusive=False, autodelete=False,
+	                           nowait=False, arguments={}))
+
+
+def slow(delay, response):
+	def handler(server, channel, method):
+		gevent.sleep(delay)
+		return [response(method)]
+	return handler
+
+
+def run(lease, count, concurrency):
+	def worker():
+		for _ in range(count):
+			with lease() as channel:
+				declare(channel)
+	workers = Pool(concurrency)
+	start = time.time()
+	for _ in range(concurrency):
+		workers.spawn(worker)
+	workers.join(raise_error=True)
+	return count * concurrency / (time.time() - start)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--count', type=int, default=500, help='Operations per greenlet')
+	parser.add_argument('--concurrency', type=int, default=8, help='Greenlets doing operations at once')
+	parser.add_argument('--delay', type=float, default=0.002, help="Seconds the slow node takes per method")
+	args = parser.parse_args()
+	servers = [
+		FakeServer({
+			queue.Declare: slow(args.delay, lambda method: queue.DeclareOk(method.name, 0, 0)),
+			basic.Qos: slow(args.delay, lambda method: basic.QosOk()),
+		}),
+		FakeServer(),
+	]
+	try:
+		conn = servers[0].connect()
+		pool = ChannelPool(conn)
+		rate = run(pool.lease, args.count, args.concurrency)
+		print("{:>16}: {:>6.0f} operations/s".format('first node', rate))
+		conn.close()
+
+		cluster = Cluster([('127.0.0.1', server.port) for server in servers], probe_interval=0.1).connect()
+		gevent.sleep(0.5) # let probes measure each node
+		rate = run(cluster.lease, args.count, args.concurrency)
+		print("{:>16}: {:>6.0f} operations/s, leases per node {}".format(
+			'cluster', rate, [node.leases for node in cluster.nodes],
+		))
+		cluster.close()
+	finally:
+		for server in servers:
+			server.stop()
+
+
+if __name__ == '__main__':
+	main()
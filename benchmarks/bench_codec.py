@@ -0,0 +1,46 @@
+"""Microbenchmark comparing the generated Sequence codecs against the reference implementation,
+for the basic.Deliver and basic.Publish methods.
+
+Run from the repository root: python benchmarks/bench_codec.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import repo_path
+
+from grabbit.methods import basic
+
+
+NUMBER = 50000
+
+
+def bench(name, fn):
+	elapsed = timeit.timeit(fn, number=NUMBER)
+	return elapsed * 1e6 / NUMBER
+
+
+def main():
+	methods = [
+		basic.Deliver('amq.ctag-0123456789', 123456, exchange='exchange', routing_key='some.routing.key',
+		              redelivered=False),
+		basic.Publish(exchange='exchange', routing_key='some.routing.key', mandatory=False, immediate=False),
+	]
+	print("{:>10} {:>8} {:>16} {:>16} {:>8}".format('method', 'op', 'reference (us)', 'compiled (us)', 'speedup'))
+	for method in methods:
+		cls = type(method)
+		data = method.pack()
+		for op, reference, compiled in [
+			('encode', method.reference_pack, method.pack),
+			('decode', lambda: cls.reference_unpack(data), lambda: cls.unpack(data)),
+		]:
+			reference = bench(op, reference)
+			compiled = bench(op, compiled)
+			print("{:>10} {:>8} {:>16.3f} {:>16.3f} {:>7.1f}x".format(
+				cls.__name__, op, reference, compiled, reference / compiled
+			))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,102 @@
+"""Benchmark for publisher confirms, comparing the throughput of publishing --count messages
+without confirms against a protocol.ConfirmPublisher, with no limit on messages in flight and
+with --max-in-flight. Messages are published to the FakeServer used by the tests, which acks them
+with one multiple Ack per read from the socket, as RabbitMQ tends to. Each run ends once every message
+has been received (unconfirmed) or confirmed.
+
+The FakeServer decodes every frame in python, so it limits both runs to similar rates. What this shows
+is that confirms add little to the client's work: about 0.9-1.0x of unconfirmed throughput on CPython 2.7
+and 3.11, and the same with 1000 in flight.
+
+Also times OutstandingTags on its own: adding --count tags and resolving them with multiple acks
+of --ack-every tags at a time, and with individual acks.
+
+Run from the repository root:
+	python benchmarks/bench_confirm.py [--count N] [--size BYTES] [--max-in-flight N] [--ack-every N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import gevent
+
+import repo_path
+
+from grabbit.protocol import ConfirmPublisher
+from grabbit.protocol.confirm import OutstandingTags
+from grabbit.protocol.tests.common import FakeServer
+
+
+def publish_unconfirmed(server, count, body):
+	conn = server.connect()
+	channel = conn.channel()
+	expected = len(server.received) + count
+	start = time.time()
+	for _ in range(count):
+		channel.publish('ex', 'key', body)
+	while len(server.received) < expected:
+		gevent.sleep(0.001)
+	elapsed = time.time() - start
+	conn.close()
+	return elapsed
+
+
+def publish_confirmed(server, count, body, max_in_flight=0):
+	conn = server.connect()
+	publisher = ConfirmPublisher(conn.channel(), max_in_flight)
+	start = time.time()
+	results = [publisher.publish('ex', 'key', body) for _ in range(count)]
+	publisher.wait()
+	elapsed = time.time() - start
+	assert all(result.successful() for result in results)
+	conn.close()
+	return elapsed
+
+
+def resolve_tags(count, ack_every):
+	tags = OutstandingTags()
+	start = time.time()
+	for n in range(count):
+		tags.add(n)
+	if ack_every > 1:
+		for tag in range(ack_every, count + 1, ack_every):
+			tags.resolve(tag, multiple=True)
+	else:
+		for tag in range(1, count + 1):
+			tags.resolve(tag)
+	return time.time() - start
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--count', type=int, default=50000, help='Number of messages to publish')
+	parser.add_argument('--size', type=int, default=100, help='Message body size in bytes')
+	parser.add_argument('--max-in-flight', type=int, default=1000, help='Limit for the limited run')
+	parser.add_argument('--ack-every', type=int, default=100, help='Tags per multiple ack, for OutstandingTags')
+	args = parser.parse_args()
+	body = b'x' * args.size
+	server = FakeServer()
+	try:
+		runs = [
+			('unconfirmed', lambda: publish_unconfirmed(server, args.count, body)),
+			('confirmed', lambda: publish_confirmed(server, args.count, body)),
+			('confirmed, max {}'.format(args.max_in_flight),
+			 lambda: publish_confirmed(server, args.count, body, args.max_in_flight)),
+		]
+		baseline = None
+		for name, run in runs:
+			rate = args.count / run()
+			baseline = baseline or rate
+			print("{:>32}: {:>8.0f} messages/s ({:.2f}x)".format(name, rate, rate / baseline))
+	finally:
+		server.stop()
+	for name, ack_every in (('multiple acks', args.ack_every), ('single acks', 1)):
+		print("{:>32}: {:>8.0f} tags/s".format(
+			'OutstandingTags, ' + name, args.count / resolve_tags(args.count, ack_every)
+		))
+
+
+if __name__ == '__main__':
+	main()
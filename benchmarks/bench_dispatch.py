@@ -0,0 +1,96 @@
+"""Benchmark for protocol.Dispatcher, with a FakeServer (as used by the tests) delivering --count messages
+with --keys different routing keys, handled by either an IO-bound handler (sleeping --io-time seconds)
+or a CPU-bound one (hashing the body --cpu-rounds times). Prints the rate at which each is handled:
+	serial: one partition, so one message at a time, as handling them on the channel's queue would be
+	greenlets: --partitions partitions, each handled in its own greenlet
+	processes: as greenlets, but with handlers run in a pool of --processes processes
+
+With the defaults (10000 messages over 100 keys, 1ms of IO each, 16 partitions), on a single core, the
+IO-bound handler manages about 700-750 messages/s serially and 3000-3200/s with greenlets, where delivering
+the messages from the same process is what limits it. The CPU-bound handler (about 0.5ms each) manages
+about 2000/s (1400/s on CPython 2.7) serially or with greenlets, and about half that with processes, as with
+one core they can't run in parallel, and pickling each message and passing it through the pool costs about
+0.5ms. So processes only pay off given several cores, for handlers which take well over that.
+
+Run from the repository root:
+	python benchmarks/bench_dispatch.py [--count N] [--keys N] [--partitions N] [--processes N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import time
+
+import gevent
+
+import repo_path
+
+from grabbit.methods import basic
+from grabbit.protocol import Dispatcher
+from grabbit.protocol.tests.common import FakeServer
+
+
+CPU_ROUNDS = 500
+
+
+def cpu_bound(message):
+	data = message.body
+	for _ in range(CPU_ROUNDS):
+		data = hashlib.sha256(data).digest()
+
+
+def io_bound(delay):
+	def handler(message):
+		gevent.sleep(delay)
+	return handler
+
+
+def run(server, handler, count, keys, **kwargs):
+	"""Returns the rate at which count messages are handled by a Dispatcher"""
+	conn = server.connect()
+	channel = conn.channel()
+	dispatcher = Dispatcher(channel, handler, **kwargs)
+	start = time.time()
+	for tag in range(1, count + 1):
+		method = basic.Deliver(consumer_tag='c1', delivery_tag=tag, redelivered=False, exchange='ex',
+		                       routing_key='key{}'.format(tag % keys))
+		server.send(channel.id, method, {}, b'body')
+	while dispatcher.handled < count:
+		gevent.sleep(0.001)
+	rate = count / (time.time() - start)
+	dispatcher.close()
+	conn.close()
+	return rate
+
+
+def main():
+	global CPU_ROUNDS
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--count', type=int, default=10000, help='Messages delivered for each run')
+	parser.add_argument('--keys', type=int, default=100, help='Distinct routing keys')
+	parser.add_argument('--partitions', type=int, default=16, help='Partitions for the concurrent runs')
+	parser.add_argument('--processes', type=int, default=4, help='Processes for the CPU-bound run')
+	parser.add_argument('--io-time', type=float, default=0.001, help='Seconds the IO-bound handler sleeps')
+	parser.add_argument('--cpu-rounds', type=int, default=CPU_ROUNDS, help='Hashes done by the CPU-bound handler')
+	args = parser.parse_args()
+	CPU_ROUNDS = args.cpu_rounds # set before the process pool forks
+	# the FakeServer ignores Qos, so deliveries aren't held up when partitions fill
+	server = FakeServer()
+	try:
+		runs = [
+			('io, serial', io_bound(args.io_time), dict(partitions=1)),
+			('io, greenlets', io_bound(args.io_time), dict(partitions=args.partitions)),
+			('cpu, serial', cpu_bound, dict(partitions=1)),
+			('cpu, greenlets', cpu_bound, dict(partitions=args.partitions)),
+			('cpu, processes', cpu_bound, dict(partitions=args.partitions, processes=args.processes)),
+		]
+		for name, handler, kwargs in runs:
+			rate = run(server, handler, args.count, args.keys, **kwargs)
+			print("{:>16}: {:>7.0f} messages/s".format(name, rate))
+	finally:
+		server.stop()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,53 @@
+"""Benchmark for packing FieldTables of increasing size, comparing the previous
+encoder (string concatenation, per-value coercion and per-name validation) against the current one.
+
+Run from the repository root: python benchmarks/bench_fieldtable.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import repo_path
+
+from grabbit.frames.datatypes import DataType, LongString
+from grabbit.frames.fieldtable import FieldTable, FieldName, FIELD_SPECIFIERS, field_type_coerce
+
+
+def reference_pack(value):
+	"""The previous FieldTable.pack()"""
+	payload = b''
+	for name, item in value.items():
+		if not isinstance(item, DataType):
+			item = field_type_coerce(item)
+		if isinstance(item, FieldTable):
+			packed = reference_pack(item.value)
+		else:
+			packed = item.pack()
+		payload += FieldName(name).pack() + FIELD_SPECIFIERS[type(item)] + packed
+	return LongString(payload).pack()
+
+
+def make_table(size):
+	table = {}
+	for n in range(size):
+		table['x-header-{}'.format(n).replace('-', '_')] = [
+			'value {}'.format(n).encode('ascii'), n, n * 0.5, n % 2 == 0, {'inner': n},
+		][n % 5]
+	return table
+
+
+def main():
+	print("{:>8} {:>16} {:>16} {:>8}".format('entries', 'reference (us)', 'current (us)', 'speedup'))
+	for size in (10, 100, 1000):
+		table = make_table(size)
+		assert FieldTable.unpack_from(reference_pack(table))[0].get_value() == table
+		assert FieldTable.unpack_from(FieldTable(table).pack())[0].get_value() == table
+		number = max(10, 20000 // size)
+		reference = timeit.timeit(lambda: reference_pack(table), number=number) * 1e6 / number
+		current = timeit.timeit(lambda: FieldTable(table).pack(), number=number) * 1e6 / number
+		print("{:>8} {:>16.1f} {:>16.1f} {:>7.1f}x".format(size, reference, current, reference / current))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,131 @@
+"""Benchmark for head-of-line blocking: how long small messages on one channel are delayed while
+a large message is being sent on another, comparing:
+	lock: each message's frames sent with one send_buffers() under a lock, as Connection.send_frames()
+		did before Writer, so a small message waits for the whole large one
+	writer: a protocol.writer.Writer, which interleaves the channels' frames
+
+One greenlet publishes --count bodies of --size MB on channel 1, while another publishes a small
+message on channel 2 every --interval seconds, containing the time it was sent. The other end of
+a local TCP connection decodes the frames and records the latency of each small message.
+
+With the defaults (3 x 100MB), the worst small message latency is about 300-600ms with lock, ie. the time
+to send a whole large message, and about 5-20ms with writer, with the same bulk throughput.
+
+Run from the repository root:
+	python benchmarks/bench_head_of_line.py [--size MB] [--count N] [--interval SECONDS]
+"""
+
+from __future__ import print_function
+
+import argparse
+import struct
+import time
+
+import gevent
+from gevent import socket
+from gevent.lock import Semaphore
+
+import repo_path
+
+from grabbit.frames import Frame, FrameReader
+from grabbit.frames.content import content_frames
+from grabbit.frames.frame import send_buffers
+from grabbit.methods import basic
+from grabbit.protocol.writer import Writer
+
+
+FRAME_SIZE_MAX = 131072
+
+
+def message_frames(channel, body):
+	method = basic.Publish(exchange='exchange', routing_key='key', mandatory=False, immediate=False)
+	return [Frame(Frame.METHOD_TYPE, channel, method)] + list(content_frames(channel, basic.CLASS_ID, {}, body, FRAME_SIZE_MAX))
+
+
+def sender(mode, sock):
+	"""Returns a function which sends a list of frames in the given mode"""
+	if mode == 'lock':
+		lock = Semaphore()
+		def send(frames):
+			buffers = [buf for frame in frames for buf in frame.pack_buffers()]
+			with lock:
+				send_buffers(sock, buffers)
+		return send
+	return Writer(sock).write
+
+
+def percentile(values, fraction):
+	return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(mode, size, count, interval):
+	listener = socket.socket()
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+	client = socket.create_connection(listener.getsockname())
+	server, _ = listener.accept()
+	send = sender(mode, client)
+	latencies = []
+	finished = [] # the time the last large message was received
+
+	def receive():
+		reader = FrameReader(lazy=True)
+		bulk = 0 # large messages received
+		remaining = size # of the current large message
+		# small messages held up by the last large one are still counted, up to the first sent after it
+		while True:
+			reader.feed(server.recv(2**20))
+			for frame in reader:
+				if frame.type != Frame.BODY_TYPE:
+					continue
+				if frame.channel == 2:
+					sent, = struct.unpack('!d', frame.payload.value)
+					latencies.append(time.time() - sent)
+					if finished and sent > finished[0]:
+						return
+					continue
+				remaining -= len(frame.payload.value)
+				if remaining <= 0:
+					bulk += 1
+					remaining = size
+					if bulk == count:
+						finished.append(time.time())
+
+	def publish_small():
+		while not receiver.ready():
+			send(message_frames(2, struct.pack('!d', time.time())))
+			gevent.sleep(interval)
+
+	body = b'x' * size
+	receiver = gevent.spawn(receive)
+	small = gevent.spawn(publish_small)
+	gevent.sleep(interval * 10)
+	start = time.time()
+	for _ in range(count):
+		send(message_frames(1, body))
+	receiver.get()
+	small.join()
+	elapsed = finished[0] - start
+	for sock in (client, server, listener):
+		sock.close()
+	return latencies, elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--size', type=int, default=100, help='Large message body size in MB')
+	parser.add_argument('--count', type=int, default=3, help='Number of large messages')
+	parser.add_argument('--interval', type=float, default=0.001, help='Seconds between small messages')
+	args = parser.parse_args()
+	size = args.size * 2**20
+	print("{} x {}MB messages, with a small message every {}s:".format(args.count, args.size, args.interval))
+	for mode in ('lock', 'writer'):
+		latencies, elapsed = run(mode, size, args.count, args.interval)
+		print("{:>8}: small message latency p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms; bulk {:.0f}MB/s".format(
+			mode, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+			max(latencies) * 1000, args.count * args.size / elapsed,
+		))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,67 @@
+"""Compares codec throughput across python interpreters, by running suite.py under each one
+and printing the ops/sec of every op side by side, relative to the first interpreter.
+
+Run from the repository root:
+	python benchmarks/bench_interpreters.py [--python EXECUTABLE ...] [--filter SUBSTRING] [--quick]
+The default is to compare python2 and python3, as found on the PATH.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'suite.py')
+
+
+def run_suite(python, path, args):
+	"""Runs suite.py with the given interpreter, returning its JSON output"""
+	with open(os.devnull, 'w') as devnull:
+		subprocess.check_call([python, SUITE, '--output', path] + args, stdout=devnull)
+	with open(path) as f:
+		return json.load(f)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--python', action='append', help='Interpreter to run the suite with. May be repeated.')
+	parser.add_argument('--filter', help='Only run ops whose name contains this')
+	parser.add_argument('--quick', action='store_true', help='Time each op only briefly, for checking this works')
+	args = parser.parse_args()
+
+	pythons = args.python or ['python2', 'python3']
+	suite_args = (['--filter', args.filter] if args.filter else []) + (['--quick'] if args.quick else [])
+	tempdir = tempfile.mkdtemp(prefix='grabbit-bench-')
+	try:
+		runs = []
+		for n, python in enumerate(pythons):
+			print("running suite with {}...".format(python), file=sys.stderr)
+			runs.append(run_suite(python, os.path.join(tempdir, '{}.json'.format(n)), suite_args))
+	finally:
+		shutil.rmtree(tempdir)
+
+	for python, run in zip(pythons, runs):
+		print("{}: {} {}".format(python, run['implementation'], run['python'].split()[0]))
+	names = ['{} {}'.format(run['implementation'], run['python'].split()[0]) for run in runs]
+	print("{:<24} {}".format('op (ops/s)', ' '.join('{:>22}'.format(name) for name in names)))
+	first = runs[0]['results']
+	for op in sorted(first):
+		cells = []
+		for run in runs:
+			result = run['results'].get(op)
+			if result is None:
+				cells.append('{:>22}'.format('-'))
+				continue
+			ops = result['ops_per_sec']
+			cells.append('{:>12.0f} ({:>6.2f}x)'.format(ops, ops / first[op]['ops_per_sec']))
+		print("{:<24} {}".format(op, ' '.join(cells)))
+
+
+if __name__ == '__main__':
+	main()
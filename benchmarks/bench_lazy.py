@@ -0,0 +1,51 @@
+"""Benchmark for the consume hot path, comparing eager and lazy frame decoding.
+
+Decodes a basic.Deliver method frame, a content header with a table of headers and a body frame,
+then reads only the body, the delivery_tag and one header, as a typical handler would.
+
+Run from the repository root: python benchmarks/bench_lazy.py [--headers N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+import repo_path
+
+from grabbit.frames import Frame
+from grabbit.methods import basic
+
+
+NUMBER = 20000
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--headers', type=int, default=20, help='Number of entries in the headers table')
+	args = parser.parse_args()
+
+	headers = {'header{}'.format(n): 'value{}'.format(n) for n in range(args.headers)}
+	properties = {'content_type': 'application/json', 'delivery_mode': 2, 'message_id': 'abc', 'headers': headers}
+	data = b''.join(frame.pack() for frame in [
+		Frame(Frame.METHOD_TYPE, 1, basic.Deliver('ctag', 1234, exchange='ex', routing_key='key', redelivered=False)),
+		Frame(Frame.HEADER_TYPE, 1, basic.CLASS_ID, 5, properties),
+		Frame(Frame.BODY_TYPE, 1, b'{"a":1}'),
+	])
+
+	def consume(lazy):
+		method, offset = Frame.unpack_from(data, 0, lazy=lazy)
+		header, offset = Frame.unpack_from(data, offset, lazy=lazy)
+		body, offset = Frame.unpack_from(data, offset, lazy=lazy)
+		return body.payload.value, method.payload.method.delivery_tag, header.payload.properties.headers.get('header0')
+
+	assert consume(False) == consume(True)
+	results = {}
+	for lazy in (False, True):
+		results[lazy] = timeit.timeit(lambda: consume(lazy), number=NUMBER) * 1e6 / NUMBER
+		print("{:>6}: {:.2f}us per message".format('lazy' if lazy else 'eager', results[lazy]))
+	print("speedup: {:.1f}x".format(results[False] / results[True]))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,71 @@
+"""Measures the memory used by each decoded basic.Deliver method frame and content header frame,
+as kept for in-flight messages, and the time taken to access their fields.
+
+Memory is the total sys.getsizeof() of every object reachable from the decoded frames, other than
+classes and modules, averaged over many messages. Objects shared between messages (eg. interned
+strings) are only counted once, so contribute little to the average.
+
+Run from the repository root: python benchmarks/bench_memory.py
+"""
+
+from __future__ import print_function
+
+import gc
+import sys
+import timeit
+import types
+
+import repo_path
+
+from grabbit.frames import Frame
+from grabbit.methods import basic
+
+
+MESSAGES = 1000
+NUMBER = 200000
+
+
+def deep_size(roots, seen):
+	"""Total size of all objects reachable from roots and not already in seen"""
+	size = 0
+	pending = list(roots)
+	while pending:
+		obj = pending.pop()
+		if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType)):
+			continue
+		seen.add(id(obj))
+		size += sys.getsizeof(obj)
+		pending.extend(gc.get_referents(obj))
+	return size
+
+
+def decode(delivery_tag):
+	data = b''.join(frame.pack() for frame in [
+		Frame(Frame.METHOD_TYPE, 1, basic.Deliver('amq.ctag-0123456789', delivery_tag, exchange='exchange',
+		                                          routing_key='some.routing.key', redelivered=False)),
+		Frame(Frame.HEADER_TYPE, 1, basic.CLASS_ID, 1024, {
+			'content_type': 'application/json', 'delivery_mode': 2, 'priority': 1,
+			'message_id': 'message-{}'.format(delivery_tag), 'timestamp': 1400000000,
+		}),
+	])
+	method, offset = Frame.unpack_from(data)
+	header, offset = Frame.unpack_from(data, offset)
+	return method, header
+
+
+def main():
+	messages = [decode(n) for n in range(MESSAGES)]
+	size = deep_size(messages, {id(messages)})
+	print("memory: {:.0f} bytes per decoded Deliver and content header frame".format(float(size) / MESSAGES))
+
+	method, header = messages[0]
+	for name, fn in [
+		('delivery_tag', lambda: method.payload.method.delivery_tag),
+		('redelivered', lambda: method.payload.method.redelivered),
+		('message_id', lambda: header.payload.properties.message_id),
+	]:
+		print("{:>12}: {:.3f}us per access".format(name, timeit.timeit(fn, number=NUMBER) * 1e6 / NUMBER))
+
+
+if __name__ == '__main__':
+	main()
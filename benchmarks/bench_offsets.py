@@ -0,0 +1,33 @@
+"""Microbenchmark showing that decoding cost is linear in the size of the data.
+
+Decodes FieldTables of increasing size, and reports the cost per entry, which should stay
+roughly constant now that decoding works on offsets into the original buffer instead of
+repeatedly slicing off the remaining data.
+
+Run from the repository root: python benchmarks/bench_offsets.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import repo_path
+
+from grabbit.frames.fieldtable import FieldTable
+
+
+SIZES = [10, 100, 1000, 10000]
+
+
+def main():
+	print("{:>8} {:>12} {:>18}".format('entries', 'bytes', 'per entry (us)'))
+	for size in SIZES:
+		table = FieldTable({'header{}'.format(n): 'value{}'.format(n) for n in range(size)})
+		data = table.pack()
+		number = max(1, 100000 // size)
+		elapsed = timeit.timeit(lambda: FieldTable.unpack(data), number=number)
+		print("{:>8} {:>12} {:>18.3f}".format(size, len(data), elapsed * 1e6 / number / size))
+
+
+if __name__ == '__main__':
+	main()
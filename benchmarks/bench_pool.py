@@ -0,0 +1,83 @@
+"""Benchmark for protocol.ChannelPool, timing one synchronous operation (a queue.Declare) done:
+	alone, on a channel kept open for it,
+	on a channel opened for it and closed after, as without a pool,
+	on a channel leased from a ChannelPool.
+Operations run against the FakeServer used by the tests, with --concurrency greenlets doing --count each.
+
+With the defaults, a leased channel takes about 1.0-1.1x as long per operation as the operation alone,
+against about 3x for opening and closing a channel around it on CPython 3.11 and 6-8x on 2.7 (where
+the FakeServer's handling of Open and Close is slower still). Against a real broker,
+where each round trip costs far more than the client's work, the difference is closer to one round trip
+against three.
+
+Run from the repository root:
+	python benchmarks/bench_pool.py [--count N] [--concurrency N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from gevent.pool import Pool
+
+import repo_path
+
+from grabbit.methods import queue
+from grabbit.protocol import ChannelPool
+from grabbit.protocol.tests.common import FakeServer
+
+
+def declare(channel):
+	channel.call(queue.Declare(name='q', passive=False, durable=False, exclusive=False, autodelete=False,
+	                           nowait=False, arguments={}))
+
+
+def alone(conn, count):
+	channel = conn.channel()
+	for _ in range(count):
+		declare(channel)
+	channel.close()
+
+
+def open_and_close(conn, count):
+	for _ in range(count):
+		channel = conn.channel()
+		declare(channel)
+		channel.close()
+
+
+def leased(pool):
+	def run(conn, count):
+		for _ in range(count):
+			with pool.lease() as channel:
+				declare(channel)
+	return run
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--count', type=int, default=2000, help='Operations per greenlet')
+	parser.add_argument('--concurrency', type=int, default=4, help='Greenlets doing operations at once')
+	args = parser.parse_args()
+	server = FakeServer()
+	try:
+		conn = server.connect()
+		pool = ChannelPool(conn, prefill={'plain': args.concurrency})
+		baseline = None
+		for name, run in (('alone', alone), ('open and close', open_and_close), ('leased', leased(pool))):
+			workers = Pool(args.concurrency)
+			start = time.time()
+			for _ in range(args.concurrency):
+				workers.spawn(run, conn, args.count)
+			workers.join(raise_error=True)
+			per_op = (time.time() - start) / (args.count * args.concurrency)
+			baseline = baseline or per_op
+			print("{:>16}: {:>7.1f}us per operation ({:.2f}x)".format(name, per_op * 1e6, per_op / baseline))
+		conn.close()
+	finally:
+		server.stop()
+
+
+if __name__ == '__main__':
+	main()
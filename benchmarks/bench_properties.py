@@ -0,0 +1,48 @@
+"""Microbenchmark comparing the compiled BasicProperties codecs against the reference implementation,
+for some common sets of properties.
+
+Run from the repository root: python benchmarks/bench_properties.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import repo_path
+
+from grabbit.methods.basic import BasicProperties
+
+
+NUMBER = 20000
+
+
+def bench(fn):
+	return timeit.timeit(fn, number=NUMBER) * 1e6 / NUMBER
+
+
+def main():
+	shapes = [
+		('persistent', {'delivery_mode': 2}),
+		('json', {'content_type': 'application/json', 'delivery_mode': 2}),
+		('full', {
+			'content_type': 'application/json', 'content_encoding': 'gzip', 'delivery_mode': 2, 'priority': 1,
+			'correlation_id': 'abc', 'reply_to': 'reply.queue', 'message_id': 'message-1', 'timestamp': 1400000000,
+			'type': 'event', 'app_id': 'bench',
+		}),
+	]
+	print("{:>10} {:>8} {:>16} {:>16} {:>8}".format('shape', 'op', 'reference (us)', 'compiled (us)', 'speedup'))
+	for name, values in shapes:
+		properties = BasicProperties(values)
+		data = properties.pack()
+		for op, reference, compiled in [
+			('encode', properties.reference_pack, properties.pack),
+			('decode', lambda: BasicProperties.reference_unpack(data), lambda: BasicProperties.unpack_from(data)),
+		]:
+			reference_time, compiled_time = bench(reference), bench(compiled)
+			print("{:>10} {:>8} {:>16.3f} {:>16.3f} {:>7.1f}x".format(
+				name, op, reference_time, compiled_time, reference_time / compiled_time,
+			))
+
+
+if __name__ == '__main__':
+	main()
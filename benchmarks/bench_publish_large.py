@@ -0,0 +1,86 @@
+"""Benchmark for publishing a large message body, comparing packing every frame into one string
+(the naive approach) against Frame.pack_buffers() and send_buffers(), which never copy the body.
+
+Each approach runs in its own subprocess so that peak RSS can be measured independently.
+Frames are sent over a socketpair, the other end of which is drained by a thread.
+
+Run from the repository root: python benchmarks/bench_publish_large.py [--size MB] [--count N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import resource
+import socket
+import subprocess
+import sys
+import threading
+
+import repo_path
+
+from grabbit.frames import Frame
+from grabbit.frames.frame import send_buffers
+from grabbit.methods import basic
+
+
+FRAME_SIZE_MAX = 131072
+
+
+def message_frames(body):
+	"""Returns the frames for publishing body"""
+	method = basic.Publish(exchange='exchange', routing_key='key', mandatory=False, immediate=False)
+	yield Frame(Frame.METHOD_TYPE, 1, method)
+	yield Frame(Frame.HEADER_TYPE, 1, basic.CLASS_ID, len(body), {'content_type': 'application/octet-stream'})
+	step = FRAME_SIZE_MAX - 8
+	for start in range(0, len(body), step):
+		yield Frame(Frame.BODY_TYPE, 1, body[start:start + step])
+
+
+def publish_naive(sock, body):
+	sock.sendall(b''.join(frame.pack() for frame in message_frames(body)))
+
+
+def publish_buffers(sock, body):
+	for frame in message_frames(memoryview(body)):
+		send_buffers(sock, frame.pack_buffers())
+
+
+def drain(sock):
+	buf = bytearray(2**20)
+	while sock.recv_into(buf):
+		pass
+
+
+def run(mode, size, count):
+	body = b'x' * size
+	publish = {'naive': publish_naive, 'buffers': publish_buffers}[mode]
+	client, server = socket.socketpair()
+	drainer = threading.Thread(target=drain, args=(server,))
+	drainer.start()
+	before = resource.getrusage(resource.RUSAGE_SELF)
+	for _ in range(count):
+		publish(client, body)
+	after = resource.getrusage(resource.RUSAGE_SELF)
+	client.close()
+	drainer.join()
+	cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+	# ru_maxrss is in KB on linux
+	print("{:>8}: peak RSS {:.1f}MB, CPU {:.3f}s per message".format(mode, after.ru_maxrss / 1024., cpu / count))
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--size', type=int, default=50, help='Message body size in MB')
+	parser.add_argument('--count', type=int, default=5, help='Number of messages to publish')
+	parser.add_argument('--mode', help=argparse.SUPPRESS)
+	args = parser.parse_args()
+	if args.mode:
+		run(args.mode, args.size * 2**20, args.count)
+		return
+	print("body size {}MB:".format(args.size))
+	for mode in ('naive', 'buffers'):
+		subprocess.check_call([sys.executable, __file__, '--mode', mode, '--size', str(args.size), '--count', str(args.count)])
+
+
+if __name__ == '__main__':
+	main()
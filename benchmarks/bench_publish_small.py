@@ -0,0 +1,126 @@
+"""Benchmark for publishing many small messages from many greenlets at once, comparing how
+outgoing frames are written to the socket:
+	frame: one sendall() per frame (method, header and body), under a lock
+	message: one send_buffers() per message, under a lock, as Connection.send_frames() did before Writer
+	latency, throughput: a protocol.writer.Writer with that profile, which coalesces the frames
+		queued by every greenlet into one write
+
+Each message's frames are packed once up front, so that this measures the cost of writing them
+rather than of encoding them (see suite.py for that). Frames are sent over a local TCP connection,
+the other end of which is drained by a greenlet, and the time is until every byte has been received.
+
+With the defaults (500 greenlets, 32 byte bodies), the Writer profiles run at about 3-4x the messages/s
+of per-frame writes on CPython 3.11 and 2.7, and 1.3-1.5x that of one write per message. Before Writer
+scheduled frames by channel and priority (see bench_head_of_line.py) it was about 10x, as queueing was
+only a list append. Most of the time now goes on queueing each message in python, not on syscalls.
+
+Run from the repository root:
+	python benchmarks/bench_publish_small.py [--greenlets N] [--messages N] [--size BYTES]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import gevent
+from gevent import socket
+from gevent.lock import Semaphore
+
+import repo_path
+
+from grabbit.frames import Frame
+from grabbit.frames.content import content_frames
+from grabbit.frames.frame import send_buffers
+from grabbit.methods import basic
+from grabbit.protocol.writer import Writer, get_profile, set_nodelay
+
+
+class PackedFrame(Frame):
+	"""A Frame which was packed up front, and returns the same bytes from every pack_buffers()"""
+	__slots__ = ('packed',)
+
+	@classmethod
+	def from_frame(cls, frame):
+		self = cls.__new__(cls)
+		self.type, self.channel, self.payload = frame.type, frame.channel, frame.payload
+		self.packed = frame.pack()
+		return self
+
+	def pack_buffers(self):
+		return [self.packed]
+
+
+def message_frames(body):
+	"""Returns the PackedFrames of publishing body"""
+	method = basic.Publish(exchange='exchange', routing_key='key', mandatory=False, immediate=False)
+	frames = [Frame(Frame.METHOD_TYPE, 1, method)] + list(content_frames(1, basic.CLASS_ID, {'delivery_mode': 2}, body))
+	return [PackedFrame.from_frame(frame) for frame in frames]
+
+
+def sender(mode, sock):
+	"""Returns a function which sends a list of PackedFrames in the given mode, and one which waits
+	until they've all been sent"""
+	if mode in ('frame', 'message'):
+		set_nodelay(sock, True)
+		lock = Semaphore()
+		def send(frames):
+			if mode == 'frame':
+				for frame in frames:
+					with lock:
+						sock.sendall(frame.packed)
+			else:
+				with lock:
+					send_buffers(sock, [frame.packed for frame in frames])
+		return send, lambda: None
+	set_nodelay(sock, get_profile(mode).nodelay)
+	writer = Writer(sock, mode)
+	return writer.write, writer.flush
+
+
+def run(mode, greenlets, messages, body):
+	listener = socket.socket()
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(1)
+	client = socket.create_connection(listener.getsockname())
+	server, _ = listener.accept()
+	frames = message_frames(body)
+	expected = greenlets * messages * sum(len(frame.packed) for frame in frames)
+	def drain():
+		received = 0
+		buf = bytearray(2**20)
+		while received < expected:
+			received += server.recv_into(buf)
+	send, flush = sender(mode, client)
+	def publish():
+		for _ in range(messages):
+			send(frames)
+	start = time.time()
+	drainer = gevent.spawn(drain)
+	gevent.joinall([gevent.spawn(publish) for _ in range(greenlets)], raise_error=True)
+	flush()
+	drainer.get()
+	elapsed = time.time() - start
+	for sock in (client, server, listener):
+		sock.close()
+	return elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--greenlets', type=int, default=500, help='Number of greenlets publishing at once')
+	parser.add_argument('--messages', type=int, default=100, help='Messages published by each greenlet')
+	parser.add_argument('--size', type=int, default=32, help='Message body size in bytes')
+	args = parser.parse_args()
+	count = args.greenlets * args.messages
+	print("{} greenlets publishing {} messages of {} bytes:".format(args.greenlets, count, args.size))
+	baseline = None
+	for mode in ('frame', 'message', 'latency', 'throughput'):
+		elapsed = run(mode, args.greenlets, args.messages, b'x' * args.size)
+		rate = count / elapsed
+		baseline = baseline or rate
+		print("{:>10}: {:>8.0f} messages/s ({:.1f}x)".format(mode, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,48 @@
+"""Benchmark for the publish hot path, comparing packing the method and content frames for each message
+against a PublishTemplate that pre-encodes them.
+
+Run from the repository root: python benchmarks/bench_publish_template.py
+"""
+
+from __future__ import print_function
+
+import time
+import timeit
+
+import repo_path
+
+from grabbit.frames import Frame
+from grabbit.frames.content import content_frames
+from grabbit.methods import basic
+from grabbit.methods.publish import PublishTemplate
+
+
+NUMBER = 20000
+
+
+def main():
+	properties = {'content_type': 'application/json', 'delivery_mode': 2, 'app_id': 'bench'}
+	body = b'{"a": 1}'
+	method = basic.Publish(exchange='exchange', routing_key='some.routing.key', mandatory=False, immediate=False)
+
+	def naive(timestamp):
+		values = dict(properties, timestamp=timestamp)
+		frames = [Frame(Frame.METHOD_TYPE, 1, method)] + list(content_frames(1, basic.CLASS_ID, values, body))
+		return b''.join(frame.pack() for frame in frames)
+
+	template = PublishTemplate('exchange', 'some.routing.key', properties=properties, variable=['timestamp'])
+	now = int(time.time())
+	assert naive(now) == template.pack(1, body, timestamp=now)
+
+	results = {}
+	for name, fn in [
+		('naive', lambda: naive(now)),
+		('template', lambda: template.pack_buffers(1, body, timestamp=now)),
+	]:
+		results[name] = timeit.timeit(fn, number=NUMBER) * 1e6 / NUMBER
+		print("{:>8}: {:.2f}us per message".format(name, results[name]))
+	print("speedup: {:.1f}x".format(results['naive'] / results['template']))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,113 @@
+"""Benchmark for protocol.QosController, simulating a consumer with --workers greenlets each taking
+--service-time seconds per delivery, behind a broker --rtt seconds away that keeps at most prefetch_count
+deliveries unacked. Compares fixed prefetch counts against the controller, printing for each the
+deliveries handled per second and the mean time a delivery spent waiting in the client's queue for a worker
+(deliveries the broker has sent but no worker can handle yet, which another consumer could have had).
+
+With the defaults (4 workers, 10ms service, 20ms rtt) a prefetch of 1 manages about 30 deliveries/s, and
+one of 1000 about 370/s (near the workers' limit of 400/s) but with deliveries waiting about 1.9s.
+The controller averages about 310-320/s, most of the shortfall being its first second or so growing from
+a prefetch of 1, with waits of about 15ms, settling on a prefetch of about 18-19 (CPython 2.7 and 3.11).
+
+Run from the repository root:
+	python benchmarks/bench_qos.py [--workers N] [--service-time S] [--rtt S] [--duration S]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
+
+import repo_path
+
+from grabbit.methods import basic
+from grabbit.protocol import Message, QosController
+
+
+class SimulatedChannel(object):
+	"""Stands in for a Channel on a broker rtt seconds away, delivering while fewer than prefetch_count
+	deliveries are unacked"""
+
+	def __init__(self, rtt, prefetch_count):
+		self.rtt = rtt
+		self.prefetch_count = prefetch_count
+		self.error = None
+		self.close_callbacks = []
+		self.queue = Queue()
+		self.unacked = 0
+		self.next_tag = 1
+		self.room = Event()
+		self.room.set()
+
+	def call(self, method):
+		gevent.sleep(self.rtt)
+		if isinstance(method, basic.Qos):
+			self.prefetch_count = method.prefetch_count
+			self.room.set()
+
+	def ack(self):
+		gevent.spawn_later(self.rtt / 2, self._acked)
+
+	def _acked(self):
+		self.unacked -= 1
+		self.room.set()
+
+	def run_broker(self):
+		while True:
+			self.room.wait()
+			while self.unacked < self.prefetch_count:
+				self.unacked += 1
+				method = basic.Deliver(consumer_tag='c', delivery_tag=self.next_tag, exchange='', routing_key='q',
+				                       redelivered=False)
+				self.next_tag += 1
+				gevent.spawn_later(self.rtt / 2, self.queue.put, (Message(method, {}, b''), time.time() + self.rtt / 2))
+			self.room.clear()
+
+
+def run(args, prefetch_count=None):
+	channel = SimulatedChannel(args.rtt, prefetch_count or 1)
+	controller = None
+	if prefetch_count is None:
+		controller = QosController(channel, min_prefetch=1, max_prefetch=1000, interval=0.2)
+	stats = {'handled': 0, 'waited': 0.0}
+
+	def worker():
+		while True:
+			message, arrived = channel.queue.get()
+			stats['waited'] += time.time() - arrived
+			if controller is not None:
+				controller.handle(message, lambda message: gevent.sleep(args.service_time))
+			else:
+				gevent.sleep(args.service_time)
+			stats['handled'] += 1
+			channel.ack()
+
+	greenlets = [gevent.spawn(channel.run_broker)] + [gevent.spawn(worker) for _ in range(args.workers)]
+	gevent.sleep(args.duration)
+	gevent.killall(greenlets)
+	if controller is not None:
+		controller.stop()
+		prefetch_count = controller.prefetch_count
+	return stats['handled'] / args.duration, stats['waited'] / max(stats['handled'], 1), prefetch_count
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--workers', type=int, default=4, help='Greenlets handling deliveries')
+	parser.add_argument('--service-time', type=float, default=0.01, help='Seconds to handle each delivery')
+	parser.add_argument('--rtt', type=float, default=0.02, help='Round trip time to the broker, in seconds')
+	parser.add_argument('--duration', type=float, default=5, help='Seconds to run each case for')
+	args = parser.parse_args()
+	for name, prefetch_count in (('prefetch 1', 1), ('prefetch 1000', 1000), ('adaptive', None)):
+		rate, waited, prefetch_count = run(args, prefetch_count)
+		print("{:>16}: {:>6.0f} deliveries/s, {:>8.2f}ms mean wait, final prefetch {}".format(
+			name, rate, waited * 1000, prefetch_count,
+		))
+
+
+if __name__ == '__main__':
+	main()
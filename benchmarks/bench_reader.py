@@ -0,0 +1,112 @@
+"""Benchmark for reading a recorded stream of frames, comparing FrameReader against a naive loop
+which concatenates received chunks and calls Frame.unpack() on the result.
+
+The stream is a mix of basic.Deliver method, content header and body frames, read from a file
+in fixed-size chunks as if from a socket. By default a stream of 64MB is generated in a temporary
+file; use --size to change this (eg. --size 1024 for 1GB) or --file to read an existing stream.
+
+The naive loop's cost grows with the square of the frame size divided by the chunk size,
+so the difference is most visible with large frames (--frame-size) and small chunks (--chunk).
+
+Run from the repository root:
+	python benchmarks/bench_reader.py [--size MB] [--chunk BYTES] [--frame-size BYTES] [--file PATH]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import tempfile
+import time
+
+import repo_path
+
+from grabbit.frames import Frame, FrameReader, Incomplete
+from grabbit.methods import basic
+
+
+def message_frames(delivery_tag, body_size, frame_size_max):
+	"""Returns the packed frames for a single delivered message"""
+	method = basic.Deliver('ctag', delivery_tag, exchange='exchange', routing_key='key', redelivered=False)
+	frames = [
+		Frame(Frame.METHOD_TYPE, 1, method),
+		Frame(Frame.HEADER_TYPE, 1, basic.CLASS_ID, body_size, {'content_type': 'text/plain'}),
+	]
+	body_frame_size = frame_size_max - 8
+	for start in range(0, body_size, body_frame_size):
+		frames.append(Frame(Frame.BODY_TYPE, 1, b'x' * min(body_frame_size, body_size - start)))
+	return b''.join(frame.pack() for frame in frames)
+
+
+def generate(path, size, frame_size_max):
+	# a mix of small messages and a few large ones that span several frames
+	block = b''.join(message_frames(n, body_size, frame_size_max) for n, body_size in enumerate(
+		[16] * 500 + [1024] * 100 + [3 * frame_size_max]
+	))
+	with open(path, 'wb') as f:
+		for _ in range(max(1, size // len(block))):
+			f.write(block)
+
+
+def chunks(path, chunk_size):
+	with open(path, 'rb') as f:
+		while True:
+			chunk = f.read(chunk_size)
+			if not chunk:
+				return
+			yield chunk
+
+
+def read_with_reader(path, chunk_size):
+	reader = FrameReader()
+	count = 0
+	for chunk in chunks(path, chunk_size):
+		reader.feed(chunk)
+		for frame in reader:
+			count += 1
+	return count
+
+
+def read_naive(path, chunk_size):
+	data = b''
+	count = 0
+	for chunk in chunks(path, chunk_size):
+		data += chunk
+		while True:
+			try:
+				frame, data = Frame.unpack(data)
+			except Incomplete:
+				break
+			count += 1
+	return count
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--size', type=int, default=64, help='Size of generated stream in MB')
+	parser.add_argument('--chunk', type=int, default=65536, help='Bytes per simulated recv()')
+	parser.add_argument('--frame-size', type=int, default=131072, help='Max frame size in generated stream')
+	parser.add_argument('--file', help='Use this existing stream instead of generating one')
+	args = parser.parse_args()
+
+	path = args.file
+	if not path:
+		fd, path = tempfile.mkstemp(prefix='grabbit-bench-')
+		os.close(fd)
+		generate(path, args.size * 2**20, args.frame_size)
+	try:
+		size = os.path.getsize(path)
+		for name, fn in [('FrameReader', read_with_reader), ('naive', read_naive)]:
+			start = time.time()
+			count = fn(path, args.chunk)
+			elapsed = time.time() - start
+			print("{:>12}: {} frames, {:.1f}MB in {:.2f}s: {:.1f}MB/s, {:.0f} frames/s".format(
+				name, count, size / 2.**20, elapsed, size / 2.**20 / elapsed, count / elapsed
+			))
+	finally:
+		if not args.file:
+			os.remove(path)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,109 @@
+"""Benchmark for protocol.Recovery, against a FakeServer (as used by the tests) which takes --delay seconds
+to reply to each method, like a broker --delay seconds of round trip away. A connection declares --queues
+queues, each bound to an exchange and consumed from on one of --channels channels (with a Qos each).
+The connection is then dropped, and the time until Recovery has every consumer registered again is
+compared with the time it took to set up, calling each method in turn, as a simple reconnect handler would.
+
+With the defaults (2ms delay, 100 queues on 10 channels), calling each method in turn takes about 0.85s,
+and Recovery 35-60ms (CPython 3.11 and 2.7). With --delay 0.01 that's 3.6s against about 70ms, most of which
+is the half dozen round trips Recovery needs however many queues there are; with 1000 queues on 50 channels,
+8.5s against 0.3s, where it's the FakeServer's CPU time that counts.
+Heartbeats aren't involved: recovery starts as soon as the socket is closed, and the new connection
+negotiates them afresh.
+
+Run from the repository root:
+	python benchmarks/bench_recovery.py [--queues N] [--channels N] [--delay S]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import gevent
+from gevent import socket
+
+import repo_path
+
+from grabbit.methods import basic, channel as channel_methods, exchange, queue
+from grabbit.protocol import Recovery
+from grabbit.protocol.channel import expects_response
+from grabbit.protocol.tests.common import FakeServer
+
+
+def delayed(delay, response):
+	"""A handler which replies after delay seconds, without holding up the methods after it"""
+	def handler(server, channel, method):
+		if expects_response(method):
+			sock = server.socks[-1]
+			# replies are sent one at a time, which Nagle's algorithm would hold up
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			gevent.spawn_later(delay, server.send, channel, response(method), sock=sock)
+		return []
+	return handler
+
+
+def methods(queues):
+	"""Returns (topology methods, [consumes]) for each queue"""
+	topology = [exchange.Declare(name='ex', type='topic', passive=False, durable=False, autodelete=False,
+	                             internal=False, nowait=False, arguments={})]
+	consumes = []
+	for n in range(queues):
+		name = 'q{}'.format(n)
+		topology.append(queue.Declare(name=name, passive=False, durable=False, exclusive=False,
+		                              autodelete=False, nowait=False, arguments={}))
+		topology.append(queue.Bind(queue=name, exchange='ex', routing_key=name, nowait=False, arguments={}))
+		consumes.append(basic.Consume(queue=name, consumer_tag='c{}'.format(n), no_local=False, no_ack=False,
+		                              exclusive=False, no_wait=False, arguments={}))
+	return topology, consumes
+
+
+def set_up(conn, topology, consumes, channels):
+	"""Sets up topology and consumes on conn, returning the channels consuming"""
+	channel = conn.channel()
+	for method in topology:
+		channel.call(method)
+	channel.close()
+	consumers = [conn.channel() for _ in range(channels)]
+	for consumer in consumers:
+		consumer.call(basic.Qos(0, 10, **{'global': False}))
+	for n, consume in enumerate(consumes):
+		consumers[n % channels].call(consume)
+	return consumers
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--queues', type=int, default=100, help='Queues declared, bound and consumed from')
+	parser.add_argument('--channels', type=int, default=10, help='Channels the consumers are spread over')
+	parser.add_argument('--delay', type=float, default=0.002, help="Seconds the server takes to reply")
+	args = parser.parse_args()
+	server = FakeServer({
+		channel_methods.Open: delayed(args.delay, lambda method: channel_methods.OpenOk()),
+		exchange.Declare: delayed(args.delay, lambda method: exchange.DeclareOk()),
+		queue.Declare: delayed(args.delay, lambda method: queue.DeclareOk(method.name, 0, 0)),
+		queue.Bind: delayed(args.delay, lambda method: queue.BindOk()),
+		basic.Qos: delayed(args.delay, lambda method: basic.QosOk()),
+		basic.Consume: delayed(args.delay, lambda method: basic.ConsumeOk(method.consumer_tag)),
+	})
+	topology, consumes = methods(args.queues)
+	try:
+		conn = server.connect()
+		recovery = Recovery(conn) # records as it's set up
+		start = time.time()
+		set_up(conn, topology, consumes, args.channels)
+		print("{:>16}: {:>8.3f}s".format('one at a time', time.time() - start))
+
+		server.drop()
+		while not recovery.recovery_times:
+			gevent.sleep(0.001)
+		print("{:>16}: {:>8.3f}s for {} queues and consumers on {} channels".format(
+			'recovery', recovery.recovery_times[0], args.queues, args.channels,
+		))
+		recovery.close()
+	finally:
+		server.stop()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,62 @@
+"""Microbenchmark for method lookup during decode.
+
+Measures the cost of decoding a basic.Deliver method payload as more and more
+Method subclasses are defined, alongside the old linear subclass scan for comparison.
+With the registry, decode cost should stay flat regardless of how many methods exist.
+
+Run from the repository root: python benchmarks/bench_registry.py
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import repo_path
+
+from grabbit.common import get_all_subclasses
+from grabbit.frames import Method, ShortString
+from grabbit.frames.frame import MethodPayload
+from grabbit.methods import basic
+
+
+EXTRA_CLASS = 0xff00 # extension class range, so we don't collide with real methods
+COUNTS = [0, 100, 1000, 5000]
+NUMBER = 20000
+
+
+def define_methods(start, stop):
+	for method_id in range(start, stop):
+		type('BenchMethod{}'.format(method_id), (Method,), dict(
+			method_class = EXTRA_CLASS,
+			method_id = method_id,
+			fields = [('foo', ShortString)],
+		))
+
+
+def linear_from_id(method_class, method_id):
+	for method in get_all_subclasses(Method):
+		if method.method_class == method_class and method.method_id == method_id:
+			return method
+
+
+def main():
+	deliver = MethodPayload(basic.Deliver('ctag', 1, exchange='ex', routing_key='key', redelivered=False))
+	data = deliver.pack()
+	defined = 0
+	print("{:>8} {:>16} {:>16} {:>16}".format('methods', 'from_id (us)', 'linear (us)', 'unpack (us)'))
+	for count in COUNTS:
+		define_methods(defined, count)
+		defined = count
+		from_id = timeit.timeit(lambda: Method.from_id(basic.CLASS_ID, basic.Deliver.method_id), number=NUMBER)
+		linear = timeit.timeit(lambda: linear_from_id(basic.CLASS_ID, basic.Deliver.method_id), number=NUMBER // 100)
+		unpack = timeit.timeit(lambda: MethodPayload.unpack(data), number=NUMBER)
+		print("{:>8} {:>16.3f} {:>16.3f} {:>16.3f}".format(
+			len(Method.registry),
+			from_id * 1e6 / NUMBER,
+			linear * 1e6 / (NUMBER // 100),
+			unpack * 1e6 / NUMBER,
+		))
+
+
+if __name__ == '__main__':
+	main()
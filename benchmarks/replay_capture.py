@@ -0,0 +1,84 @@
+"""Replays a frame capture (see grabbit.frames.capture) through the decoder, reporting
+decode latency percentiles for each kind of frame.
+
+Captures are recorded by passing a CaptureWriter as the capture argument of FrameReader and send_buffers().
+To try this out without one, --generate writes a synthetic capture of N messages to the given path first.
+
+Run from the repository root:
+	python benchmarks/replay_capture.py PATH [--reader] [--lazy] [--pacing] [--direction in|out] [--generate N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+
+import repo_path
+
+from grabbit.frames import Frame, FrameReader
+from grabbit.frames.capture import CaptureWriter, IN, OUT, read_capture, replay, percentiles
+from grabbit.frames.content import content_frames
+from grabbit.frames.frame import send_buffers
+from grabbit.methods import basic
+
+
+POINTS = (50, 90, 99, 99.9)
+
+
+def generate(path, messages):
+	"""Writes a capture of a consumer receiving messages and acking them, with a heartbeat between each 100"""
+	class NullSocket(object):
+		def sendall(self, data):
+			pass
+
+	with open(path, 'wb') as f:
+		now = [1400000000.0]
+		def clock():
+			now[0] += random.expovariate(10000)
+			return now[0]
+		writer = CaptureWriter(f, clock)
+		reader = FrameReader(capture=writer)
+		for tag in range(1, messages + 1):
+			body = b'x' * random.choice([10, 100, 1000, 10000, 200000])
+			headers = {'header{}'.format(n): n for n in range(random.randint(0, 20))}
+			frames = [Frame(Frame.METHOD_TYPE, 1, basic.Deliver(
+				'ctag', tag, exchange='exchange', routing_key='key', redelivered=False,
+			))] + list(content_frames(1, basic.CLASS_ID, {'delivery_mode': 2, 'headers': headers}, body, 131072))
+			reader.feed(b''.join(frame.pack() for frame in frames))
+			list(reader)
+			send_buffers(NullSocket(), Frame(Frame.METHOD_TYPE, 1, basic.Ack(tag, multiple=False)).pack_buffers(),
+			             capture=writer)
+			if tag % 100 == 0:
+				send_buffers(NullSocket(), Frame(Frame.HEARTBEAT_TYPE, 0).pack_buffers(), capture=writer)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('path', help='Capture file to replay')
+	parser.add_argument('--reader', action='store_true', help='Decode with a FrameReader instead of Frame.unpack_from()')
+	parser.add_argument('--lazy', action='store_true', help='Decode frames lazily')
+	parser.add_argument('--pacing', action='store_true', help='Replay with the original intervals between frames')
+	parser.add_argument('--direction', choices=['in', 'out'], help='Only replay frames in this direction')
+	parser.add_argument('--generate', type=int, metavar='N', help='First write a synthetic capture of N messages')
+	args = parser.parse_args()
+
+	if args.generate:
+		generate(args.path, args.generate)
+
+	direction = {'in': IN, 'out': OUT, None: None}[args.direction]
+	with open(args.path, 'rb') as f:
+		records = [record for record in read_capture(f) if direction in (None, record.direction)]
+	latencies = replay(records, reader=args.reader, lazy=args.lazy, pacing=args.pacing)
+
+	print("{:<28} {:>8} {}".format('frame kind', 'count', ' '.join('{:>9}'.format('p{}'.format(point)) for point in POINTS)))
+	for kind, values in sorted(latencies.items()):
+		results = percentiles(values, POINTS)
+		print("{:<28} {:>8} {}".format(kind, len(values), ' '.join(
+			'{:>7.1f}us'.format(results[point] * 1e6) for point in POINTS
+		)))
+	total = sum(sum(values) for values in latencies.values())
+	print("{} frames, {:.0f} bytes decoded in {:.3f}s".format(len(records), sum(len(record.data) for record in records), total))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,11 @@
+"""Imported by each benchmark before grabbit, so that they can be run as "python benchmarks/X.py"
+from the repository root, where only benchmarks/ would otherwise be on sys.path."""
+
+import os
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
@@ -0,0 +1,272 @@
+"""Benchmark suite for the frames and methods layers, for catching performance regressions.
+
+Each workload is encoded and decoded repeatedly, and for each op we record:
+	ops_per_sec: the best of several timed repeats
+	calibration_ops_per_sec: the speed of the calibration loop (see below) when the op was timed
+	bytes_per_sec: ops_per_sec times the size of the encoded workload
+	retained_bytes: for decode ops, the memory kept alive by each decoded result (see bench_memory.py)
+	peak_bytes: the peak memory allocated during a single op, measured with tracemalloc.
+	blocks_per_frame: the memory blocks allocated by a single op which are still alive afterwards
+		(ie. in its result), per frame of the workload, also measured with tracemalloc. CPython doesn't
+		count allocations which have been freed again outside of debug builds, so this is the closest
+		measure of allocations per frame available.
+		These two are only available on interpreters which have tracemalloc (ie. not CPython 2), and are
+		null otherwise.
+
+Results are written as JSON to --output, and if --baseline is given (a previous --output),
+each result is compared against it. The exit status is 1 if any op's ops_per_sec has dropped by
+more than --threshold (a fraction, default 0.2) compared to the baseline.
+To make results less sensitive to the speed of the machine (eg. CPU frequency scaling or a busy VM),
+a fixed pure-python calibration loop is also timed alongside each op, and changes are relative
+to the change in the calibration's speed. This helps, but results are still only reliably comparable
+on the same machine and interpreter, so keep a baseline per environment, eg. by running once on
+the old version with --output. Comparing against a baseline from another interpreter (implementation
+and major.minor version) is refused. The baselines in this directory, baseline-<interpreter>.json,
+were recorded on the machine the suite was developed on.
+
+Run from the repository root:
+	python benchmarks/suite.py [--output PATH] [--baseline PATH] [--threshold FRACTION] [--filter SUBSTRING] [--quick]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import platform
+import struct
+import sys
+import time
+import timeit
+
+import repo_path
+
+from grabbit.errors import ConnectionForced
+from grabbit.frames import Frame, FieldTable
+from grabbit.frames.common import to_str
+from grabbit.frames.content import content_frames
+from grabbit.methods import basic, connection
+
+from bench_memory import deep_size
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+
+REPEAT = 5
+# each timed repeat runs for at least this long
+MIN_TIME = 0.2
+
+
+class Workload(object):
+	"""A named sequence of frames, which are encoded with pack_buffers() and decoded with
+	Frame.unpack_from() as a whole, or a single value with its own encode and decode functions."""
+
+	def __init__(self, name, frames=None, encode=None, decode=None):
+		self.name = name
+		self.frames = 1 if frames is None else len(frames)
+		if frames is not None:
+			encode = lambda: [buf for frame in frames for buf in frame.pack_buffers()]
+			decode = self.decode_frames
+		self.encode = encode
+		self.decode = decode
+		self.data = b''.join(to_str(buf) for buf in encode())
+
+	def decode_frames(self):
+		frames = []
+		offset = 0
+		while offset < len(self.data):
+			frame, offset = Frame.unpack_from(self.data, offset)
+			frames.append(frame)
+		return frames
+
+
+def message_frames(method, properties, body, frame_size_max=131072):
+	return [Frame(Frame.METHOD_TYPE, 1, method)] + list(
+		content_frames(1, basic.CLASS_ID, properties, body, frame_size_max)
+	)
+
+
+def make_table(size):
+	return {'header_{}'.format(n): ['value {}'.format(n), n, n % 2 == 0][n % 3] for n in range(size)}
+
+
+def table_workload(size):
+	table = FieldTable(make_table(size))
+	data = table.pack()
+	return Workload(
+		'fieldtable_{}'.format(size),
+		encode=lambda: [FieldTable(table.value).pack()],
+		decode=lambda: FieldTable.unpack_from(data),
+	)
+
+
+def workloads():
+	yield Workload('publish_small', message_frames(
+		basic.Publish(exchange='exchange', routing_key='some.routing.key', mandatory=False, immediate=False),
+		{'content_type': 'application/json', 'delivery_mode': 2},
+		b'{"id": 1234, "name": "a small message body"}',
+	))
+	yield Workload('deliver_headers', message_frames(
+		basic.Deliver('amq.ctag-0123456789', 1234, exchange='exchange', routing_key='some.routing.key',
+		              redelivered=False),
+		{'content_type': 'application/json', 'delivery_mode': 2, 'message_id': 'abc', 'timestamp': 1400000000,
+		 'headers': make_table(20)},
+		b'{"id": 1234}',
+	))
+	yield Workload('body_large', message_frames(
+		basic.Publish(exchange='exchange', routing_key='some.routing.key', mandatory=False, immediate=False),
+		{}, b'x' * (4 * 1024 * 1024),
+	))
+	yield Workload('heartbeat', [Frame(Frame.HEARTBEAT_TYPE, 0)])
+	for size in (10, 100, 1000):
+		yield table_workload(size)
+	yield Workload('close', [Frame(Frame.METHOD_TYPE, 0, connection.Close(
+		error=ConnectionForced('closed by benchmark'), method=basic.Publish,
+	))])
+
+
+def calibration():
+	"""A fixed amount of pure-python work, similar in character to the codecs"""
+	total = 0
+	for n in range(1000):
+		total += len(str(n)) + (n & 0xff)
+	return b''.join([struct.pack('B', total & 0x7f)] * 100)
+
+
+def time_op(fn, min_time=MIN_TIME, repeat=REPEAT):
+	"""Returns the best ops per second over several repeats of at least min_time"""
+	# calibrate the number of ops per repeat
+	number = 1
+	while True:
+		elapsed = timeit.timeit(fn, number=number)
+		if elapsed >= min_time:
+			break
+		number *= 2 if elapsed < min_time / 100 else max(2, int(min_time / elapsed))
+	return number / min([elapsed] + timeit.repeat(fn, number=number, repeat=repeat - 1))
+
+
+def allocations(fn):
+	"""Returns (peak bytes allocated during fn(), blocks allocated by it which are still alive afterwards)"""
+	if tracemalloc is None:
+		return None, None
+	fn() # warm up any caches, so they are not counted
+	gc.collect()
+	tracemalloc.start()
+	try:
+		result = fn()
+		peak = tracemalloc.get_traced_memory()[1]
+		blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+		del result
+		return peak, blocks
+	finally:
+		tracemalloc.stop()
+
+
+def run(name_filter=None, quick=False):
+	min_time, repeat = (0.01, 1) if quick else (MIN_TIME, REPEAT)
+	results = {}
+	for workload in workloads():
+		for op in ('encode', 'decode'):
+			name = '{}.{}'.format(workload.name, op)
+			if name_filter and name_filter not in name:
+				continue
+			fn = getattr(workload, op)
+			# the faster of the calibrations just before and after the op
+			calibration_ops = time_op(calibration, min_time / 4, repeat)
+			ops = time_op(fn, min_time, repeat)
+			calibration_ops = max(calibration_ops, time_op(calibration, min_time / 4, repeat))
+			peak, blocks = allocations(fn)
+			results[name] = {
+				'ops_per_sec': ops,
+				'calibration_ops_per_sec': calibration_ops,
+				'bytes_per_sec': ops * len(workload.data),
+				'retained_bytes': deep_size([fn()], set()) if op == 'decode' else None,
+				'peak_bytes': peak,
+				'blocks_per_frame': None if blocks is None else blocks / float(workload.frames),
+			}
+			report(name, results[name])
+	return results
+
+
+def report(name, result):
+	line = "{:<24} {:>12.0f} ops/s {:>10.1f} MB/s".format(
+		name, result['ops_per_sec'], result['bytes_per_sec'] / 1e6,
+	)
+	if result['retained_bytes'] is not None:
+		line += " {:>9} retained".format(result['retained_bytes'])
+	if result['peak_bytes'] is not None:
+		line += " {:>9} peak {:>7.1f} blocks/frame".format(result['peak_bytes'], result['blocks_per_frame'])
+	print(line)
+
+
+def compare(results, baseline, threshold):
+	"""Prints the change in each result compared to baseline, returning the names of any regressions.
+	Changes are relative to the change in speed of the calibration timed alongside each op."""
+	regressions = []
+	print()
+	print("{:<24} {:>14} {:>14} {:>8} {:>8}".format(
+		'compared to baseline', 'baseline ops/s', 'ops/s', 'machine', 'change',
+	))
+	for name in sorted(results):
+		if name not in baseline:
+			print("{:<24} {:>14} {:>14.0f}".format(name, '-', results[name]['ops_per_sec']))
+			continue
+		old, new = baseline[name]['ops_per_sec'], results[name]['ops_per_sec']
+		scale = results[name]['calibration_ops_per_sec'] / baseline[name]['calibration_ops_per_sec']
+		change = new / old / scale - 1
+		flag = ''
+		if change < -threshold:
+			regressions.append(name)
+			flag = ' REGRESSION'
+		print("{:<24} {:>14.0f} {:>14.0f} {:>+7.1%} {:>+7.1%}{}".format(name, old, new, scale - 1, change, flag))
+	return regressions
+
+
+def interpreter(info=None):
+	"""Returns eg. 'cpython-3.11' for the current interpreter, or the one in info (the JSON of a run)"""
+	if info is None:
+		return '{}-{}.{}'.format(platform.python_implementation().lower(), *sys.version_info[:2])
+	return info.get('interpreter') or '{}-{}'.format(
+		info['implementation'].lower(), '.'.join(info['python'].split()[0].split('.')[:2]),
+	)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--output', help='Path to write JSON results to')
+	parser.add_argument('--baseline', help='Path to JSON results of a previous run to compare against')
+	parser.add_argument('--threshold', type=float, default=0.2,
+	                    help='Fractional drop in ops/sec compared to the baseline that counts as a regression')
+	parser.add_argument('--filter', help='Only run ops whose name contains this')
+	parser.add_argument('--quick', action='store_true', help='Time each op only briefly, for checking the suite works')
+	args = parser.parse_args()
+
+	baseline = None
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		if interpreter(baseline) != interpreter():
+			parser.error("Baseline {} was recorded on {}, so can't be compared with {}".format(
+				args.baseline, interpreter(baseline), interpreter(),
+			))
+
+	results = run(args.filter, args.quick)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({
+				'python': sys.version,
+				'implementation': platform.python_implementation(),
+				'interpreter': interpreter(),
+				'platform': platform.platform(),
+				'time': time.time(),
+				'results': results,
+			}, f, indent=1, sort_keys=True)
+	if baseline is not None and compare(results, baseline['results'], args.threshold):
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -19,3 +19,57 @@ class classproperty(object):
 
 	def __get__(self, instance, cls):
 		return self.fn(cls)
+
+
+class Registry(object):
+	"""A mapping from some identifying key (eg. a method's (method_class, method_id))
+	to the class with that key. Classes are added as they are defined by RegisteredType,
+	which allows constant-time lookup instead of a search through all subclasses.
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.entries = {}
+
+	def add(self, key, cls):
+		"""Register cls under key. Raises ValueError if key is already taken by another class."""
+		existing = self.entries.get(key)
+		if existing is not None and existing is not cls:
+			raise ValueError("Duplicate {} key {!r}: {} conflicts with already-registered {}".format(
+				self.name, key, cls.__name__, existing.__name__
+			))
+		self.entries[key] = cls
+
+	def lookup(self, key):
+		"""Return the class registered under key, or raise KeyError."""
+		return self.entries[key]
+
+	def table(self):
+		"""Return a copy of the full {key: class} table, eg. for inspection or debugging."""
+		return dict(self.entries)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __repr__(self):
+		return "<{cls.__name__} {self.name!r} ({n} entries)>".format(cls=type(self), self=self, n=len(self))
+
+
+class RegisteredType(type):
+	"""Metaclass that adds classes to a Registry when they are defined.
+	A class hierarchy opts in by setting the class attribute "registry" to a Registry,
+	and defining a classmethod "registry_key" that returns the key for that class,
+	or None if the class should not be registered (eg. it is an abstract base class).
+	"""
+
+	def __init__(cls, name, bases, attrs):
+		super(RegisteredType, cls).__init__(name, bases, attrs)
+		registry = getattr(cls, 'registry', None)
+		if registry is None:
+			return
+		key = cls.registry_key()
+		if key is not None:
+			registry.add(key, cls)
@@ -0,0 +1,52 @@
+
+"""Helpers for running on both python 2 and python 3.
+
+On both, packed data is bytes (which is str on python 2), and any buffer (eg. bytearray or memoryview)
+may be given where data is unpacked.
+"""
+
+import sys
+import time
+
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+	text_type = unicode
+	string_types = (str, unicode)
+	integer_types = (int, long)
+	exec('def reraise(tp, value, tb=None):\n\traise tp, value, tb\n')
+else:
+	text_type = str
+	string_types = (bytes, str)
+	integer_types = (int,)
+	def reraise(tp, value, tb=None):
+		if value.__traceback__ is not tb:
+			raise value.with_traceback(tb)
+		raise value
+
+# a clock which never goes backwards, for timing intervals. Python 2 has none, so uses the wall clock.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def with_metaclass(meta, *bases):
+	"""Returns a base class for a class with metaclass meta and the given bases,
+	as neither interpreter understands the other's syntax for this."""
+	class temporary_meta(meta):
+		def __new__(mcs, name, this_bases, attrs):
+			return meta(name, bases, attrs)
+	return type.__new__(temporary_meta, 'temporary_class', (), {})
+
+
+def to_bytes(value):
+	"""Encodes text to bytes as UTF-8, passing bytes through as-is"""
+	if isinstance(value, text_type):
+		return value.encode('utf-8')
+	return value
+
+
+def native_str(value):
+	"""Converts bytes which are known to be ascii (eg. identifiers) to the native str type"""
+	if PY2 or isinstance(value, str):
+		return value
+	return value.decode('ascii')
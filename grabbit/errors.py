@@ -1,7 +1,9 @@
 
-from grabbit.common import get_all_subclasses
+from grabbit.common import Registry, RegisteredType
+from grabbit.compat import integer_types, with_metaclass
 
-class AMQPError(Exception):
+class AMQPError(with_metaclass(RegisteredType, Exception)):
+	registry = Registry('error code')
 	code = NotImplemented
 
 	def __init__(self, reason=None, **data):
@@ -12,13 +14,18 @@ class AMQPError(Exception):
 		self.reason = reason
 		self.data = data
 
+	@classmethod
+	def registry_key(cls):
+		# note we can't compare to NotImplemented here, as that name is shadowed below
+		return cls.code if isinstance(cls.code, integer_types) else None
+
 	@classmethod
 	def from_code(cls, code):
 		"""Look up error class based on code."""
-		for subcls in get_all_subclasses(cls):
-			if subcls.code == code:
-				return subcls
-		raise ValueError("No known subclass for code: {!r}".format(code))
+		try:
+			return cls.registry.lookup(code)
+		except KeyError:
+			raise ValueError("No known subclass for code: {!r}".format(code))
 
 	def __eq__(self, other):
 		return type(self) == type(other) and self.reason == other.reason and self.data == other.data
@@ -27,6 +34,7 @@ class AMQPError(Exception):
 		s = "{cls.__name__}: {self.reason} (extra data: {self.data!r})".format(self=self, cls=type(self))
 		if self.args:
 			s += " ({})".format(', '.join(map(repr, self.args)))
+		return s
 
 class ChannelError(AMQPError):
 	"""Class of errors which abort the channel"""
@@ -35,6 +43,13 @@ class ConnectionError(AMQPError):
 	"""Class of errors which abort the connection"""
 
 
+# errors with no code are never sent or received, they are only raised locally
+class ChannelClosed(ChannelError):
+	"""Channel is closed"""
+class ConnectionClosed(ConnectionError):
+	"""Connection is closed"""
+
+
 class ContentTooLarge(ChannelError):
 	"""Server rejected content - too large. Try again later."""
 	code = 311
@@ -1,7 +1,9 @@
-from common import Incomplete
-from fieldtable import FieldTable
-from frame import Frame
-from method import Method
-from properties import Properties, PropertyBit
+from .common import Incomplete
+from .fieldtable import FieldTable
+from .frame import Frame
+from .reader import FrameReader
+from .content import content_frames
+from .method import Method
+from .properties import Properties, PropertyBit
 
-from datatypes import DataType, Octet, Short, Long, LongLong, Timestamp, ShortString, LongString, Bits, Sequence
+from .datatypes import DataType, Octet, Short, Long, LongLong, Timestamp, ShortString, LongString, Bits, Sequence
@@ -0,0 +1,145 @@
+
+"""A file format for capturing streams of frames, and tools to replay captures through the decoder.
+
+A capture file is MAGIC followed by a record for each frame (or ProtocolHeader), each being
+a RECORD_HEADER (timestamp as float seconds since the epoch, direction IN or OUT, and length)
+followed by the raw bytes of the frame. Frames are captured by passing a CaptureWriter as the capture
+argument of FrameReader (received frames) and send_buffers() (sent frames).
+"""
+
+import math
+import struct
+import time
+from collections import namedtuple
+
+from .common import to_str
+from .datatypes import ProtocolHeader
+from .frame import Frame
+from .reader import FrameReader
+
+
+MAGIC = b'GRABCAP\x01'
+RECORD_HEADER = struct.Struct('!dcL')
+IN, OUT = b'I', b'O'
+
+Record = namedtuple('Record', ['timestamp', 'direction', 'data'])
+
+
+class CaptureWriter(object):
+	"""Writes records to file object f, which should be opened in binary mode.
+	clock is the source of timestamps for records written without one."""
+
+	def __init__(self, f, clock=time.time):
+		self.f = f
+		self.clock = clock
+		f.write(MAGIC)
+
+	def write(self, direction, data, timestamp=None):
+		"""Write a record for a single frame in data (a str or other buffer)"""
+		if direction not in (IN, OUT):
+			raise ValueError("Direction must be IN or OUT, not {!r}".format(direction))
+		if timestamp is None:
+			timestamp = self.clock()
+		self.f.write(RECORD_HEADER.pack(timestamp, direction, len(data)))
+		self.f.write(to_str(data))
+
+	def write_frames(self, direction, buffers, timestamp=None):
+		"""Write a record for each frame in buffers, which when concatenated must be a sequence
+		of complete frames, eg. as passed to send_buffers()."""
+		if timestamp is None:
+			timestamp = self.clock()
+		data = b''.join(to_str(buf) for buf in buffers)
+		offset = 0
+		while offset < len(data):
+			end = frame_end(data, offset)
+			if end > len(data):
+				raise ValueError("Buffers end part-way through a frame")
+			self.write(direction, data[offset:end], timestamp)
+			offset = end
+
+
+def frame_end(data, offset):
+	"""Returns the offset of the end of the frame or ProtocolHeader starting at data[offset],
+	as given by its header (which must be in data)."""
+	if data[offset:offset + 1] == b'A':
+		return offset + FrameReader.PROTOCOL_HEADER_SIZE
+	frame_type, channel, size = FrameReader.HEADER.unpack_from(data, offset)
+	return offset + size + Frame.OVERHEAD
+
+
+def read_capture(f):
+	"""Yields each Record in a capture from file object f. Raises ValueError if the capture is invalid."""
+	if f.read(len(MAGIC)) != MAGIC:
+		raise ValueError("Not a capture file, or unsupported version")
+	while True:
+		header = f.read(RECORD_HEADER.size)
+		if not header:
+			return
+		if len(header) < RECORD_HEADER.size:
+			raise ValueError("Capture ends part-way through a record header")
+		timestamp, direction, length = RECORD_HEADER.unpack(header)
+		data = f.read(length)
+		if len(data) < length:
+			raise ValueError("Capture ends part-way through a record")
+		yield Record(timestamp, direction, data)
+
+
+def frame_kind(frame):
+	"""A name for the kind of frame, which for method frames includes the method, eg. 'method basic.Deliver'"""
+	if isinstance(frame, ProtocolHeader):
+		return 'protocol header'
+	if frame.type == Frame.METHOD_TYPE:
+		method = type(frame.payload.method)
+		return 'method {}.{}'.format(method.__module__.split('.')[-1], method.__name__)
+	return {Frame.HEADER_TYPE: 'header', Frame.BODY_TYPE: 'body', Frame.HEARTBEAT_TYPE: 'heartbeat'}[frame.type]
+
+
+def unpack_record(data, lazy=False):
+	if data[:1] == b'A':
+		return ProtocolHeader.unpack_from(data)[0]
+	frame, offset = Frame.unpack_from(data, 0, lazy=lazy)
+	return frame
+
+
+def replay(records, reader=False, lazy=False, pacing=False, clock=time.time, sleep=time.sleep):
+	"""Decodes the frame in each of records (eg. from read_capture()), timing each one.
+	If reader is True, records are fed through a FrameReader for each direction, otherwise each
+	is unpacked with Frame.unpack_from(). lazy is passed through to either.
+	If pacing is True, records are replayed with the same intervals between them as when they
+	were captured, otherwise they are replayed as fast as possible.
+	Returns {frame kind (see frame_kind()): [decode time in seconds for each frame of that kind]}.
+	"""
+	readers = {IN: FrameReader(lazy=lazy), OUT: FrameReader(lazy=lazy)}
+	latencies = {}
+	start = first_timestamp = None
+	for timestamp, direction, data in records:
+		if pacing:
+			if start is None:
+				start, first_timestamp = clock(), timestamp
+			delay = (timestamp - first_timestamp) - (clock() - start)
+			if delay > 0:
+				sleep(delay)
+		if reader:
+			frame_reader = readers[direction]
+			before = clock()
+			frame_reader.feed(data)
+			frame = frame_reader.read()
+			elapsed = clock() - before
+			if frame is None or len(frame_reader):
+				raise ValueError("Record does not contain exactly one frame")
+		else:
+			before = clock()
+			frame = unpack_record(data, lazy)
+			elapsed = clock() - before
+		latencies.setdefault(frame_kind(frame), []).append(elapsed)
+	return latencies
+
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+	"""Returns {point: value} for each percentile point of values, using the nearest-rank method"""
+	values = sorted(values)
+	result = {}
+	for point in points:
+		rank = int(math.ceil(point / 100.0 * len(values)))
+		result[point] = values[min(max(rank, 1), len(values)) - 1]
+	return result
@@ -0,0 +1,146 @@
+
+"""Generates specialised encode and decode functions for Sequence subclasses.
+
+Rather than walking a Sequence's fields and wrapping each value in a DataType every time
+it is packed or unpacked, we generate python source for each Sequence's field layout once,
+when the class is defined. Runs of fixed-width fields (including string length prefixes and
+Bits octets) are merged into a single precompiled struct.Struct, and strings are sliced inline.
+
+The generated functions work on "raw" values, one per field (including unnamed fields):
+	STRUCT fields (eg. Short, LongLong): an int
+	STRING fields (ShortString, LongString): bytes
+	BITS fields: a tuple of bools, one for each of the Bits type's all_names
+	OTHER fields (anything else, eg. FieldTable): an instance of the field's DataType,
+		which is packed and unpacked with its own methods.
+"""
+
+import struct
+
+from .datatypes import FromStruct, BitsType, ShortString, LongString
+from .common import Incomplete, to_str, STRUCT, STRING, BITS, OTHER
+
+
+def field_kind(datatype):
+	"""Returns which kind of raw value (see module docstring) is used for the given field type"""
+	if datatype in (ShortString, LongString):
+		return STRING
+	if issubclass(datatype, FromStruct):
+		return STRUCT
+	if issubclass(datatype, BitsType):
+		return BITS
+	return OTHER
+
+
+class _Run(object):
+	"""A run of fixed-width values which are packed or unpacked with a single struct"""
+	def __init__(self):
+		self.fmt = ''
+		self.encode_exprs = [] # expressions for values to pass to struct.pack()
+		self.decode_targets = [] # variable names to assign results of struct.unpack_from() to
+		self.decode_after = [] # lines to run after unpacking, eg. to expand bits
+
+
+def _bits_encode_expr(var, nbits, byte):
+	"""Expression for the byte'th octet of a BITS raw value in var"""
+	bits = range(byte * 8, min(nbits, (byte + 1) * 8))
+	return ' | '.join('{}[{}] << {}'.format(var, bit, bit % 8) for bit in bits) or '0'
+
+
+def compile_sequence(cls):
+	"""Returns (encode, decode) functions for Sequence subclass cls.
+	encode(raw) takes a tuple of raw values and returns the packed bytes.
+	decode(data, offset) returns (raw, offset after the last field), or raises Incomplete.
+	As per DataType.unpack_from(), data may be bytes or other buffer.
+	"""
+	return compile_codec(cls.__name__, cls.types())
+
+
+def compile_codec(name, types, prefix=b''):
+	"""As compile_sequence(), for a sequence of fields of the given types.
+	name is only used to identify the generated code in tracebacks.
+	prefix is a constant bytes value included at the start of the output of encode(). It is not read by decode().
+	"""
+	namespace = {'Incomplete': Incomplete, 'to_str': to_str, 'prefix': prefix}
+	ops = [] # list of (op, args) where op is one of STRUCT (a _Run), STRING or OTHER
+	encode_lines = []
+	run = None
+
+	for index, datatype in enumerate(types):
+		kind = field_kind(datatype)
+		var = 'v{}'.format(index)
+		if kind in (STRUCT, BITS, STRING) and run is None:
+			run = _Run()
+			ops.append((STRUCT, run))
+		if kind == STRUCT:
+			run.fmt += datatype.format_char
+			run.encode_exprs.append(var)
+			run.decode_targets.append(var)
+		elif kind == BITS:
+			nbits = len(datatype.all_names)
+			targets = []
+			for byte in range(datatype.length):
+				target = 'b{}_{}'.format(index, byte)
+				run.fmt += 'B'
+				run.encode_exprs.append(_bits_encode_expr(var, nbits, byte))
+				run.decode_targets.append(target)
+				targets.append(target)
+			run.decode_after.append('{} = ({},)'.format(var, ', '.join(
+				'{} & {} != 0'.format(targets[bit // 8], 1 << (bit % 8)) for bit in range(nbits)
+			)))
+		elif kind == STRING:
+			length = 'n{}'.format(index)
+			encode_lines.append('{} = len({})'.format(length, var))
+			encode_lines.append('if {} > {}: raise ValueError("String value too long: {{!r}}".format({}))'.format(
+				length, datatype.len_max, var
+			))
+			if issubclass(datatype, ShortString):
+				encode_lines.append(r'if b"\0" in {}: raise ValueError("ShortString cannot contain nul characters")'.format(var))
+			run.fmt += datatype.len_type.format_char
+			run.encode_exprs.append(length)
+			run.decode_targets.append(length)
+			# a string ends the current run, as the next value is at a variable offset
+			ops.append((STRING, index))
+			run = None
+		else:
+			namespace['T{}'.format(index)] = datatype
+			ops.append((OTHER, index))
+			run = None
+
+	names = ['v{}'.format(index) for index in range(len(types))]
+	parts = ['prefix'] if prefix else []
+	decode_lines = ['size = len(data)', 'is_bytes = type(data) is bytes']
+	for op, arg in ops:
+		if op == STRUCT:
+			struct_name = 's{}'.format(len(namespace))
+			namespace[struct_name] = run_struct = struct.Struct('!' + arg.fmt)
+			parts.append('{}.pack({})'.format(struct_name, ', '.join(arg.encode_exprs)))
+			decode_lines += [
+				'if size < offset + {}: raise Incomplete'.format(run_struct.size),
+				'{}, = {}.unpack_from(data, offset)'.format(', '.join(arg.decode_targets), struct_name),
+				'offset += {}'.format(run_struct.size),
+			] + arg.decode_after
+		elif op == STRING:
+			parts.append('v{}'.format(arg))
+			decode_lines += [
+				'end = offset + n{}'.format(arg),
+				'if size < end: raise Incomplete',
+				'v{} = data[offset:end]'.format(arg),
+				'if not is_bytes: v{0} = to_str(v{0})'.format(arg),
+				'offset = end',
+			]
+		else:
+			parts.append('v{}.pack()'.format(arg))
+			decode_lines.append('v{0}, offset = T{0}.unpack_from(data, offset)'.format(arg))
+
+	if names:
+		encode_lines.insert(0, '{}, = raw'.format(', '.join(names)))
+	encode_lines.append('return b"".join([{}])'.format(', '.join(parts)))
+	decode_lines.append('return ({}), offset'.format(''.join(name + ', ' for name in names)))
+
+	source = 'def encode(raw):\n{}\n\ndef decode(data, offset):\n{}\n'.format(
+		'\n'.join('\t' + line for line in encode_lines),
+		'\n'.join('\t' + line for line in decode_lines),
+	)
+	code = compile(source, '<{} codec>'.format(name), 'exec')
+	exec(code, namespace)
+	return namespace['encode'], namespace['decode']
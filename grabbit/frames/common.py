@@ -1,4 +1,7 @@
 
+# kinds of field values in a Sequence, see codec.py
+STRUCT, STRING, BITS, OTHER = 'struct', 'string', 'bits', 'other'
+
 
 class Incomplete(Exception):
 	"""Indicates the data given was incomplete."""
@@ -10,3 +13,23 @@ def eat(data, length):
 	if len(data) < length:
 		raise Incomplete
 	return data[:length], data[length:]
+
+
+def take(data, offset, length):
+	"""Helper method: Return (length) bytes of data starting at offset as bytes, along with
+	the offset of the byte after them, or raise Incomplete if not long enough.
+	Unlike eat(), this only copies the bytes taken, not the rest of data.
+	data may be a str or any other buffer supporting slicing (eg. a bytearray or memoryview)."""
+	end = offset + length
+	if len(data) < end:
+		raise Incomplete
+	return to_str(data[offset:end]), end
+
+
+def to_str(data):
+	"""Convert a slice of some buffer (eg. a bytearray or memoryview) to bytes (ie. a str on python 2)"""
+	if type(data) is bytes:
+		return data
+	if isinstance(data, memoryview):
+		return data.tobytes()
+	return bytes(data)
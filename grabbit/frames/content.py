@@ -0,0 +1,127 @@
+
+"""Splitting of message bodies into content frames, for publishing."""
+
+import os
+
+from .frame import Frame, ContentHeaderPayload
+
+
+def as_buffer(body):
+	"""Returns a memoryview of body, or None if it doesn't support the buffer protocol.
+	Checked before treating body as a file, as eg. an mmap has read(), which would copy it."""
+	try:
+		return memoryview(body)
+	except TypeError:
+		return None # eg. a file object, or an mmap under python 2
+
+
+def body_size(body):
+	"""Work out the size of a message body (see content_frames()) without reading it,
+	or return None if this isn't possible (eg. for an iterator of chunks)."""
+	view = as_buffer(body)
+	if view is not None:
+		return len(view)
+	if hasattr(body, 'read'):
+		# file objects: size is the remainder of the file after the current position
+		if hasattr(body, 'fileno'):
+			try:
+				return os.fstat(body.fileno()).st_size - body.tell()
+			except (IOError, OSError, ValueError):
+				pass # eg. not a real file, or a pipe. Try seeking instead.
+		try:
+			start = body.tell()
+			body.seek(0, os.SEEK_END)
+			end = body.tell()
+			body.seek(start)
+		except (IOError, OSError, ValueError, AttributeError):
+			return None
+		return end - start
+	try:
+		return len(body)
+	except TypeError:
+		return None
+
+
+def body_chunks(body, chunk_size):
+	"""Yields successive chunks of body, each of size chunk_size except possibly the last,
+	without ever reading more of the body than is needed for the current chunk.
+	See content_frames() for what body may be. chunk_size of 0 means no limit."""
+	view = as_buffer(body)
+	if view is not None:
+		# eg. a str, memoryview or (under python 3) an mmap, which are sliced without copying
+		step = chunk_size or max(len(view), 1)
+		for start in range(0, len(view), step):
+			yield view[start:start + step]
+		return
+
+	if hasattr(body, 'read'):
+		while True:
+			chunk = body.read(chunk_size) if chunk_size else body.read()
+			if not chunk:
+				return
+			yield chunk
+			if not chunk_size:
+				return
+
+	try:
+		size = len(body)
+	except TypeError:
+		pass
+	else:
+		# some other sequence. Slicing it copies each chunk as it's taken.
+		step = chunk_size or max(size, 1)
+		for start in range(0, size, step):
+			yield body[start:start + step]
+		return
+
+	# otherwise, it's an iterable of chunks of arbitrary size, which we split and combine as needed
+	pending = []
+	pending_size = 0
+	for chunk in body:
+		if not chunk_size:
+			yield chunk
+			continue
+		while pending_size + len(chunk) >= chunk_size:
+			needed = chunk_size - pending_size
+			pending.append(chunk[:needed])
+			yield b''.join(pending) if len(pending) > 1 else pending[0]
+			pending = []
+			pending_size = 0
+			chunk = chunk[needed:]
+		if chunk:
+			pending.append(chunk)
+			pending_size += len(chunk)
+	if pending:
+		yield b''.join(pending)
+
+
+def content_frames(channel, method_class, properties, body, frame_size_max=0, size=None):
+	"""Lazily generates the content header frame and body frames for a message, as sent after
+	a method with content (eg. basic.Publish).
+	Body may be any of:
+		a str, memoryview or other buffer (eg. an mmap)
+		a file object, which is read from its current position to the end
+		an iterable of str chunks (of any size)
+	Body frames are at most frame_size_max in size (including frame overhead), or unlimited if 0.
+	Where possible, chunks of the body are memoryview slices so the body is never copied, and
+	files and iterables are only read as each frame is generated, so the whole body is never held in memory.
+	The body size is determined from the body where possible (by len() or fstat()),
+	but must be given as size for iterables. A ValueError is raised if the body turns out to
+	be a different size.
+	"""
+	if size is None:
+		size = body_size(body)
+	if size is None:
+		raise TypeError("Cannot determine size of body {!r}, size must be given".format(body))
+
+	yield Frame(Frame.HEADER_TYPE, channel, ContentHeaderPayload(method_class, size, properties))
+
+	chunk_size = frame_size_max - Frame.OVERHEAD if frame_size_max else 0
+	sent = 0
+	for chunk in body_chunks(body, chunk_size):
+		sent += len(chunk)
+		if sent > size:
+			raise ValueError("Body is larger than given size {}".format(size))
+		yield Frame(Frame.BODY_TYPE, channel, chunk)
+	if sent < size:
+		raise ValueError("Body is smaller than given size {} (got {} bytes)".format(size, sent))
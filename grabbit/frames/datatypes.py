@@ -1,10 +1,15 @@
+import sys
 import struct
 import math
 
-from grabbit.common import classproperty
-from common import eat
+from grabbit.common import classproperty, RegisteredType
+from grabbit.compat import reraise, to_bytes, with_metaclass
+from .common import take, to_str, Incomplete, STRUCT, STRING, BITS, OTHER
+
+class DataType(with_metaclass(RegisteredType, object)):
+	__slots__ = ('value',) # subclasses without __slots__ still get a __dict__ as normal
+	registry = None # see RegisteredType. Subclass hierarchies may set this to a Registry.
 
-class DataType(object):
 	def __init__(self, value):
 		"""Simple data types may wish to not override this and use value directly.
 		Data types with multiple values may wish to set their own attributes,
@@ -30,38 +35,90 @@ class DataType(object):
 	def pack(self):
 		raise NotImplementedError
 
+	def pack_buffers(self):
+		"""As pack(), but returns a list of buffers (eg. str or memoryview) which when concatenated
+		are the packed value. Types which may contain large amounts of data should override this
+		to avoid copying that data. See Frame.pack_buffers()"""
+		return [self.pack()]
+
 	@classmethod
 	def unpack(cls, data):
 		"""Data may be longer than needed.
 		Returns (instance of datatype, left over data).
 		Raises Incomplete if data is incomplete.
+		This is a thin wrapper around unpack_from(), which subclasses should implement instead.
+		"""
+		value, offset = cls.unpack_from(data, 0)
+		return value, data[offset:]
+
+	@classmethod
+	def unpack_from(cls, data, offset=0):
+		"""Unpack a value from data (a str or other buffer, eg. a memoryview) starting at offset.
+		Data may be longer than needed, and is never copied except for the parts that make up the value.
+		Returns (instance of datatype, offset of the first byte after the value).
+		Raises Incomplete if data is incomplete.
 		"""
 		raise NotImplementedError
 
+	@classmethod
+	def skip_from(cls, data, offset=0):
+		"""As unpack_from(), but only returns the offset of the first byte after the value.
+		This is used to find values for lazy decoding (see Properties and FieldTable),
+		so types should override it where they can do so without decoding the value."""
+		value, offset = cls.unpack_from(data, offset)
+		return offset
+
 	def __len__(self):
 		"""You may override this if there's a better way to get length than simply packing."""
 		return len(self.pack())
 
+	def __reduce__(self):
+		# pickled in packed form, as instances have no __dict__ and may be lazily decoded
+		return unpack_value, (type(self), self.pack())
+
+
+def unpack_value(cls, data):
+	"""Returns the cls instance packed in data, for unpickling"""
+	return cls.unpack(data)[0]
+
 
 class FromStruct(DataType):
 	format_char = NotImplemented
 
 	def pack(self):
-		return struct.pack(self.struct_fmt(), self.value)
+		return self.compiled_struct().pack(self.value)
 
 	@classmethod
-	def unpack(cls, data):
-		data, leftover = eat(data, cls.len())
-		value, = struct.unpack(cls.struct_fmt(), data)
-		return cls(value), leftover
+	def unpack_from(cls, data, offset=0):
+		compiled = cls.compiled_struct()
+		end = offset + compiled.size
+		if len(data) < end:
+			raise Incomplete
+		value, = compiled.unpack_from(data, offset)
+		return cls(value), end
+
+	@classmethod
+	def skip_from(cls, data, offset=0):
+		end = offset + cls.len()
+		if len(data) < end:
+			raise Incomplete
+		return end
 
 	@classmethod
 	def struct_fmt(cls):
 		return '!' + cls.format_char
 
+	@classmethod
+	def compiled_struct(cls):
+		"""Returns a struct.Struct for this type, which is created on first use"""
+		compiled = cls.__dict__.get('_compiled_struct')
+		if compiled is None:
+			compiled = cls._compiled_struct = struct.Struct(cls.struct_fmt())
+		return compiled
+
 	@classmethod
 	def len(cls):
-		return struct.calcsize(cls.struct_fmt())
+		return cls.compiled_struct().size
 
 	def __len__(self):
 		return self.len()
@@ -81,9 +138,13 @@ Timestamp = LongLong
 
 
 class String(DataType):
+	"""Values are bytes. Text values are encoded as UTF-8."""
 	len_type = NotImplemented
 	len_max = NotImplemented
 
+	def __init__(self, value):
+		super(String, self).__init__(to_bytes(value))
+
 	def pack(self):
 		length = len(self.value)
 		if length > self.len_max:
@@ -91,10 +152,21 @@ class String(DataType):
 		return self.len_type(length).pack() + self.value
 
 	@classmethod
-	def unpack(cls, data):
-		length, data = cls.len_type.unpack(data)
-		string, data = eat(data, length.value)
-		return cls(string), data
+	def unpack_from(cls, data, offset=0):
+		length, offset = cls.len_type.unpack_from(data, offset)
+		string, offset = take(data, offset, length.value)
+		return cls(string), offset
+
+	@classmethod
+	def skip_from(cls, data, offset=0):
+		len_struct = cls.len_type.compiled_struct()
+		if len(data) < offset + len_struct.size:
+			raise Incomplete
+		length, = len_struct.unpack_from(data, offset)
+		end = offset + len_struct.size + length
+		if len(data) < end:
+			raise Incomplete
+		return end
 
 	def __len__(self):
 		return self.len_type.len() + len(self.value)
@@ -103,7 +175,7 @@ class ShortString(String):
 	len_type = Octet
 	len_max = 255
 	def pack(self):
-		if '\0' in self.value:
+		if b'\0' in self.value:
 			raise ValueError("ShortString cannot contain nul characters")
 		return super(ShortString, self).pack()
 
@@ -152,19 +224,19 @@ def Bits(*name_list):
 					if values.pop(0):
 						mask |= 1 << bit
 				masks.append(mask)
-			return ''.join(Octet(mask).pack() for mask in masks)
+			return b''.join(Octet(mask).pack() for mask in masks)
 
 		@classmethod
-		def unpack(cls, data):
+		def unpack_from(cls, data, offset=0):
 			values = []
 			for x in range(cls.length):
-				mask, data = Octet.unpack(data)
+				mask, offset = Octet.unpack_from(data, offset)
 				mask = mask.value
 				for bit in range(8):
 					values.append(bool(mask & (1 << bit)))
 			# strip out reserved fields and the pad bits at the end
 			values = [value for name, value in zip(cls.all_names, values) if name is not None]
-			return cls(values), data
+			return cls(values), offset
 
 		def get_value(self):
 			return self
@@ -184,28 +256,119 @@ def Bits(*name_list):
 
 
 class ProtocolHeader(DataType):
-	def __init__(self, proto_id='\x00', proto_version='\x00\x09\x01'):
+	def __init__(self, proto_id=b'\x00', proto_version=b'\x00\x09\x01'):
 		self.proto_id = proto_id
 		self.proto_version = proto_version
 		super(ProtocolHeader, self).__init__((proto_id, proto_version))
 
 	def pack(self):
-		return "AMQP" + self.proto_id + self.proto_version
+		return b"AMQP" + self.proto_id + self.proto_version
 
 	@classmethod
-	def unpack(cls, data):
-		amqp, data = eat(data, 4)
-		if amqp != "AMQP":
+	def unpack_from(cls, data, offset=0):
+		amqp, offset = take(data, offset, 4)
+		if amqp != b"AMQP":
 			raise ValueError('Invalid data: Data did not begin with "AMQP"')
-		proto_id, data = eat(data, 1)
-		proto_version, data = eat(data, 3)
-		return cls(proto_id, proto_version), data
+		proto_id, offset = take(data, offset, 1)
+		proto_version, offset = take(data, offset, 3)
+		return cls(proto_id, proto_version), offset
 
 	def __len__(self):
 		return 8
 
 
-class Sequence(DataType):
+class FieldAccessor(object):
+	"""Descriptor generated by SequenceType for each named field (and each named bit) of a Sequence,
+	which reads the field from the instance's raw values.
+	When accessed on the class rather than an instance, returns class_value: the attribute of the same name
+	which the field shadows in a base class, if any (eg. Method.response for connection.SecureOk.response).
+	"""
+	__slots__ = ('index', 'class_value')
+
+	def __init__(self, index, class_value):
+		self.index = index
+		self.class_value = class_value
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self.class_value
+		return instance.raw[self.index]
+
+class OtherFieldAccessor(FieldAccessor):
+	__slots__ = ()
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self.class_value
+		return instance.raw[self.index].get_value()
+
+class BitsFieldAccessor(FieldAccessor):
+	__slots__ = ()
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self.class_value
+		return instance.values[self.index]
+
+class BitAccessor(FieldAccessor):
+	__slots__ = ('bit',)
+
+	def __init__(self, index, bit, class_value):
+		super(BitAccessor, self).__init__(index, class_value)
+		self.bit = bit
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self.class_value
+		return instance.raw[self.index][self.bit]
+
+
+class SequenceType(RegisteredType):
+	"""Metaclass for Sequence, which prepares each subclass's field tables, attribute accessors
+	and compiled codec (see codec.py) once, when the class is defined."""
+
+	ACCESSORS = {STRUCT: FieldAccessor, STRING: FieldAccessor, BITS: BitsFieldAccessor, OTHER: OtherFieldAccessor}
+
+	def __new__(mcs, name, bases, attrs):
+		# instances only hold their raw values, so subclasses don't get a __dict__ unless they ask for one
+		attrs.setdefault('__slots__', ())
+		return super(SequenceType, mcs).__new__(mcs, name, bases, attrs)
+
+	def __init__(cls, name, bases, attrs):
+		super(SequenceType, cls).__init__(name, bases, attrs)
+		if cls.fields is NotImplemented:
+			return
+		# imported here as codec depends on the types defined in this module
+		from .codec import field_kind, compile_sequence
+		cls._kinds = [field_kind(datatype) for datatype in cls.types()]
+		cls._field_info = list(zip(cls.allnames(), cls.types(), cls.defaults(), cls.bitnames(), cls._kinds))
+		# map from attr name to (index into raw, index into bits or None)
+		cls._attrs = {}
+		for index, (name, datatype, kind) in enumerate(zip(cls.allnames(), cls.types(), cls._kinds)):
+			if name is not None:
+				cls._attrs[name] = index, None
+			elif kind == BITS:
+				for bit, bitname in enumerate(datatype.all_names):
+					if bitname is not None:
+						cls._attrs[bitname] = index, bit
+		for attr, (index, bit) in cls._attrs.items():
+			# fields don't replace attributes explicitly defined on the class, or properties from a base class
+			if attr in attrs:
+				continue
+			class_value = getattr(cls, attr, None)
+			if isinstance(class_value, FieldAccessor):
+				class_value = class_value.class_value
+			elif isinstance(class_value, property):
+				continue
+			if bit is None:
+				accessor = cls.ACCESSORS[cls._kinds[index]](index, class_value)
+			else:
+				accessor = BitAccessor(index, bit, class_value)
+			setattr(cls, attr, accessor)
+		encode, decode = compile_sequence(cls)
+		cls._encode = staticmethod(encode)
+		cls._decode = staticmethod(decode)
+
+
+class Sequence(with_metaclass(SequenceType, DataType)):
 	"""Generic class for a datatype which is a fixed sequence of other data types.
 	Data values are accessible as attributes.
 	fields should be a list of (name, type) or (name, type, default).
@@ -213,9 +376,20 @@ class Sequence(DataType):
 		eg. they can be accessed with sequence.name and set in the constructor by kwarg.
 	Otherwise, if name is None, this is treated as an "unused" field which will not be settable
 		except by the default (this is used to implement those annoying "reserved" fields).
+		Unnamed integer and string fields default to 0 and empty string respectively.
 		(This latter part also applies to Bits() names, where None values will always be False)
+	Values are stored in self.raw as a tuple of "raw" values (see codec.py), and are packed and
+	unpacked by functions generated for each subclass. Note that unpack() does not call __init__.
+	Instances have no __dict__, and fields are read from raw by descriptors generated for each subclass,
+	so DataType instances are only created for values when explicitly asked for (see values).
+	Subclasses which set their own instance attributes must list them in __slots__.
+	The original (slower) field-by-field implementation is kept as reference_pack() and
+	reference_unpack(), for testing the generated codecs against.
 	"""
+	__slots__ = ('raw', '_lazy_data')
 	fields = NotImplemented # list of tuples (name, type)
+	# implicit defaults for unnamed (reserved) fields, by kind of field
+	RESERVED_DEFAULTS = {STRUCT: 0, STRING: b''}
 
 	# class methods that are transforms on cls.fields
 	@classmethod
@@ -248,9 +422,8 @@ class Sequence(DataType):
 		values.update(dict(zip(self.names(), args)))
 		values.update(kwargs)
 
-		self.values = ()
-		for name, datatype, default, bitnames in zip(self.allnames(), self.types(),
-		                                             self.defaults(), self.bitnames()):
+		raw = []
+		for name, datatype, default, bitnames, kind in self._field_info:
 			if name is not None and name in values:
 				value = values[name]
 			elif bitnames is not None:
@@ -260,40 +433,97 @@ class Sequence(DataType):
 				value = [values[name] for name in bitnames]
 			elif default is not None:
 				value = default
+			elif name is None and kind in self.RESERVED_DEFAULTS:
+				value = self.RESERVED_DEFAULTS[kind]
 			elif name is None:
 				raise TypeError("Unnamed argument of type {} has no default".format(datatype.__name__))
 			else:
 				raise TypeError("Argument {!r} is required".format(name))
+			raw.append(self._to_raw(datatype, kind, value))
+
+		self.raw = tuple(raw)
 
+	@property
+	def value(self):
+		return self.raw
+
+	@staticmethod
+	def _to_raw(datatype, kind, value):
+		if kind == BITS:
 			if not isinstance(value, datatype):
 				value = datatype(value)
+			return tuple(value.value_list)
+		if kind == OTHER:
+			return value if isinstance(value, datatype) else datatype(value)
+		if isinstance(value, DataType):
+			return value.value
+		return to_bytes(value) if kind == STRING else value
 
-			self.values += (value,)
+	@classmethod
+	def _from_raw(cls, raw):
+		self = cls.__new__(cls)
+		self.raw = raw
+		return self
+
+	@property
+	def values(self):
+		"""The field values as a tuple of DataType instances"""
+		values = ()
+		for datatype, kind, raw in zip(self.types(), self._kinds, self.raw):
+			if kind == BITS:
+				raw = datatype([value for name, value in zip(datatype.all_names, raw) if name is not None])
+			elif kind != OTHER:
+				raw = datatype(raw)
+			values += (raw,)
+		return values
 
-		super(Sequence, self).__init__(self.values)
+	@classmethod
+	def unpack_lazy(cls, data, offset, end):
+		"""Returns an instance whose values are only decoded from data[offset:end] when first accessed.
+		Unlike unpack_from(), the end of the value must be known in advance (eg. the end of a frame).
+		If the data turns out to be invalid, a ValueError is raised on first access."""
+		self = cls.__new__(cls)
+		self._lazy_data = to_str(data[offset:end]) # we keep a copy as the caller may re-use their buffer
+		return self
+
+	def _load(self):
+		data = self._lazy_data
+		del self._lazy_data
+		try:
+			raw, offset = self._decode(data, 0)
+		except Incomplete:
+			_, _, tb = sys.exc_info()
+			ex = ValueError("{} payload reported Incomplete".format(type(self).__name__))
+			reraise(type(ex), ex, tb)
+		if offset != len(data):
+			raise ValueError("Payload had excess bytes: {!r}".format(data[offset:]))
+		self.raw = raw
 
 	def __getattr__(self, attr):
-		for name, value, bitnames in zip(self.allnames(), self.values, self.bitnames()):
-			if name == attr:
-				return value.get_value()
-			if bitnames and attr in bitnames:
-				return getattr(value, attr)
+		# only called for unset slots, in particular raw for lazily unpacked instances
+		if attr == 'raw' and hasattr(self, '_lazy_data'):
+			self._load()
+			return self.raw
 		raise AttributeError(attr)
 
 	def pack(self):
-		return ''.join(value.pack() for value in self.values)
+		return self._encode(self.raw)
 
 	@classmethod
-	def unpack(cls, data):
-		kwargs = {}
-		for name, datatype, bitnames in zip(cls.allnames(), cls.types(), cls.bitnames()):
+	def unpack_from(cls, data, offset=0):
+		raw, offset = cls._decode(data, offset)
+		return cls._from_raw(raw), offset
+
+	def reference_pack(self):
+		return b''.join(value.pack() for value in self.values)
+
+	@classmethod
+	def reference_unpack(cls, data):
+		raw = []
+		for datatype, kind in zip(cls.types(), cls._kinds):
 			value, data = datatype.unpack(data)
-			if name is not None:
-				kwargs[name] = value
-			if bitnames is not None:
-				# map BitType values to bit flag names and update kwargs
-				kwargs.update(dict(zip(bitnames, value.value_list)))
-		return cls(**kwargs), data
+			raw.append(cls._to_raw(datatype, kind, value))
+		return cls._from_raw(tuple(raw)), data
 
 	def __len__(self):
-		return sum(len(value) for value in self.values)
+		return len(self.pack())
@@ -1,10 +1,14 @@
 
+import re
 import sys
 import string
+import struct
 from decimal import Decimal as PyDecimal
 
-from datatypes import DataType, Octet, FromStruct, ShortString, LongString, Timestamp
-from common import eat, Incomplete
+from grabbit.compat import integer_types, native_str, reraise, text_type
+
+from .datatypes import DataType, Octet, Long, FromStruct, ShortString, LongString, Timestamp
+from .common import eat, take, to_str, Incomplete
 
 
 # note that data types defined here (like the Signed integers)
@@ -53,10 +57,10 @@ class Decimal(DataType):
 		return Octet(scale).pack() + SignedLong(value).pack()
 
 	@classmethod
-	def unpack(cls, data):
-		scale, data = Octet.unpack(data)
+	def unpack_from(cls, data, offset=0):
+		scale, offset = Octet.unpack_from(data, offset)
 		scale = scale.value
-		value, data = SignedLong.unpack(data)
+		value, offset = SignedLong.unpack_from(data, offset)
 		value = value.value
 		sign = 0
 		if value < 0:
@@ -65,102 +69,285 @@ class Decimal(DataType):
 		digits = []
 		while value:
 			digits.append(value % 10)
-			value /= 10
+			value //= 10
 		digits = digits[::-1]
 		exponent = -scale
-		return cls(PyDecimal((sign, digits, exponent))), data
+		return cls(PyDecimal((sign, digits, exponent))), offset
 
 
 class Void(DataType):
 	def __init__(self):
 		super(Void, self).__init__(None)
 	def pack(self):
-		return ''
+		return b''
 	@classmethod
-	def unpack(cls, data):
-		return Void(), data
+	def unpack_from(cls, data, offset=0):
+		return Void(), offset
 
 
 class FieldName(ShortString):
 	len_max = 128
-	FIRSTCHARS = set(string.letters) | {'$', '#'}
+	FIRSTCHARS = set(string.ascii_letters) | {'$', '#'}
 	CHARS = FIRSTCHARS | set(string.digits) | {'_'}
+	VALID = re.compile(br'[a-zA-Z$#][a-zA-Z0-9$#_]*\Z')
 	def pack(self):
-		first, rest = eat(self.value, 1)
+		if self.VALID.match(self.value):
+			return super(FieldName, self).pack()
+		# find the offending character to report
+		first, rest = eat(self.value.decode('latin-1'), 1)
 		if first not in self.FIRSTCHARS:
-			raise ValueError("Illegal character {} as first character of field name".format(first))
+			raise ValueError("Illegal character {!r} as first character of field name".format(first))
 		for c in rest:
 			if c not in self.CHARS:
-				raise ValueError("Illegal character {} in field name".format(c))
+				raise ValueError("Illegal character {!r} in field name".format(c))
 		return super(FieldName, self).pack()
 
 
 class FieldArray(DataType):
 	"""Expects an iterable value"""
 	def pack(self):
-		payload = ''
-		for item in self.value:
-			if not isinstance(item, DataType):
-				item = field_type_coerce(item)
-			field_type = type(item)
-			field_specifier = FIELD_SPECIFIERS[field_type]
-			payload += field_specifier + item.pack()
-		return LongString(payload).pack()
+		return pack_array(self.value)
 
 	@classmethod
-	def unpack(cls, data):
-		payload, data = LongString.unpack(data)
-		payload = payload.value
+	def unpack_from(cls, data, offset=0):
+		offset, end = unpack_payload_bounds(data, offset)
 		values = []
 		try:
-			while payload:
-				type_specifier, payload = eat(payload, 1)
+			while offset < end:
+				type_specifier, offset = take(data, offset, 1)
 				field_type = FIELD_TYPES[type_specifier]
-				value, payload = field_type.unpack(payload)
+				value, offset = field_type.unpack_from(data, offset)
 				values.append(value)
 		except Incomplete:
 			_, _, tb = sys.exc_info()
 			ex = ValueError("FieldArray payload reported Incomplete")
-			raise type(ex), ex, tb
-		return cls(values), data
+			reraise(type(ex), ex, tb)
+		if offset > end:
+			raise ValueError("FieldArray payload reported Incomplete")
+		return cls(values), end
+
+	@classmethod
+	def skip_from(cls, data, offset=0):
+		offset, end = unpack_payload_bounds(data, offset)
+		return end
 
 	def get_value(self):
-		return [item.get_value() for item in self.value]
+		return [item.get_value() if isinstance(item, DataType) else item for item in self.value]
 
 
 class FieldTable(DataType):
-	"""Expects a dict value"""
+	"""Expects a dict value.
+	If unpacked with lazy=True, only the field names are decoded up front. Each value is decoded
+	when it is first looked up with table[name] or table.get(name), or all at once when the whole
+	value is needed (eg. by get_value()).
+	"""
+	__slots__ = ('_value', '_pending', '_data')
+
+	def __init__(self, value):
+		self._pending = {} # {name: (field type, offset into self._data)} for values not yet decoded
+		self._data = None
+		super(FieldTable, self).__init__(value)
+
+	def _get_value(self):
+		for name in list(self._pending):
+			self._load(name)
+		return self._value
+	def _set_value(self, value):
+		self._value = value
+	value = property(_get_value, _set_value)
+
+	def _load(self, name):
+		field_type, offset = self._pending.pop(name)
+		self._value[name], offset = field_type.unpack_from(self._data, offset)
+		if not self._pending:
+			self._data = None
+
+	def __getitem__(self, name):
+		"""Returns the python value of the named field, decoding only that field if needed"""
+		if name in self._pending:
+			self._load(name)
+		value = self._value[name]
+		return value.get_value() if isinstance(value, DataType) else value
+
+	def get(self, name, default=None):
+		try:
+			return self[name]
+		except KeyError:
+			return default
+
+	def __contains__(self, name):
+		return name in self._value or name in self._pending
+
+	def keys(self):
+		return list(self._value) + list(self._pending)
+
 	def pack(self):
-		payload = ''
-		for name, value in self.value.items():
-			if not isinstance(value, DataType):
-				value = field_type_coerce(value)
-			field_type = type(value)
-			field_specifier = FIELD_SPECIFIERS[field_type]
-			payload += FieldName(name).pack() + field_specifier + value.pack()
-		return LongString(payload).pack()
+		return pack_table(self.value)
 
 	@classmethod
-	def unpack(cls, data):
-		payload, data = LongString.unpack(data)
-		payload = payload.value
+	def unpack_from(cls, data, offset=0, lazy=False):
+		offset, end = unpack_payload_bounds(data, offset)
+		table_end = end
+		if lazy:
+			# we keep a copy of only the payload, as the caller may re-use their buffer
+			data, offset, end = to_str(data[offset:end]), 0, end - offset
 		values = {}
+		pending = {}
 		try:
-			while payload:
-				name, payload = FieldName.unpack(payload)
-				name = name.value
-				type_specifier, payload = eat(payload, 1)
+			while offset < end:
+				if lazy:
+					# we can take some shortcuts here as we know data is bytes
+					name_end = offset + 1 + _octet.unpack_from(data, offset)[0]
+					name = native_str(data[offset + 1:name_end])
+					field_type = FIELD_TYPES[data[name_end:name_end + 1]]
+					pending[name] = field_type, name_end + 1
+					offset = field_type.skip_from(data, name_end + 1)
+					continue
+				name, offset = FieldName.unpack_from(data, offset)
+				name = native_str(name.value)
+				type_specifier, offset = take(data, offset, 1)
 				field_type = FIELD_TYPES[type_specifier]
-				value, payload = field_type.unpack(payload)
+				value, offset = field_type.unpack_from(data, offset)
 				values[name] = value
+		except KeyError as ex:
+			raise ValueError("Unknown field type in FieldTable: {}".format(ex))
 		except Incomplete:
 			_, _, tb = sys.exc_info()
 			ex = ValueError("FieldTable payload reported Incomplete")
-			raise type(ex), ex, tb
-		return cls(values), data
+			reraise(type(ex), ex, tb)
+		if offset > end:
+			raise ValueError("FieldTable payload reported Incomplete")
+		table = cls(values)
+		if pending:
+			table._pending, table._data = pending, data
+		return table, table_end
+
+	@classmethod
+	def skip_from(cls, data, offset=0):
+		offset, end = unpack_payload_bounds(data, offset)
+		return end
 
 	def get_value(self):
-		return {name: value.get_value() for name, value in self.value.items()}
+		return {
+			name: value.get_value() if isinstance(value, DataType) else value
+			for name, value in self.value.items()
+		}
+
+
+def unpack_payload_bounds(data, offset):
+	"""FieldTables and FieldArrays are encoded as a LongString payload.
+	Returns (start, end) offsets of the payload starting at offset, or raises Incomplete
+	if data does not contain the entire payload. Note that the payload itself is not copied."""
+	length, offset = Long.unpack_from(data, offset)
+	end = offset + length.value
+	if len(data) < end:
+		raise Incomplete
+	return offset, end
+
+
+class FieldNameCache(object):
+	"""A bounded cache of packed, validated field names, since the same few header names
+	tend to appear in every message.
+	This approximates LRU with two generations, so that a hit is a single dict lookup:
+	names are added to the recent generation, and when it fills up it replaces the old one.
+	A name found in the old generation is moved back to the recent one, so only names
+	not used for a full generation are evicted, and at most size names are kept.
+	"""
+
+	def __init__(self, size=1024):
+		self.size = size
+		self.recent = {}
+		self.old = {}
+
+	def pack(self, name):
+		packed = self.recent.get(name)
+		if packed is not None:
+			return packed
+		packed = self.old.get(name)
+		if packed is None:
+			packed = FieldName(name).pack()
+		if len(self.recent) >= self.size // 2:
+			self.old, self.recent = self.recent, {}
+		self.recent[name] = packed
+		return packed
+
+	def clear(self):
+		self.recent = {}
+		self.old = {}
+
+
+field_names = FieldNameCache(4096)
+
+
+def pack_table(table):
+	"""Packs a dict as a FieldTable. Output is built in a single pass."""
+	parts = []
+	pack_name = field_names.pack
+	for name, value in table.items():
+		parts.append(pack_name(name))
+		pack_field_value(value, parts)
+	return pack_payload(parts)
+
+
+def pack_array(values):
+	"""Packs an iterable as a FieldArray. Output is built in a single pass."""
+	parts = []
+	for value in values:
+		pack_field_value(value, parts)
+	return pack_payload(parts)
+
+
+def pack_payload(parts):
+	payload = b''.join(parts)
+	if len(payload) > LongString.len_max:
+		raise ValueError("Payload too long for {}: {} > {}".format(LongString.__name__, len(payload), LongString.len_max))
+	return _long.pack(len(payload)) + payload
+
+
+def pack_field_value(value, parts):
+	"""Appends the type specifier and packed value to the list parts.
+	Common python types are dispatched on exact type, anything else goes through field_type_coerce()."""
+	encoder = VALUE_ENCODERS.get(type(value))
+	if encoder is None:
+		if not isinstance(value, DataType):
+			value = field_type_coerce(value)
+		encoder = pack_datatype
+	encoder(value, parts)
+
+
+def pack_datatype(value, parts):
+	# nested tables and arrays have their (possibly lazy) value packed directly
+	if isinstance(value, FieldTable):
+		parts += [b'F', pack_table(value.value)]
+	elif isinstance(value, FieldArray):
+		parts += [b'A', pack_array(value.value)]
+	else:
+		parts += [FIELD_SPECIFIERS[type(value)], value.pack()]
+
+
+def pack_str(value, parts):
+	parts += [_string_header.pack(b'S', len(value)), value]
+
+
+_octet = Octet.compiled_struct()
+_long = Long.compiled_struct()
+_string_header = struct.Struct('!cL')
+_long_long = struct.Struct('!cq')
+_double = struct.Struct('!cd')
+
+# encoders for the python types we can encode without creating DataType instances
+VALUE_ENCODERS = {
+	bool: lambda value, parts: parts.append(b't\x01' if value else b't\x00'),
+	float: lambda value, parts: parts.append(_double.pack(b'd', value)),
+	bytes: pack_str,
+	text_type: lambda value, parts: pack_str(value.encode('utf-8'), parts),
+	dict: lambda value, parts: parts.extend([b'F', pack_table(value)]),
+	list: lambda value, parts: parts.extend([b'A', pack_array(value)]),
+	tuple: lambda value, parts: parts.extend([b'A', pack_array(value)]),
+	type(None): lambda value, parts: parts.append(b'V'),
+}
+for _type in integer_types:
+	VALUE_ENCODERS[_type] = lambda value, parts: parts.append(_long_long.pack(b'l', value))
 
 
 def field_type_coerce(value):
@@ -168,20 +355,11 @@ def field_type_coerce(value):
 	We prefer consistency over the smallest possible representation.
 	We then return the coverted value.
 	"""
-	type_map = {
-		bool: Boolean,
-		int: SignedLongLong,
-		long: SignedLongLong,
-		float: Double,
-		PyDecimal: Decimal,
-		str: LongString,
-		dict: FieldTable
-	}
-	if isinstance(value, unicode):
+	if isinstance(value, text_type):
 		# if you care about your encoding, you should be doing it yourself
 		# as a sensible default, we use UTF-8
 		value = value.encode('utf-8')
-	for type, datatype in type_map.items():
+	for type, datatype in COERCE_TYPES:
 		if isinstance(value, type):
 			return datatype(value)
 	if value is None:
@@ -200,21 +378,31 @@ def field_type_coerce(value):
 # NOTE: These definitions are what is used by RabbitMQ, NOT what is defined by the spec.
 # source: https://www.rabbitmq.com/amqp-0-9-1-errata.html as of 2014-04-05
 FIELD_TYPES = {
-	't': Boolean,
-	'b': SignedOctet,
-	's': SignedShort,
-	'I': SignedLong,
-	'l': SignedLongLong,
-	'f': Float,
-	'd': Double,
-	'D': Decimal,
-	'S': LongString,
-	'A': FieldArray,
-	'T': Timestamp,
-	'F': FieldTable,
-	'V': Void,
-	'x': LongString, # NOTE: This is properly defined as "byte array" but the format is identical
+	b't': Boolean,
+	b'b': SignedOctet,
+	b's': SignedShort,
+	b'I': SignedLong,
+	b'l': SignedLongLong,
+	b'f': Float,
+	b'd': Double,
+	b'D': Decimal,
+	b'S': LongString,
+	b'A': FieldArray,
+	b'T': Timestamp,
+	b'F': FieldTable,
+	b'V': Void,
+	b'x': LongString, # NOTE: This is properly defined as "byte array" but the format is identical
 	                 #       to LongString. We treat them as the same since we make no attempt at text encoding.
 }
 FIELD_SPECIFIERS = {v: k for k, v in FIELD_TYPES.items()}
-FIELD_SPECIFIERS[LongString] = 'S' # we need to specify this manually as it appears in FIELD_TYPES twice
+FIELD_SPECIFIERS[LongString] = b'S' # we need to specify this manually as it appears in FIELD_TYPES twice
+
+# checked in order, as eg. a bool is also an int
+COERCE_TYPES = [
+	(bool, Boolean),
+	(integer_types, SignedLongLong),
+	(float, Double),
+	(PyDecimal, Decimal),
+	(bytes, LongString),
+	(dict, FieldTable),
+]
@@ -1,9 +1,12 @@
 import sys
 
-from datatypes import DataType, Octet, Short, Long, LongLong, Sequence
-from properties import Properties
-from common import eat, Incomplete
-from method import Method
+from grabbit.compat import reraise
+from grabbit.errors import FrameError
+
+from .datatypes import DataType, Octet, Short, Long, LongLong, Sequence
+from .properties import Properties
+from .common import take, to_str, Incomplete
+from .method import Method
 
 
 class FrameHeader(Sequence):
@@ -15,6 +18,7 @@ class FrameHeader(Sequence):
 
 
 class MethodPayload(Sequence):
+	__slots__ = ('method',)
 	fields = [
 		('method_class', Short),
 		('method_id', Short),
@@ -38,12 +42,19 @@ class MethodPayload(Sequence):
 		return super(MethodPayload, self).pack() + self.method.pack()
 
 	@classmethod
-	def unpack(cls, data):
-		method_class, data = Short.unpack(data)
-		method_id, data = Short.unpack(data)
-		method_type = Method.from_id(method_class.value, method_id.value)
-		method, data = method_type.unpack(data)
-		return cls(method), data
+	def unpack_from(cls, data, offset=0):
+		(method_class, method_id), offset = cls._decode(data, offset)
+		method_type = Method.from_id(method_class, method_id)
+		method, offset = method_type.unpack_from(data, offset)
+		return cls(method), offset
+
+	@classmethod
+	def unpack_lazy(cls, data, offset, end):
+		"""As per Sequence.unpack_lazy(), the method's fields are decoded when first accessed.
+		The method type itself is decoded immediately."""
+		(method_class, method_id), offset = cls._decode(data, offset)
+		method_type = Method.from_id(method_class, method_id)
+		return cls(method_type.unpack_lazy(data, offset, end))
 
 
 class ContentHeaderPayload(Sequence):
@@ -59,23 +70,38 @@ class ContentHeaderPayload(Sequence):
 			properties = Properties.get_by_class(method_class)(properties)
 		super(ContentHeaderPayload, self).__init__(method_class, 0, body_size, properties)
 
+	@property
+	def properties(self):
+		"""The Properties instance itself, rather than a dict of its values, so that lazily-unpacked
+		properties are only decoded as they are accessed. Use properties.get_value() for a dict."""
+		return self.raw[3]
+
 	@classmethod
-	def unpack(cls, data):
+	def unpack_from(cls, data, offset=0, lazy=False):
+		"""If lazy is True, properties are decoded lazily. See Properties."""
 		# we special-case as we need properties unpack class to change according to method_class
-		method_class, data = Octet.unpack(data)
-		weight, data = Octet.unpack(data)
-		body_size, data = LongLong.unpack(data)
-		properties, data = Properties.get_by_class(method_class).unpack(data)
-		return cls(method_class, body_size, properties)
+		method_class, offset = Short.unpack_from(data, offset)
+		weight, offset = Short.unpack_from(data, offset)
+		body_size, offset = LongLong.unpack_from(data, offset)
+		properties, offset = Properties.get_by_class(method_class.value).unpack_from(data, offset, lazy=lazy)
+		return cls(method_class, body_size, properties), offset
 
 
 class ContentPayload(DataType):
+	"""The value is a str, or any other buffer such as a memoryview slice of a larger message body.
+	Buffers are passed through as-is by pack_buffers(), and so are never copied."""
+
 	def pack(self):
-		return self.value
+		return to_str(self.value)
+
+	def pack_buffers(self):
+		return [self.value]
 
 	@classmethod
-	def unpack(cls, data):
-		return cls(data), '' # eat it all! because we know we're only being passed the frame body.
+	def unpack_from(cls, data, offset=0):
+		# eat it all! because we know we're only being passed the frame body.
+		body, offset = take(data, offset, len(data) - offset)
+		return cls(body), offset
 
 
 class HeartbeatPayload(Sequence):
@@ -83,7 +109,9 @@ class HeartbeatPayload(Sequence):
 
 
 class Frame(DataType):
-	FRAME_END = '\xCE'
+	__slots__ = ('type', 'channel', 'payload')
+	FRAME_END = b'\xCE'
+	OVERHEAD = 8 # bytes in a frame other than the payload, ie. header and frame end
 	METHOD_TYPE, HEADER_TYPE, BODY_TYPE, HEARTBEAT_TYPE = range(1, 5)
 	payload_types = {
 		1: MethodPayload,
@@ -100,30 +128,105 @@ class Frame(DataType):
 			self.payload, = payload
 		else:
 			self.payload = payload_type(*payload)
-		super(Frame, self).__init__((self.type, self.channel, self.payload))
+
+	@property
+	def value(self):
+		return self.type, self.channel, self.payload
 
 	def pack(self):
 		payload = self.payload.pack()
 		header = FrameHeader(self.type, self.channel, len(payload))
 		return header.pack() + payload + self.FRAME_END
 
+	def pack_buffers(self):
+		"""As pack(), but returns the frame as a list of buffers (header, payload buffers, frame end)
+		without copying any message body. The list can be sent with send_buffers() or socket.sendmsg()."""
+		payload = self.payload.pack_buffers()
+		size = sum(len(buf) for buf in payload)
+		return [FrameHeader._encode((self.type, self.channel, size))] + payload + [self.FRAME_END]
+
 	@classmethod
-	def unpack(cls, data):
-		header, data = FrameHeader.unpack(data)
-		payload, data = eat(data, header.size)
-		frame_end, data = eat(data, 1)
+	def unpack_from(cls, data, offset=0, lazy=False):
+		"""If lazy is True, method fields and content header properties are not decoded until accessed.
+		This saves work when only some values are needed, eg. the delivery_tag of a basic.Deliver.
+		Note that this means some errors in the payload are not raised until then."""
+		(frame_type, channel, size), offset = FrameHeader._decode(data, offset)
+		end = offset + size
+		frame_end, frame_end_offset = take(data, end, 1)
 		if frame_end != cls.FRAME_END:
 			raise ValueError("Framing error: Frame ended with {!r}, not {!r}".format(frame_end, cls.FRAME_END))
-		payload_type = cls.payload_types[header.type]
 		try:
-			payload, leftover = payload_type.unpack(payload)
-		except Incomplete:
-			_, _, tb = sys.exc_info()
-			ex = ValueError("Frame payload reported Incomplete")
-			raise type(ex), ex, tb
-		if leftover:
-			raise ValueError("Payload had excess bytes: {!r}".format(leftover))
-		return cls(header.type, header.channel, payload), data
+			payload_type = cls.payload_types[frame_type]
+		except KeyError:
+			raise FrameError("Unknown frame type", type=frame_type)
+		if payload_type is ContentPayload:
+			# content payloads are the entire frame body, so we must tell it where the body ends
+			payload = ContentPayload(take(data, offset, size)[0])
+			payload_end = end
+		elif lazy and payload_type is MethodPayload:
+			payload = MethodPayload.unpack_lazy(data, offset, end)
+			payload_end = end
+		else:
+			# other payloads know their own length. We check they used exactly the whole frame body after.
+			try:
+				if lazy and payload_type is ContentHeaderPayload:
+					payload, payload_end = payload_type.unpack_from(data, offset, lazy=True)
+				else:
+					payload, payload_end = payload_type.unpack_from(data, offset)
+			except Incomplete:
+				_, _, tb = sys.exc_info()
+				ex = ValueError("Frame payload reported Incomplete")
+				reraise(type(ex), ex, tb)
+		if payload_end > end:
+			raise ValueError("Frame payload reported Incomplete")
+		if payload_end < end:
+			raise ValueError("Payload had excess bytes: {!r}".format(take(data, payload_end, end - payload_end)[0]))
+		return cls(frame_type, channel, payload), frame_end_offset
 
 	def get_value(self):
 		return self
+
+
+# Buffers smaller than this are combined into one before sending when scatter-gather IO is not available.
+# Above this size, the cost of the extra syscall to send it seperately is less than the cost of the copy.
+SEND_COALESCE_SIZE = 16384
+# Maximum number of buffers that can be passed to one sendmsg() call (this is IOV_MAX on linux)
+SEND_MAX_BUFFERS = 1024
+
+
+def send_buffers(sock, buffers, capture=None):
+	"""Send all the given buffers (eg. from Frame.pack_buffers()) to the socket sock, in order.
+	Where sock supports sendmsg() (python 3), the buffers are sent with scatter-gather IO without copying.
+	Otherwise, consecutive small buffers are combined and large ones are passed to sendall() as they are.
+	If capture is given (a capture.CaptureWriter), each frame sent is written to it. The buffers must
+	then make up a sequence of complete frames.
+	"""
+	if capture:
+		# imported here as capture depends on this module
+		from .capture import OUT
+		capture.write_frames(OUT, buffers)
+	if hasattr(sock, 'sendmsg'):
+		views = [memoryview(buf) for buf in buffers]
+		while views:
+			sent = sock.sendmsg(views[:SEND_MAX_BUFFERS])
+			# discard what was sent, which may end part-way through a buffer
+			index = 0
+			while index < len(views) and sent >= len(views[index]):
+				sent -= len(views[index])
+				index += 1
+			views = views[index:]
+			if sent:
+				views[0] = views[0][sent:]
+		return
+
+	pending = []
+	for buf in buffers:
+		if len(buf) < SEND_COALESCE_SIZE:
+			pending.append(to_str(buf))
+			continue
+		if pending:
+			sock.sendall(b''.join(pending))
+			pending = []
+		sock.sendall(buf)
+	if pending:
+		sock.sendall(b''.join(pending))
@@ -1,7 +1,7 @@
 
-from grabbit.common import get_all_subclasses
+from grabbit.common import Registry
 
-from datatypes import Sequence
+from .datatypes import Sequence
 
 class Method(Sequence):
 	"""Subclass this class to define a method of the given method_class and method_id.
@@ -11,18 +11,26 @@ class Method(Sequence):
 	Attribute "has_content" indicates that the method is to be followed by content frames,
 		and defaults to False.
 	Don't forget to define fields as per datatype.Sequence
+	Subclasses with both method_class and method_id set are registered in Method.registry
+	as they are defined, and defining two methods with the same ids is an error.
 	"""
+	registry = Registry('method')
 	method_class = NotImplemented
 	method_id = NotImplemented
 	response = None
 	has_content = False
 
+	@classmethod
+	def registry_key(cls):
+		if NotImplemented in (cls.method_class, cls.method_id):
+			return None
+		return cls.method_class, cls.method_id
+
 	@classmethod
 	def from_id(cls, method_class, method_id):
 		"""Look up Method class based on method_class and method_id numbers."""
-		for method in get_all_subclasses(Method):
-			if method.method_class == method_class and method.method_id == method_id:
-				return method
-		else:
+		try:
+			return cls.registry.lookup((method_class, method_id))
+		except KeyError:
 			raise ValueError("Unknown method for class {} and method_id {}".format(method_class, method_id))
 
@@ -1,7 +1,15 @@
 
-from grabbit.common import get_all_subclasses
+import struct
 
-from datatypes import DataType, Short
+from grabbit.common import Registry, RegisteredType
+from grabbit.compat import to_bytes, with_metaclass
+
+from .datatypes import DataType, Short
+from .fieldtable import FieldTable
+from .common import to_str, Incomplete, STRING, OTHER
+
+
+_short = Short.compiled_struct()
 
 
 class PropertyBit(DataType):
@@ -9,42 +17,278 @@ class PropertyBit(DataType):
 	pass
 
 
-class Properties(DataType):
+class PropertyAccessor(object):
+	"""Descriptor generated by PropertiesType for each property, which returns its raw value
+	(decoding it first if needed), or None if the property is not present."""
+	__slots__ = ('name',)
+
+	def __init__(self, name):
+		self.name = name
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self
+		if self.name in instance._pending:
+			instance._load(self.name)
+		return instance._values.get(self.name)
+
+
+class ShapeCache(object):
+	"""A bounded cache of PropertiesShapes, approximating LRU with two generations as FieldNameCache does:
+	shapes are added to the recent generation, and when it fills up it replaces the old one. A shape found
+	in the old generation is moved back to the recent one, so only shapes not used for a full generation are
+	evicted, and at most size are kept. So a peer sending many different sets of properties can't crowd
+	out the common ones for good, only make them be compiled again.
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.recent = {}
+		self.old = {}
+
+	def __len__(self):
+		return len(self.recent) + len(self.old)
+
+	def get(self, key):
+		shape = self.recent.get(key)
+		if shape is None:
+			shape = self.old.get(key)
+			if shape is not None:
+				self.add(key, shape)
+		return shape
+
+	def add(self, key, shape):
+		if len(self.recent) >= self.size // 2:
+			self.old, self.recent = self.recent, {}
+		self.recent[key] = shape
+
+
+class PropertiesType(RegisteredType):
+	"""Metaclass for Properties, which prepares each subclass's property types and accessors
+	when the class is defined."""
+
+	def __new__(mcs, name, bases, attrs):
+		# as per Sequence, instances only hold raw values, so don't need a __dict__
+		attrs.setdefault('__slots__', ())
+		return super(PropertiesType, mcs).__new__(mcs, name, bases, attrs)
+
+	def __init__(cls, name, bases, attrs):
+		super(PropertiesType, cls).__init__(name, bases, attrs)
+		if cls.property_map is NotImplemented:
+			return
+		# imported here to match Sequence, as codec depends on the types defined in datatypes
+		from .codec import field_kind
+		cls._types = {name: (datatype, field_kind(datatype)) for name, datatype in cls.property_map}
+		cls._indexes = {name: index for index, (name, datatype) in enumerate(cls.property_map)}
+		cls._bits = [name for name, datatype in cls.property_map if datatype == PropertyBit]
+		# caches of PropertiesShape by set of present properties, and by flag words
+		cls._shapes = ShapeCache(cls.SHAPE_CACHE_SIZE)
+		cls._shapes_by_masks = ShapeCache(cls.SHAPE_CACHE_SIZE)
+		for name, datatype in cls.property_map:
+			setattr(cls, name, PropertyAccessor(name))
+
+
+class PropertiesShape(object):
+	"""The packed flags and a compiled codec (see codec.py) for the values of one particular
+	set of present properties of a Properties subclass, eg. {content_type, delivery_mode}.
+	For PropertyBits, the set contains those which are True.
+	"""
+	__slots__ = ('present', 'masks', 'flags', 'names', 'bits', 'encode', 'decode')
+
+	def __init__(self, cls, present):
+		self.present = present = frozenset(present)
+		# imported here to match Sequence, as codec depends on the types defined in datatypes
+		from .codec import compile_codec
+		# presence of a property is encoded as a bit in 16-bit words (highest first)
+		# last bit of each word is 1 if there is another word coming, else 0
+		masks = [0] * ((len(cls.property_map) + 14) // 15)
+		for name in present:
+			index = cls._indexes[name]
+			masks[index // 15] |= 1 << (15 - index % 15)
+		for word in range(len(masks) - 1):
+			masks[word] |= 1
+		self.masks = tuple(masks)
+		self.flags = struct.pack('!{}H'.format(len(masks)), *masks)
+		# the names of properties with values, in the order they're packed
+		self.names = [name for name, datatype in cls.property_map if name in present and datatype != PropertyBit]
+		# special case for PropertyBit - presence encodes a value of True, otherwise False
+		self.bits = {name: name in present for name in cls._bits}
+		self.encode, self.decode = compile_codec(
+			'{}({})'.format(cls.__name__, ', '.join(self.names)),
+			[cls._types[name][0] for name in self.names],
+			prefix=self.flags,
+		)
+
+	@classmethod
+	def from_masks(cls, properties_cls, masks):
+		present = set()
+		for word, mask in enumerate(masks):
+			for bit in range(15, 0, -1):
+				if not mask & (1 << bit):
+					continue
+				index = word * 15 + 15 - bit
+				if index >= len(properties_cls.property_map):
+					raise ValueError("Property bit out of range for {}".format(properties_cls.__name__))
+				present.add(properties_cls.property_map[index][0])
+		return cls(properties_cls, present)
+
+
+class Properties(with_metaclass(PropertiesType, DataType)):
+	"""Property values are accessible as attributes, which are None for properties that are not present.
+	As with Sequence, values are stored "raw" (see codec.py): python values for simple types,
+	bools for PropertyBits and DataType instances for anything else (ie. FieldTables),
+	and DataType instances for all values are only created when explicitly asked for (see values).
+	If unpacked with lazy=True, each property is only decoded when first accessed as an attribute,
+	or when all values are needed (eg. by get_value()). FieldTable properties are also decoded lazily,
+	see FieldTable.
+	Values are packed and unpacked with a codec compiled for each set of present properties,
+	see PropertiesShape. Codecs for the most recently used sets are cached (up to SHAPE_CACHE_SIZE of them,
+	see ShapeCache).
+	"""
+	__slots__ = ('_values', '_pending', '_data')
+	# max number of distinct sets of present properties to keep compiled codecs for, per subclass
+	SHAPE_CACHE_SIZE = 256
+	registry = Registry('properties method class')
 	method_class = NotImplemented
 	property_map = NotImplemented # list of tuples (property name, property type)
 
+	@classmethod
+	def registry_key(cls):
+		return None if cls.method_class is NotImplemented else cls.method_class
+
 	def __init__(self, values):
 		"""Values should be a dict"""
-		self.values = {}
+		self._pending = {} # {name: (datatype, offset into self._data)} for properties not yet decoded
+		self._data = None
+		self._values = {} # {name: raw value}
 		for name, value in values.items():
-			for _name, _type in self.property_map:
-				if _name == name:
-					value_type = _type
-					break
-			else:
+			try:
+				datatype, kind = self._types[name]
+			except KeyError:
 				raise TypeError("{} not a valid property for this method class".format(name))
-			if not isinstance(value, value_type):
-				value = value_type(value)
-			self.values[name] = value
+			self._values[name] = self._to_raw(datatype, kind, value)
 		# special case for PropertyBit - always present, default False
-		for name, type in self.property_map:
-			if type == PropertyBit:
-				self.values.setdefault(name, PropertyBit(False))
-		super(Properties, self).__init__(self.values)
+		for name in self._bits:
+			self._values.setdefault(name, False)
+
+	@staticmethod
+	def _to_raw(datatype, kind, value):
+		if kind == OTHER and datatype != PropertyBit:
+			return value if isinstance(value, datatype) else datatype(value)
+		if isinstance(value, DataType):
+			value = value.value
+		if kind == STRING:
+			return to_bytes(value)
+		return bool(value) if datatype == PropertyBit else value
+
+	@property
+	def raw(self):
+		"""Dict of the raw values of all present properties"""
+		for name in list(self._pending):
+			self._load(name)
+		return self._values
 
-	def __getattr__(self, attr):
-		for name, type in self.property_map:
-			if name == attr:
-				return self.values[name]
-		raise AttributeError(attr)
+	@property
+	def values(self):
+		"""Dict of all present properties as DataType instances"""
+		values = {}
+		for name, raw in self.raw.items():
+			datatype, kind = self._types[name]
+			values[name] = raw if isinstance(raw, DataType) else datatype(raw)
+		return values
+	value = values
+
+	def _load(self, name):
+		datatype, offset = self._pending.pop(name)
+		if issubclass(datatype, FieldTable):
+			value, offset = datatype.unpack_from(self._data, offset, lazy=True)
+		else:
+			value, offset = datatype.unpack_from(self._data, offset)
+			value = value.value
+		self._values[name] = value
+		if not self._pending:
+			self._data = None
 
 	def get_value(self):
-		return {key: value.get_value() for key, value in self.values.items()}
+		return {name: raw.get_value() if isinstance(raw, DataType) else raw for name, raw in self.raw.items()}
+
+	@classmethod
+	def _from_raw(cls, values):
+		self = cls.__new__(cls)
+		self._values = values
+		self._pending = {}
+		self._data = None
+		return self
+
+	@classmethod
+	def _cache_shape(cls, shape, present=None, masks=None):
+		cls._shapes.add(present or shape.present, shape)
+		# a peer may send flags differently to how we pack them, eg. with extra zero words
+		cls._shapes_by_masks.add(masks or shape.masks, shape)
+
+	def shape(self):
+		"""Returns the PropertiesShape for the properties present in this instance"""
+		values = self.raw if self._pending else self._values
+		if self._bits:
+			present = frozenset(name for name, value in values.items() if value is not False or name not in self._bits)
+		else:
+			present = frozenset(values)
+		shape = self._shapes.get(present)
+		if shape is None:
+			shape = PropertiesShape(type(self), present)
+			self._cache_shape(shape)
+		return shape
 
 	def pack(self):
-		# presence of a property is encoded as a bit in 16-bit words (highest first)
-		# last bit of each word is 1 if there is another word coming, else 0
+		shape = self.shape()
+		values = self._values
+		return shape.encode(tuple([values[name] for name in shape.names]))
+
+	def pack_flags(self):
+		"""Returns the packed property flags, and a list of (name, value) for the present properties
+		whose values follow the flags, in order."""
+		shape = self.shape()
+		values = self.values
+		return shape.flags, [(name, values[name]) for name in shape.names]
+
+	@classmethod
+	def unpack_from(cls, data, offset=0, lazy=False):
+		masks = ()
+		while True:
+			if len(data) < offset + 2:
+				raise Incomplete
+			mask, = _short.unpack_from(data, offset)
+			offset += 2
+			masks += (mask,)
+			if not mask & 1:
+				break
+		shape = cls._shapes_by_masks.get(masks)
+		if shape is None:
+			shape = PropertiesShape.from_masks(cls, masks)
+			cls._cache_shape(shape, masks=masks)
+
+		if not lazy:
+			raw, offset = shape.decode(data, offset)
+			values = dict(shape.bits)
+			values.update(zip(shape.names, raw))
+			return cls._from_raw(values), offset
+
+		# find where each value is, then keep a copy of just the values as the caller may re-use their buffer
+		start = offset
+		pending = {}
+		for name in shape.names:
+			datatype, kind = cls._types[name]
+			pending[name] = datatype, offset - start
+			offset = datatype.skip_from(data, offset)
+		properties = cls._from_raw(dict(shape.bits))
+		if pending:
+			properties._pending, properties._data = pending, to_str(data[start:offset])
+		return properties, offset
+
+	def reference_pack(self):
+		"""The original (slower) implementation of pack(), kept for testing the compiled codecs against"""
 		properties = self.property_map[:]
+		values = self.values
 		masks = []
 		value_list = []
 		while properties:
@@ -52,10 +296,9 @@ class Properties(DataType):
 			for bit in range(15, 0, -1):
 				if not properties: break
 				name, datatype = properties.pop(0)
-				if name in self.values:
-					value = self.values[name]
+				if name in values:
+					value = values[name]
 					if datatype == PropertyBit:
-						# special case for PropertyBit - encode value (default False) instead of presence
 						if value.value: mask |= 1 << bit
 						continue
 					mask |= 1 << bit
@@ -63,12 +306,11 @@ class Properties(DataType):
 			if properties:
 				mask |= 1
 			masks.append(mask)
-		masks = ''.join(Short(mask).pack() for mask in masks)
-		value_list = ''.join(value.pack() for value in value_list)
-		return masks + value_list
+		return b''.join(Short(mask).pack() for mask in masks) + b''.join(value.pack() for value in value_list)
 
 	@classmethod
-	def unpack(cls, data):
+	def reference_unpack(cls, data):
+		"""The original (slower) implementation of unpack(), kept for testing the compiled codecs against"""
 		values = {}
 		property_index = -1
 		list_items = []
@@ -83,20 +325,18 @@ class Properties(DataType):
 					raise ValueError("Property bit out of range for {}".format(cls.__name__))
 				name, datatype = cls.property_map[property_index]
 				if datatype == PropertyBit:
-					# special case for PropertyBit - if present, it means True, no list entry
 					values[name] = True
 					continue
 				list_items.append((name, datatype))
 			if not mask & 1:
 				break
 		for name, datatype in list_items:
-			value, data = datatype.unpack(data)
-			values[name] = value
+			values[name], data = datatype.unpack(data)
 		return cls(values), data
 
 	@classmethod
 	def get_by_class(cls, method_class):
-		for subcls in get_all_subclasses(cls):
-			if subcls.method_class == method_class:
-				return subcls
-		raise ValueError("No Properties defined for method class {:x}".format(method_class))
+		try:
+			return cls.registry.lookup(method_class)
+		except KeyError:
+			raise ValueError("No Properties defined for method class {:x}".format(method_class))
@@ -0,0 +1,104 @@
+
+import struct
+
+from grabbit.errors import FrameError
+
+from .datatypes import ProtocolHeader
+from .frame import Frame
+
+
+class FrameReader(object):
+	"""Incrementally parses Frames out of a stream of data, eg. as received from a socket.
+	Data is added with feed() in arbitrary chunks, and complete frames are returned
+	by read() (or by iterating over the reader) as soon as all their bytes have arrived.
+	Frames are only parsed once complete, so no work is repeated however the data is split up.
+
+	The first thing in the stream may be a ProtocolHeader instead of a Frame (as sent by a client when
+	opening a connection, or by a server to reject the client's protocol version), in which case
+	it is returned like a frame.
+
+	frame_size_max is the maximum size of a whole frame, including header and frame end byte,
+	as negotiated with Tune/TuneOk. 0 means no limit. It may be changed at any time.
+	A FrameError is raised for any frame larger than this.
+
+	If lazy is True, frames are unpacked lazily (see Frame.unpack_from()).
+
+	If capture is given (a capture.CaptureWriter), the raw bytes of each frame read are written to it.
+	"""
+
+	HEADER = struct.Struct('!BHL') # frame type, channel, payload size
+	PROTOCOL_HEADER_SIZE = len(ProtocolHeader())
+
+	def __init__(self, frame_size_max=0, lazy=False, capture=None):
+		self.frame_size_max = frame_size_max
+		self.lazy = lazy
+		self.capture = capture
+		self.buffer = bytearray()
+		self.view = memoryview(self.buffer) # parsing from a memoryview means each value is only copied once
+		self.offset = 0 # offset of first unparsed byte in buffer
+		self.started = False # whether we've parsed anything yet, ie. a ProtocolHeader is no longer allowed
+
+	def feed(self, data):
+		"""Add data (a str or other buffer) to the end of the stream"""
+		self.view = None # the buffer can't be resized while a view of it exists
+		if self.offset:
+			# discard everything already parsed. There's at most one partial frame left, so this is cheap.
+			del self.buffer[:self.offset]
+			self.offset = 0
+		self.buffer += data
+		self.view = memoryview(self.buffer)
+
+	def read(self):
+		"""Returns the next complete Frame (or initial ProtocolHeader), or None if more data is needed."""
+		buffer, offset = self.buffer, self.offset
+		available = len(buffer) - offset
+		if not self.started and available and buffer[offset] == ord('A'):
+			# no frame type begins with 'A', so this must be a ProtocolHeader.
+			if available < self.PROTOCOL_HEADER_SIZE:
+				return None
+			header, self.offset = ProtocolHeader.unpack_from(self.view, offset)
+			self.started = True
+			if self.capture:
+				self._capture(self.view[offset:self.offset])
+			return header
+		if available < self.HEADER.size:
+			return None
+		frame_type, channel, size = self.HEADER.unpack_from(buffer, offset)
+		if self.frame_size_max and size + Frame.OVERHEAD > self.frame_size_max:
+			raise FrameError("Frame size exceeds negotiated maximum",
+			                 size=size + Frame.OVERHEAD, frame_size_max=self.frame_size_max)
+		end = offset + size + Frame.OVERHEAD
+		if len(buffer) < end:
+			return None
+		if frame_type == Frame.BODY_TYPE:
+			# parse the body straight out of our buffer, so it is only copied once
+			frame, self.offset = Frame.unpack_from(self.view, offset)
+		elif self.lazy:
+			# lazy values keep their own copy of only the data they need
+			frame, self.offset = Frame.unpack_from(self.view, offset, lazy=True)
+		else:
+			# for small frames with many fields, it's faster to copy the frame to a str
+			# and parse that, than to make a copy from a view for every field.
+			frame, _ = Frame.unpack_from(self.view[offset:end].tobytes())
+			self.offset = end
+		self.started = True
+		if self.capture:
+			self._capture(self.view[offset:end])
+		return frame
+
+	def _capture(self, data):
+		# imported here as capture depends on this module
+		from .capture import IN
+		self.capture.write(IN, data)
+
+	def __iter__(self):
+		"""Yields all complete frames currently available"""
+		while True:
+			frame = self.read()
+			if frame is None:
+				return
+			yield frame
+
+	def __len__(self):
+		"""Number of bytes fed but not yet returned as part of a frame"""
+		return len(self.buffer) - self.offset
@@ -29,4 +29,13 @@ class FramesTestCase(unittest.TestCase):
 		self.assertEquals(datatype(*args, **kwargs).pack(), expected)
 		unpacked, leftover = datatype.unpack(expected)
 		self.assertEquals(unpacked, datatype(*args, **kwargs))
-		self.assertEquals(leftover, '')
+		self.assertEquals(leftover, b'')
+		self.check_unpack_from(datatype, expected, datatype(*args, **kwargs))
+
+	def check_unpack_from(self, datatype, expected, value):
+		"""Check unpack_from() works at an offset, and for buffers other than bytes"""
+		data = b'prefix' + expected + b'suffix'
+		for buf in (data, bytearray(data), memoryview(data)):
+			unpacked, offset = datatype.unpack_from(buf, len('prefix'))
+			self.assertEquals(unpacked, value)
+			self.assertEquals(offset, len('prefix') + len(expected))
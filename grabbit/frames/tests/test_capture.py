@@ -0,0 +1,104 @@
+
+from io import BytesIO
+from unittest import main
+
+from grabbit.frames.capture import (
+	MAGIC, CaptureWriter, Record, IN, OUT, read_capture, replay, percentiles,
+)
+from grabbit.frames.datatypes import ProtocolHeader
+from grabbit.frames.frame import Frame, send_buffers
+from grabbit.frames.reader import FrameReader
+from grabbit.methods import basic
+
+from .common import FramesTestCase
+
+
+class FakeClock(object):
+	def __init__(self):
+		self.now = 1000.0
+		self.slept = []
+	def __call__(self):
+		self.now += 0.001
+		return self.now
+	def sleep(self, delay):
+		self.slept.append(delay)
+		self.now += delay
+
+
+class CaptureTests(FramesTestCase):
+
+	frames = [
+		Frame(Frame.METHOD_TYPE, 1, basic.Deliver('ctag', 1, exchange='ex', routing_key='key', redelivered=False)),
+		Frame(Frame.HEADER_TYPE, 1, basic.CLASS_ID, 5, {'content_type': 'text/plain'}),
+		Frame(Frame.BODY_TYPE, 1, b'hello'),
+		Frame(Frame.HEARTBEAT_TYPE, 0),
+	]
+
+	def capture(self, records):
+		f = BytesIO()
+		writer = CaptureWriter(f)
+		for timestamp, direction, data in records:
+			writer.write(direction, data, timestamp)
+		return f.getvalue()
+
+	def test_round_trip(self):
+		records = [Record(1.5, IN, b'abc'), Record(2.25, OUT, b''), Record(3.0, IN, b'x' * 1000)]
+		self.assertEquals(list(read_capture(BytesIO(self.capture(records)))), records)
+
+	def test_invalid(self):
+		data = self.capture([Record(1.5, IN, b'abc')])
+		for length in range(len(data)):
+			if length == len(MAGIC): # just the magic is a valid, empty capture
+				continue
+			self.assertRaises(ValueError, list, read_capture(BytesIO(data[:length])))
+		self.assertRaises(ValueError, CaptureWriter(BytesIO()).write, b'X', b'abc')
+
+	def test_reader_tap(self):
+		f = BytesIO()
+		reader = FrameReader(capture=CaptureWriter(f))
+		data = b''.join(frame.pack() for frame in self.frames)
+		reader.feed(ProtocolHeader().pack() + data[:10])
+		reader.feed(data[10:])
+		self.assertEquals(len(list(reader)), 5)
+		records = list(read_capture(BytesIO(f.getvalue())))
+		self.assertEquals([record.direction for record in records], [IN] * 5)
+		self.assertEquals([record.data for record in records],
+		                  [ProtocolHeader().pack()] + [frame.pack() for frame in self.frames])
+
+	def test_send_tap(self):
+		class FakeSocket(object):
+			def sendall(self, data):
+				pass
+		f = BytesIO()
+		buffers = [buf for frame in self.frames for buf in frame.pack_buffers()]
+		send_buffers(FakeSocket(), buffers, capture=CaptureWriter(f))
+		records = list(read_capture(BytesIO(f.getvalue())))
+		self.assertEquals([record.direction for record in records], [OUT] * 4)
+		self.assertEquals([record.data for record in records], [frame.pack() for frame in self.frames])
+		self.assertRaises(ValueError, CaptureWriter(BytesIO()).write_frames, OUT, buffers[:-1])
+
+	def test_replay(self):
+		records = [Record(n, IN, frame.pack()) for n, frame in enumerate(self.frames)]
+		records.append(Record(10, OUT, self.frames[2].pack()))
+		for reader in (False, True):
+			for lazy in (False, True):
+				latencies = replay(records, reader=reader, lazy=lazy)
+				self.assertEquals({kind: len(values) for kind, values in latencies.items()}, {
+					'method basic.Deliver': 1, 'header': 1, 'body': 2, 'heartbeat': 1,
+				})
+
+	def test_replay_pacing(self):
+		clock = FakeClock()
+		records = [Record(100.0 + n, IN, frame.pack()) for n, frame in enumerate(self.frames)]
+		replay(records, pacing=True, clock=clock, sleep=clock.sleep)
+		self.assertEquals(len(clock.slept), 3)
+		self.assertTrue(all(0.99 < delay <= 1 for delay in clock.slept[1:]))
+
+	def test_percentiles(self):
+		values = list(range(1, 101))
+		self.assertEquals(percentiles(values, (0, 50, 90, 99.9, 100)), {0: 1, 50: 50, 90: 90, 99.9: 100, 100: 100})
+		self.assertEquals(percentiles([5]), {50: 5, 90: 5, 99: 5, 99.9: 5})
+
+
+if __name__ == '__main__':
+	main()
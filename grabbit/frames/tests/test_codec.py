@@ -0,0 +1,93 @@
+
+from unittest import main
+
+import grabbit.methods # make sure all methods are registered
+from grabbit.frames.codec import field_kind
+from grabbit.frames.common import Incomplete, STRUCT, STRING, BITS
+from grabbit.frames.datatypes import Sequence, Short, ShortString, LongString, Bits
+from grabbit.frames.fieldtable import FieldTable
+from grabbit.frames.method import Method
+
+from .common import FramesTestCase
+
+
+def sample_raw(cls, seed):
+	"""Generate raw values for all fields of cls, varying with seed"""
+	raw = []
+	for index, datatype in enumerate(cls.types()):
+		kind = field_kind(datatype)
+		n = seed + index
+		if kind == STRUCT:
+			raw.append(n % 2**(8 * datatype.len()))
+		elif kind == STRING:
+			raw.append(b'x' * (n % 7) + b'string')
+		elif kind == BITS:
+			raw.append(tuple(
+				False if name is None else bool((n >> bit) & 1)
+				for bit, name in enumerate(datatype.all_names)
+			))
+		else:
+			raw.append(datatype({'key{}'.format(n): n}))
+	return tuple(raw)
+
+
+class CodecTests(FramesTestCase):
+
+	def check_against_reference(self, cls):
+		for seed in range(4):
+			value = cls._from_raw(sample_raw(cls, seed))
+			packed = value.pack()
+			self.assertEquals(packed, value.reference_pack(), cls)
+			unpacked, leftover = cls.unpack(packed + b'extra')
+			reference, reference_leftover = cls.reference_unpack(packed + b'extra')
+			self.assertEquals(unpacked, reference)
+			self.assertEquals(leftover, reference_leftover)
+			self.assertEquals(unpacked.raw, value.raw)
+			for length in range(len(packed)):
+				self.assertRaises(Incomplete, cls.unpack, packed[:length])
+
+	def test_all_methods(self):
+		for method in Method.registry.table().values():
+			self.check_against_reference(method)
+
+	def test_big_bits(self):
+		class BigBits(Sequence):
+			fields = [
+				(None, Bits(*'abcdefghij')),
+				('one', Short),
+			]
+		self.check_against_reference(BigBits)
+		value = BigBits(1, **{name: name in 'bij' for name in 'abcdefghij'})
+		self.assertEquals(value.pack(), b'\x02\x03\x00\x01')
+		self.assertEquals((value.a, value.b, value.i), (False, True, True))
+
+	def test_reserved_defaults(self):
+		class Reserved(Sequence):
+			fields = [
+				(None, Short),
+				(None, ShortString),
+				('one', Short),
+			]
+		self.assertEquals(Reserved(1).pack(), b'\x00\x00\x00\x00\x01')
+
+	def test_string_validation(self):
+		class Strings(Sequence):
+			fields = [
+				('short', ShortString),
+				('long', LongString),
+			]
+		self.assertRaises(ValueError, Strings('x' * 256, '').pack)
+		self.assertRaises(ValueError, Strings('nul\0', '').pack)
+		self.assertEquals(Strings('nul', 'ok\0').pack(), b'\x03nul\x00\x00\x00\x03ok\x00')
+
+	def test_table_field(self):
+		class WithTable(Sequence):
+			fields = [('table', FieldTable)]
+		value = WithTable({'foo': 'bar'})
+		self.assertEquals(value.table, {'foo': 'bar'})
+		unpacked, leftover = WithTable.unpack(value.pack())
+		self.assertEquals(unpacked.table, {'foo': b'bar'})
+
+
+if __name__ == '__main__':
+	main()
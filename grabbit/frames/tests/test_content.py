@@ -0,0 +1,82 @@
+
+import mmap
+import tempfile
+from io import BytesIO
+from unittest import main, skipIf
+
+from grabbit.compat import PY2
+from grabbit.frames.common import to_str
+from grabbit.frames.content import body_chunks, content_frames
+from grabbit.frames.frame import Frame
+
+from .common import TEST_METHOD_CLASS, FramesTestCase
+
+
+class ContentFramesTests(FramesTestCase):
+
+	body = bytes(bytearray(n % 256 for n in range(100)))
+	frame_size_max = 30 + Frame.OVERHEAD
+
+	def check(self, body, size=None, expected_body=body):
+		frames = list(content_frames(1, TEST_METHOD_CLASS, {'an_int': 7}, body, self.frame_size_max, size=size))
+		header, bodies = frames[0], frames[1:]
+		self.assertEquals(header.type, Frame.HEADER_TYPE)
+		self.assertEquals(header.payload.body_size, len(expected_body))
+		self.assertEquals([frame.type for frame in bodies], [Frame.BODY_TYPE] * 4)
+		self.assertEquals([len(frame.pack()) for frame in bodies], [self.frame_size_max] * 3 + [10 + Frame.OVERHEAD])
+		self.assertEquals(b''.join(to_str(frame.payload.value) for frame in bodies), expected_body)
+
+	def test_str(self):
+		self.check(self.body)
+
+	def test_memoryview(self):
+		self.check(memoryview(self.body))
+
+	def test_file(self):
+		with tempfile.TemporaryFile() as f:
+			f.write(b'skipped' + self.body)
+			f.seek(len(b'skipped'))
+			self.check(f)
+
+	def test_mmap(self):
+		with tempfile.TemporaryFile() as f:
+			f.write(self.body)
+			f.flush()
+			self.check(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+	@skipIf(PY2, "mmap doesn't support the buffer protocol under python 2")
+	def test_mmap_not_copied(self):
+		with tempfile.TemporaryFile() as f:
+			f.write(self.body)
+			f.flush()
+			body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			chunks = list(body_chunks(body, 40))
+			self.assertEquals([type(chunk) for chunk in chunks], [memoryview] * 3)
+			self.assertEquals(b''.join(chunks), self.body)
+			del chunks # an mmap can't be closed while views of it exist
+			body.close()
+
+	def test_file_like(self):
+		self.check(BytesIO(self.body))
+
+	def test_iterator(self):
+		chunks = (self.body[start:start + 7] for start in range(0, len(self.body), 7))
+		self.assertRaises(TypeError, list, content_frames(1, TEST_METHOD_CLASS, {}, chunks))
+		chunks = (self.body[start:start + 7] for start in range(0, len(self.body), 7))
+		self.check(chunks, size=len(self.body))
+
+	def test_wrong_size(self):
+		self.assertRaises(ValueError, list, content_frames(1, TEST_METHOD_CLASS, {}, iter([b'abc']), size=4))
+		self.assertRaises(ValueError, list, content_frames(1, TEST_METHOD_CLASS, {}, iter([b'abc']), size=2))
+
+	def test_lazy(self):
+		def chunks():
+			yield b'x' * 30
+			raise AssertionError("Body was read before it was needed")
+		frames = content_frames(1, TEST_METHOD_CLASS, {}, chunks(), self.frame_size_max, size=60)
+		self.assertEquals(next(frames).type, Frame.HEADER_TYPE)
+		self.assertEquals(next(frames).payload.value, b'x' * 30)
+
+
+if __name__ == '__main__':
+	main()
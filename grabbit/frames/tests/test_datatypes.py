@@ -1,33 +1,38 @@
 
+import pickle
 from unittest import main
 
 from grabbit.frames.datatypes import *
 
-from common import FramesTestCase
+from .common import FramesTestCase
 
 class DatatypeTests(FramesTestCase):
 
 	def test_octet(self):
-		self.check(Octet, '\xab', 0xab)
+		self.check(Octet, b'\xab', 0xab)
 	def test_short(self):
-		self.check(Short, '\xbe\xef', 0xbeef)
+		self.check(Short, b'\xbe\xef', 0xbeef)
 	def test_long(self):
-		self.check(Long, '\xde\xad\xbe\xef', 0xdeadbeef)
+		self.check(Long, b'\xde\xad\xbe\xef', 0xdeadbeef)
 	def test_longlong(self):
-		self.check(LongLong, '\x00\x0d\xef\xac\xed\xfa\xca\xde', 0x000defacedfacade)
+		self.check(LongLong, b'\x00\x0d\xef\xac\xed\xfa\xca\xde', 0x000defacedfacade)
 
 	def test_shortstring(self):
-		self.check(ShortString, '\x0bhello world', "hello world")
+		self.check(ShortString, b'\x0bhello world', b"hello world")
 	def test_longstring(self):
-		self.check(LongString, '\x00\x00\x00\x0bhello world', "hello world")
+		self.check(LongString, b'\x00\x00\x00\x0bhello world', b"hello world")
+	def test_text(self):
+		# text is encoded as UTF-8, and always read back as bytes
+		self.check(ShortString, b'\x04f\xc3\xbcr', u'f\xfcr')
+		self.assertEquals(ShortString(u'f\xfcr').value, b'f\xc3\xbcr')
 
 	def test_bits(self):
 		TestFlags = Bits('foo', 'bar', 'baz')
-		self.check(TestFlags, '\x03', (True, True, False))
+		self.check(TestFlags, b'\x03', (True, True, False))
 	def test_bits_big(self):
 		BigTestFlags = Bits('a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i', 'j')
 		self.check(BigTestFlags,
-		           '\x35\x02',
+		           b'\x35\x02',
 		           (True, False, True, False, True, True, False, False, False, True))
 	def test_bits_properties(self):
 		TestFlags = Bits('foo', 'bar', 'baz')
@@ -35,7 +40,7 @@ class DatatypeTests(FramesTestCase):
 		self.assertEquals((flags.foo, flags.bar, flags.baz), (True, False, True))
 
 	def test_proto_header(self):
-		self.check(ProtocolHeader, 'AMQP\x00\x00\x09\x01')
+		self.check(ProtocolHeader, b'AMQP\x00\x00\x09\x01')
 
 	def test_sequence(self):
 		class TestSequence(Sequence):
@@ -50,9 +55,24 @@ class DatatypeTests(FramesTestCase):
 		self.assertEquals(obj.one, 1)
 		self.assertEquals(obj.two, True)
 		self.assertEquals(obj.three, False)
-		self.assertEquals(obj.four, "test")
+		self.assertEquals(obj.four, b"test")
 		self.assertEquals(obj.five, 3)
-		self.check(TestSequence, '\x00\x00\x01\x01\x04test\x00\x03', 1, two=True, three=False, five=3)
+		self.check(TestSequence, b'\x00\x00\x01\x01\x04test\x00\x03', 1, two=True, three=False, five=3)
+
+	def test_sequence_shadowed_attr(self):
+		class Base(Sequence):
+			fields = NotImplemented
+			shadowed = 'class value'
+		class TestSequence(Base):
+			fields = [('shadowed', ShortString)]
+		self.assertEquals(TestSequence('field value').shadowed, b'field value')
+		self.assertEquals(TestSequence.shadowed, 'class value')
+		self.assertFalse(hasattr(TestSequence('field value'), '__dict__'))
+
+	def test_pickle(self):
+		obj = ShortString(u'f\xfcr')
+		self.assertEquals(pickle.loads(pickle.dumps(obj, 2)), obj)
+		self.assertEquals(pickle.loads(pickle.dumps(ProtocolHeader(), 2)), ProtocolHeader())
 
 if __name__ == '__main__':
 	main()
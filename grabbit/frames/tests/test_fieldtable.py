@@ -5,33 +5,33 @@ from unittest import main
 
 from grabbit.frames.fieldtable import *
 
-from common import FramesTestCase
+from .common import FramesTestCase
 
 
 class FieldTableTests(FramesTestCase):
 
 	def test_signed_octet(self):
-		self.check(SignedOctet, '\xff', -1)
+		self.check(SignedOctet, b'\xff', -1)
 	def test_signed_short(self):
-		self.check(SignedShort, '\xff\xff', -1)
+		self.check(SignedShort, b'\xff\xff', -1)
 	def test_signed_long(self):
-		self.check(SignedLong, '\xff\xff\xff\xff', -1)
+		self.check(SignedLong, b'\xff\xff\xff\xff', -1)
 	def test_signed_longlong(self):
-		self.check(SignedLongLong, '\xff\xff\xff\xff\xff\xff\xff\xff', -1)
+		self.check(SignedLongLong, b'\xff\xff\xff\xff\xff\xff\xff\xff', -1)
 
 	def test_float(self):
-		self.check(Float, '\x3f\x80\x00\x00', 1)
+		self.check(Float, b'\x3f\x80\x00\x00', 1)
 	def test_double(self):
-		self.check(Double, '\x3f\xf0\x00\x00\x00\x00\x00\x00', 1)
+		self.check(Double, b'\x3f\xf0\x00\x00\x00\x00\x00\x00', 1)
 
 	def test_decimal(self):
-		self.check(Decimal, '\x01\x00\x00\x00\x05', 0.5)
+		self.check(Decimal, b'\x01\x00\x00\x00\x05', 0.5)
 
 	def test_void(self):
-		self.check(Void, '')
+		self.check(Void, b'')
 
 	def test_field_name(self):
-		self.check(FieldName, '\x06foobar', 'foobar')
+		self.check(FieldName, b'\x06foobar', 'foobar')
 
 	def test_table(self):
 		# we use an ordered dict to make the packed result predictable
@@ -40,32 +40,69 @@ class FieldTableTests(FramesTestCase):
 			('b', 255),
 			('c', 0.5),
 			('d', decimal.Decimal('0.5')),
-			('e', 'test'),
+			('e', b'test'),
 			('f', None),
-			('g', {'inner': 'foobar'}),
-			('h', ['x', 'y']),
+			('g', {'inner': b'foobar'}),
+			('h', [b'x', b'y']),
 		])
 		expected = (
-			'\x00\x00\x00\x5b' # payload size: 3*8+1+8+8+5+8+21+16 = 91
+			b'\x00\x00\x00\x5b' # payload size: 3*8+1+8+8+5+8+21+16 = 91
 			# payload:
-				'\x01a' 't' '\x00' # a Boolean False
-				'\x01b' 'l' '\x00\x00\x00\x00\x00\x00\x00\xff' # b SignedLongLong 255
-				'\x01c' 'd' '\x3f\xe0\x00\x00\x00\x00\x00\x00' # c Double 0.5
-				'\x01d' 'D' '\x01\x00\x00\x00\x05' # d Decimal 0.5 (Octet scale + SignedLong value)
-				'\x01e' 'S' '\x00\x00\x00\x04test' # e LongString "test"
-				'\x01f' 'V' # f Void
-				'\x01g' 'F' # g FieldTable:
-					'\x00\x00\x00\x11' # payload size: 17
+				b'\x01a' b't' b'\x00' # a Boolean False
+				b'\x01b' b'l' b'\x00\x00\x00\x00\x00\x00\x00\xff' # b SignedLongLong 255
+				b'\x01c' b'd' b'\x3f\xe0\x00\x00\x00\x00\x00\x00' # c Double 0.5
+				b'\x01d' b'D' b'\x01\x00\x00\x00\x05' # d Decimal 0.5 (Octet scale + SignedLong value)
+				b'\x01e' b'S' b'\x00\x00\x00\x04test' # e LongString "test"
+				b'\x01f' b'V' # f Void
+				b'\x01g' b'F' # g FieldTable:
+					b'\x00\x00\x00\x11' # payload size: 17
 					# payload:
-						'\x05inner' 'S' '\x00\x00\x00\x06foobar' # inner LongString "foobar"
-				'\x01h' 'A' # h FieldArray:
-					'\x00\x00\x00\x0c' # payload size: 12
+						b'\x05inner' b'S' b'\x00\x00\x00\x06foobar' # inner LongString "foobar"
+				b'\x01h' b'A' # h FieldArray:
+					b'\x00\x00\x00\x0c' # payload size: 12
 					# payload:
-						'S' '\x00\x00\x00\x01x' # LongString "x"
-						'S' '\x00\x00\x00\x01y' # LongString "y"
+						b'S' b'\x00\x00\x00\x01x' # LongString "x"
+						b'S' b'\x00\x00\x00\x01y' # LongString "y"
 		) # phew...
 		self.check(FieldTable, expected, values)
 
+	def test_bool_coerce(self):
+		# bool is a subclass of int, and must never be encoded as one
+		for _ in range(20):
+			self.assertIsInstance(field_type_coerce(True), Boolean)
+		self.assertEquals(FieldArray([True, 1]).pack(), b'\x00\x00\x00\x0b' b't\x01' b'l\x00\x00\x00\x00\x00\x00\x00\x01')
+
+	def test_large_table(self):
+		values = {'key{}'.format(n): n for n in range(1000)}
+		values['nested'] = {'list': [1, 'two', 3.0, None, (u'f\xfcnf',)], 'typed': SignedShort(-2)}
+		packed = FieldTable(values).pack()
+		unpacked, offset = FieldTable.unpack_from(packed)
+		self.assertEquals(offset, len(packed))
+		values['nested']['list'][1] = b'two'
+		values['nested']['list'][-1] = [b'f\xc3\xbcnf']
+		values['nested']['typed'] = -2
+		self.assertEquals(unpacked.get_value(), values)
+
+	def test_native_field_names(self):
+		# field names are always ascii, so are decoded to the native str type
+		for lazy in (False, True):
+			table, offset = FieldTable.unpack_from(FieldTable({u'name': 1}).pack(), lazy=lazy)
+			self.assertEquals([type(name) for name in table.keys()], [str])
+			self.assertEquals(table['name'], 1)
+
+	def test_bad_field_name(self):
+		for _ in range(2):
+			self.assertRaises(ValueError, FieldTable({'1abc': 1}).pack)
+			self.assertRaises(ValueError, FieldTable({'a-b': 1}).pack)
+
+	def test_field_name_cache(self):
+		cache = FieldNameCache(4)
+		for name in ['a', 'b', 'c', 'a', 'd', 'e']:
+			self.assertEquals(cache.pack(name), b'\x01' + name.encode('ascii'))
+		# 'b' is the least recently used, 'a' survives as it was used again
+		self.assertEquals(set(cache.recent) | set(cache.old), {'a', 'c', 'd', 'e'})
+		self.assertLessEqual(len(cache.recent) + len(cache.old), 4)
+
 
 if __name__ == '__main__':
 	main()
@@ -1,9 +1,10 @@
 
 from unittest import main
 
-from grabbit.frames.frame import Frame
+from grabbit.frames.common import to_str
+from grabbit.frames.frame import Frame, send_buffers, SEND_COALESCE_SIZE
 
-from common import TEST_METHOD_CLASS, TestMethod, FramesTestCase
+from .common import TEST_METHOD_CLASS, TestMethod, FramesTestCase
 
 
 class FrameTests(FramesTestCase):
@@ -12,61 +13,102 @@ class FrameTests(FramesTestCase):
 		self.assertEquals(frame.pack(), expected)
 		unpacked, leftover = Frame.unpack(expected)
 		self.assertEquals(unpacked, frame)
-		self.assertEquals(leftover, '')
+		self.assertEquals(leftover, b'')
+		self.check_unpack_from(Frame, expected, frame)
 
 	def test_method_frame(self):
-		frame = Frame(Frame.METHOD_TYPE, 1, TestMethod('hello world', 1234))
+		frame = Frame(Frame.METHOD_TYPE, 1, TestMethod(b'hello world', 1234))
 		expected = (
-			"\x01" # frame type: method
-			"\x00\x01" # channel: 1
-			"\x00\x00\x00\x18" # payload size: 24
+			b"\x01" # frame type: method
+			b"\x00\x01" # channel: 1
+			b"\x00\x00\x00\x18" # payload size: 24
 			# payload:
-				"\xff\x42" # method class: 0xff42
-				"\x00\x01" # method id: 1
+				b"\xff\x42" # method class: 0xff42
+				b"\x00\x01" # method id: 1
 				# method args:
-					"\x0bhello world" # foo: "hello world"
-					"\x00\x00\x00\x00\x00\x00\x04\xd2" # bar: 1234
-			"\xCE" # frame end
+					b"\x0bhello world" # foo: "hello world"
+					b"\x00\x00\x00\x00\x00\x00\x04\xd2" # bar: 1234
+			b"\xCE" # frame end
 		)
 		self.check(frame, expected)
 
 	def test_header_frame(self):
 		frame = Frame(Frame.HEADER_TYPE, 1, TEST_METHOD_CLASS, 42, {"an_int": 7, "a_bool": True})
 		expected = (
-			"\x02" # frame type: header
-			"\x00\x01" # channel: 1
-			"\x00\x00\x00\x10" # payload size: 16
+			b"\x02" # frame type: header
+			b"\x00\x01" # channel: 1
+			b"\x00\x00\x00\x10" # payload size: 16
 			# payload:
-				"\xff\x42" # method class: 0xff42
-				"\x00\x00" # weight: 0
-				"\x00\x00\x00\x00\x00\x00\x00\x2a" # content body size: 42 (meaningless here)
+				b"\xff\x42" # method class: 0xff42
+				b"\x00\x00" # weight: 0
+				b"\x00\x00\x00\x00\x00\x00\x00\x2a" # content body size: 42 (meaningless here)
 				# properties:
-					"\xc0\x00" # flags: 1st and 2nd bits set, no more flags
-					"\x00\x07" # an_int: 7
+					b"\xc0\x00" # flags: 1st and 2nd bits set, no more flags
+					b"\x00\x07" # an_int: 7
 					# a_bool: present, but no data as it is a bool
-			"\xCE" # frame end
+			b"\xCE" # frame end
 		)
-		self.assertEquals(frame.pack(), expected)
+		self.check(frame, expected)
 
 	def test_body_frame(self):
-		frame = Frame(Frame.BODY_TYPE, 1, "placeholder strings are hard")
+		frame = Frame(Frame.BODY_TYPE, 1, b"placeholder strings are hard")
 		expected = (
-			"\x03" # frame type: body
-			"\x00\x01" # channel: 1
-			"\x00\x00\x00\x1c" # payload size: 28
+			b"\x03" # frame type: body
+			b"\x00\x01" # channel: 1
+			b"\x00\x00\x00\x1c" # payload size: 28
 			# payload:
-				"placeholder strings are hard"
-			"\xCE" # frame end
+				b"placeholder strings are hard"
+			b"\xCE" # frame end
 		)
 		self.assertEquals(frame.pack(), expected)
 
+	def test_pack_buffers(self):
+		body = b'x' * 100
+		frames = [
+			Frame(Frame.METHOD_TYPE, 1, TestMethod(b'hello world', 1234)),
+			Frame(Frame.HEADER_TYPE, 1, TEST_METHOD_CLASS, 42, {"an_int": 7, "a_bool": True}),
+			Frame(Frame.BODY_TYPE, 1, body),
+			Frame(Frame.HEARTBEAT_TYPE, 0),
+		]
+		for frame in frames:
+			self.assertEquals(b''.join(map(to_str, frame.pack_buffers())), frame.pack())
+		# the body should be passed through without copying
+		view = memoryview(body)[10:20]
+		buffers = Frame(Frame.BODY_TYPE, 1, view).pack_buffers()
+		self.assertIs(buffers[1], view)
+		self.assertEquals(b''.join(map(to_str, buffers)), Frame(Frame.BODY_TYPE, 1, body[10:20]).pack())
+
+	def test_send_buffers(self):
+		class FakeSocket(object):
+			def __init__(self):
+				self.sent = []
+			def sendall(self, data):
+				self.sent.append(to_str(data))
+		class FakeSendmsgSocket(FakeSocket):
+			def sendmsg(self, buffers):
+				# only ever send part of what we're given, to exercise handling of partial sends
+				data = b''.join(map(to_str, buffers))[:7]
+				self.sent.append(data)
+				return len(data)
+		body = b'x' * SEND_COALESCE_SIZE
+		buffers = Frame(Frame.BODY_TYPE, 1, b'small').pack_buffers() + Frame(Frame.BODY_TYPE, 1, body).pack_buffers()
+		expected = b''.join(map(to_str, buffers))
+		sock = FakeSocket()
+		send_buffers(sock, buffers)
+		self.assertEquals(b''.join(sock.sent), expected)
+		# small buffers should have been combined, and the large one sent seperately
+		self.assertEquals(len(sock.sent), 3)
+		sock = FakeSendmsgSocket()
+		send_buffers(sock, buffers)
+		self.assertEquals(b''.join(sock.sent), expected)
+
 	def test_heartbeat(self):
 		frame = Frame(Frame.HEARTBEAT_TYPE, 0)
 		expected = (
-			"\x04" # frame type: body
-			"\x00\x00" # channel: 0
-			"\x00\x00\x00\x00" # payload size: 0
-			"\xCE" # frame end
+			b"\x04" # frame type: body
+			b"\x00\x00" # channel: 0
+			b"\x00\x00\x00\x00" # payload size: 0
+			b"\xCE" # frame end
 		)
 		self.assertEquals(frame.pack(), expected)
 
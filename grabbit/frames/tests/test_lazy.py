@@ -0,0 +1,71 @@
+
+from unittest import main
+
+from grabbit.frames.fieldtable import FieldTable
+from grabbit.frames.frame import Frame
+from grabbit.frames.reader import FrameReader
+from grabbit.methods import basic
+
+from .common import TestMethod, FramesTestCase
+
+
+class LazyTests(FramesTestCase):
+
+	headers = {'foo': b'bar', 'count': 3, 'nested': {'inner': [1, 2]}}
+	deliver = basic.Deliver('ctag', 42, exchange='ex', routing_key='key', redelivered=True)
+	frames = [
+		Frame(Frame.METHOD_TYPE, 1, deliver),
+		Frame(Frame.HEADER_TYPE, 1, basic.CLASS_ID, 4, {'content_type': 'text/plain', 'headers': headers}),
+		Frame(Frame.BODY_TYPE, 1, b'body'),
+	]
+
+	def test_method(self):
+		frame, offset = Frame.unpack_from(self.frames[0].pack(), lazy=True)
+		method = frame.payload.method
+		self.assertIsInstance(method, basic.Deliver)
+		self.assertTrue(hasattr(method, '_lazy_data'))
+		self.assertEquals(method.delivery_tag, 42)
+		self.assertFalse(hasattr(method, '_lazy_data'))
+		self.assertEquals(method, self.deliver)
+
+	def test_method_invalid(self):
+		data = Frame(Frame.METHOD_TYPE, 1, TestMethod('hello', 1)).pack()
+		# corrupt the string length so it runs past the end of the frame
+		data = data[:11] + b'\xff' + data[12:]
+		frame, offset = Frame.unpack_from(data, lazy=True)
+		self.assertRaises(ValueError, getattr, frame.payload.method, 'foo')
+
+	def test_properties(self):
+		frame, offset = Frame.unpack_from(self.frames[1].pack(), lazy=True)
+		properties = frame.payload.properties
+		self.assertEquals(set(properties._pending), {'content_type', 'headers'})
+		self.assertEquals(properties.content_type, b'text/plain')
+		self.assertEquals(set(properties._pending), {'headers'})
+		headers = properties.headers
+		self.assertEquals(headers['foo'], b'bar')
+		self.assertEquals(set(headers._pending), {'count', 'nested'})
+		self.assertEquals(headers.get('missing'), None)
+		self.assertIn('nested', headers)
+		self.assertEquals(sorted(headers.keys()), ['count', 'foo', 'nested'])
+		self.assertEquals(properties.get_value()['headers'], self.headers)
+		self.assertEquals(frame, self.frames[1])
+
+	def test_table_pack(self):
+		data = FieldTable(self.headers).pack()
+		table, offset = FieldTable.unpack_from(data, lazy=True)
+		self.assertEquals(offset, len(data))
+		self.assertEquals(table['count'], 3)
+		self.assertEquals(FieldTable.unpack(table.pack())[0].get_value(), self.headers)
+
+	def test_reader(self):
+		reader = FrameReader(lazy=True)
+		data = b''.join(frame.pack() for frame in self.frames)
+		reader.feed(data)
+		frames = list(reader)
+		# lazy values must not depend on the reader's buffer
+		reader.feed(b'\0' * len(data))
+		self.assertEquals(frames, self.frames)
+
+
+if __name__ == '__main__':
+	main()
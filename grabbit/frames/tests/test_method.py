@@ -0,0 +1,39 @@
+
+from unittest import main
+
+from grabbit.frames.method import Method
+from grabbit.frames.datatypes import Short
+
+from .common import TEST_METHOD_CLASS, TestMethod, FramesTestCase
+
+
+class MethodRegistryTests(FramesTestCase):
+
+	def test_from_id(self):
+		self.assertIs(Method.from_id(TEST_METHOD_CLASS, TestMethod.method_id), TestMethod)
+		self.assertRaises(ValueError, Method.from_id, TEST_METHOD_CLASS, 0xffff)
+
+	def test_abstract_not_registered(self):
+		class AbstractMethod(Method):
+			method_class = TEST_METHOD_CLASS
+		self.assertNotIn(AbstractMethod, Method.registry.table().values())
+
+	def test_duplicate(self):
+		def define():
+			class DuplicateMethod(Method):
+				method_class = TEST_METHOD_CLASS
+				method_id = TestMethod.method_id
+				fields = [('baz', Short)]
+		self.assertRaises(ValueError, define)
+		self.assertIs(Method.from_id(TEST_METHOD_CLASS, TestMethod.method_id), TestMethod)
+
+	def test_table(self):
+		table = Method.registry.table()
+		self.assertEquals(table[TEST_METHOD_CLASS, TestMethod.method_id], TestMethod)
+		# modifying the returned table must not affect the registry
+		table.clear()
+		self.assertIn((TEST_METHOD_CLASS, TestMethod.method_id), Method.registry)
+
+
+if __name__ == '__main__':
+	main()
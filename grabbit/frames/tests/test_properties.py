@@ -1,10 +1,13 @@
 
+import itertools
 from unittest import main
 
-from grabbit.frames.properties import Properties
+from grabbit.frames.common import Incomplete
+from grabbit.frames.properties import Properties, ShapeCache
 from grabbit.frames.datatypes import Octet
+from grabbit.methods.basic import BasicProperties
 
-from common import FramesTestCase, TestProperties, TEST_METHOD_CLASS
+from .common import FramesTestCase, TestProperties, TEST_METHOD_CLASS
 
 
 class BigProperties(Properties):
@@ -15,15 +18,66 @@ class BigProperties(Properties):
 class PropertiesTests(FramesTestCase):
 
 	def test_basic(self):
-		self.check(TestProperties, '\xa0\x00\x00\x03\x03foo', dict(an_int=3, a_bool=False, a_string='foo'))
-		self.check(TestProperties, '\xe0\x00\x00\x03\x03foo', dict(an_int=3, a_bool=True, a_string='foo'))
-		self.check(TestProperties, '\x40\x00', dict(a_bool=True))
+		self.check(TestProperties, b'\xa0\x00\x00\x03\x03foo', dict(an_int=3, a_bool=False, a_string=b'foo'))
+		self.check(TestProperties, b'\xe0\x00\x00\x03\x03foo', dict(an_int=3, a_bool=True, a_string=b'foo'))
+		self.check(TestProperties, b'\x40\x00', dict(a_bool=True))
 
 	def test_big(self):
-		self.check(BigProperties, '\x00\x01\x00\x00', {})
-		self.check(BigProperties, '\xff\xff\xff\xfe' + '\x01' * 30,
+		self.check(BigProperties, b'\x00\x01\x00\x00', {})
+		self.check(BigProperties, b'\xff\xff\xff\xfe' + b'\x01' * 30,
 		           {attr: 1 for attr, type in BigProperties.property_map})
 
+	def test_attrs(self):
+		properties = TestProperties(dict(an_int=3, a_string=b'foo'))
+		self.assertEquals((properties.an_int, properties.a_bool, properties.a_string), (3, False, b'foo'))
+		self.assertIsNone(BigProperties({}).attr0)
+		self.assertIsInstance(properties.values['an_int'], TestProperties.property_map[0][1])
+
+	def test_against_reference(self):
+		samples = dict(content_type='text/plain', headers={'a': 1}, delivery_mode=2, priority=1,
+		               timestamp=1400000000, message_id='abc')
+		for count in range(len(samples) + 1):
+			for names in itertools.combinations(sorted(samples), count):
+				properties = BasicProperties({name: samples[name] for name in names})
+				packed = properties.pack()
+				self.assertEquals(packed, properties.reference_pack())
+				unpacked, leftover = BasicProperties.unpack(packed + b'extra')
+				self.assertEquals(unpacked, BasicProperties.reference_unpack(packed + b'extra')[0])
+				self.assertEquals(leftover, b'extra')
+				for length in range(len(packed)):
+					self.assertRaises(Incomplete, BasicProperties.unpack, packed[:length])
+
+	def test_shape_cache(self):
+		first = TestProperties(dict(an_int=1, a_string=b'foo'))
+		second = TestProperties(dict(an_int=2, a_string=b'barbaz', a_bool=False))
+		self.assertIs(first.shape(), second.shape())
+		self.assertIsNot(first.shape(), TestProperties(dict(an_int=2, a_string=b'foo', a_bool=True)).shape())
+		self.assertIs(TestProperties.unpack(first.pack())[0].shape(), first.shape())
+
+	def test_shape_cache_bounded(self):
+		cache = ShapeCache(4)
+		for key in 'abc':
+			cache.add(key, key.upper())
+		self.assertEquals((cache.old, cache.recent), ({'a': 'A', 'b': 'B'}, {'c': 'C'}))
+		self.assertEquals(cache.get('a'), 'A') # used, so moved to the recent generation
+		cache.add('d', 'D')
+		cache.add('e', 'E')
+		self.assertEquals((cache.get('a'), cache.get('b'), len(cache)), ('A', None, 3))
+		# a peer sending many different sets of properties doesn't evict one that's in use
+		common = BigProperties(dict(attr0=1)).pack()
+		shape = BigProperties.unpack(common)[0].shape()
+		for n in range(1, 30):
+			for m in range(n + 1, 30):
+				BigProperties.unpack(BigProperties({'attr%d' % n: 1, 'attr%d' % m: 2}).pack())
+				self.assertIs(BigProperties.unpack(common)[0].shape(), shape)
+		self.assertLessEqual(len(BigProperties._shapes_by_masks), BigProperties.SHAPE_CACHE_SIZE)
+
+	def test_extra_flag_words(self):
+		# a continuation bit followed by an empty word is valid, even if we never send it
+		properties, leftover = TestProperties.unpack(b'\x80\x01\x00\x00\x00\x03')
+		self.assertEquals(properties.get_value(), dict(an_int=3, a_bool=False))
+		self.assertRaises(ValueError, TestProperties.unpack, b'\x80\x01\x80\x00\x00\x03')
+
 
 if __name__ == '__main__':
 	main()
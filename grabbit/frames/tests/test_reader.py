@@ -0,0 +1,65 @@
+
+from unittest import main
+
+from grabbit.errors import FrameError
+from grabbit.frames.datatypes import ProtocolHeader
+from grabbit.frames.frame import Frame
+from grabbit.frames.reader import FrameReader
+
+from .common import TEST_METHOD_CLASS, TestMethod, FramesTestCase
+
+
+class FrameReaderTests(FramesTestCase):
+
+	frames = [
+		Frame(Frame.METHOD_TYPE, 1, TestMethod('hello world', 1234)),
+		Frame(Frame.HEADER_TYPE, 1, TEST_METHOD_CLASS, 10, {"an_int": 7}),
+		Frame(Frame.BODY_TYPE, 1, b"0123456789"),
+		Frame(Frame.HEARTBEAT_TYPE, 0),
+	]
+	data = b''.join(frame.pack() for frame in frames)
+
+	def check_chunks(self, reader, chunks, expected):
+		results = []
+		for chunk in chunks:
+			reader.feed(chunk)
+			results += list(reader)
+		self.assertEquals(results, expected)
+		self.assertEquals(len(reader), 0)
+
+	def test_all_at_once(self):
+		self.check_chunks(FrameReader(), [self.data], self.frames)
+
+	def test_byte_at_a_time(self):
+		self.check_chunks(FrameReader(), [self.data[n:n + 1] for n in range(len(self.data))], self.frames)
+
+	def test_incomplete(self):
+		reader = FrameReader()
+		reader.feed(self.data[:-1])
+		self.assertEquals(list(reader), self.frames[:-1])
+		self.assertEquals(reader.read(), None)
+		self.assertEquals(len(reader), len(self.frames[-1].pack()) - 1)
+
+	def test_protocol_header(self):
+		header = ProtocolHeader()
+		self.check_chunks(FrameReader(), [header.pack()[:3], header.pack()[3:] + self.data], [header] + self.frames)
+
+	def test_frame_size_max(self):
+		big = Frame(Frame.BODY_TYPE, 1, b'x' * 100).pack()
+		reader = FrameReader(frame_size_max=len(big))
+		self.check_chunks(reader, [big], [Frame(Frame.BODY_TYPE, 1, b'x' * 100)])
+		reader.frame_size_max = len(big) - 1
+		# the frame should be rejected as soon as its header arrives
+		reader.feed(big[:7])
+		self.assertRaises(FrameError, reader.read)
+
+	def test_unknown_type(self):
+		# a heartbeat's header and frame end, with a type that doesn't exist
+		for lazy in (False, True):
+			reader = FrameReader(lazy=lazy)
+			reader.feed(b'\x09\x00\x00\x00\x00\x00\x00' + Frame.FRAME_END)
+			self.assertRaises(FrameError, reader.read)
+
+
+if __name__ == '__main__':
+	main()
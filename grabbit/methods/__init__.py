@@ -1,7 +1,8 @@
-import basic
-import channel
-import confirm
-import connection
-import exchange
-import queue
-import tx
+from . import basic
+from . import channel
+from . import confirm
+from . import connection
+from . import exchange
+from . import queue
+from . import tx
+from . import publish
@@ -1,7 +1,7 @@
 
 from grabbit.frames import Method, Bits, LongString, ShortString
 
-from common import CloseMethod
+from .common import CloseMethod
 
 
 CLASS_ID = 20
@@ -46,6 +46,6 @@ class Close(CloseMethod, ChannelMethod):
 	After sending a Close, all subsequent methods should be ignored (except Close and CloseOk).
 	A received Close should be responded to with a CloseOk even if a Close has been sent.
 	"""
-	method = 40
+	method_id = 40
 	response = CloseOk
 
@@ -20,3 +20,4 @@ class Select(ConfirmMethod):
 	"""
 	method_id = 10
 	fields = [(None, Bits('no_wait'))]
+	response = SelectOk
@@ -1,7 +1,8 @@
 
+from grabbit.compat import native_str, string_types
 from grabbit.frames import Method, Bits, FieldTable, Long, LongString, Octet, Short, ShortString
 
-from common import CloseMethod
+from .common import CloseMethod
 
 
 CLASS_ID = 10
@@ -42,19 +43,19 @@ class Start(ConnectionMethod):
 
 	@property
 	def version(self):
-		return self.version_major.value, self.version_minor.value
+		return self.version_major, self.version_minor
 	@property
 	def security_mechanisms(self):
-		return self._security_mechanisms.split(' ')
+		return native_str(self._security_mechanisms).split(' ')
 	@property
 	def locales(self):
-		return self._locales.split(' ')
+		return native_str(self._locales).split(' ')
 
 	def __init__(self, version_major, version_minor, server_properties, security_mechanisms, locales):
-		if not isinstance(security_mechanisms, basestring):
-			security_mechanisms = ' '.join(security_mechanisms)
-		if not isinstance(locales, basestring):
-			locales = ' '.join(locales)
+		if not isinstance(security_mechanisms, string_types):
+			security_mechanisms = ' '.join(native_str(mechanism) for mechanism in security_mechanisms)
+		if not isinstance(locales, string_types):
+			locales = ' '.join(native_str(locale) for locale in locales)
 		super(Start, self).__init__(version_major, version_minor, server_properties, security_mechanisms, locales)
 
 class SecureOk(ConnectionMethod):
@@ -126,6 +127,6 @@ class Close(CloseMethod, ConnectionMethod):
 	After sending a Close, all subsequent methods should be ignored (except Close and CloseOk).
 	A received Close should be responded to with a CloseOk even if a Close has been sent.
 	"""
-	method = 50
+	method_id = 50
 	response = CloseOk
 
@@ -0,0 +1,119 @@
+
+"""Pre-encoded frames for publishing many messages with the same method and properties."""
+
+import struct
+
+from grabbit.frames import Frame, PropertyBit
+from grabbit.frames.codec import field_kind
+from grabbit.frames.common import STRUCT, to_str
+from grabbit.frames.content import body_chunks
+from grabbit.frames.frame import MethodPayload
+
+from .basic import CLASS_ID, Publish, BasicProperties
+
+
+FRAME_HEADER = struct.Struct('!BHL')
+# frame header plus the start of a content header payload: method_class, weight, body_size
+CONTENT_HEADER_START = '!BHLHHQ'
+
+
+class PublishTemplate(object):
+	"""Packs the frames for a basic.Publish with a given exchange, routing_key, flags and BasicProperties
+	once, so that each message published only needs to fill in its body size, any properties
+	that vary per message, and the body itself.
+	Properties named in variable must be given for every message (as kwargs to pack_buffers() or pack()),
+	all other properties are fixed. If all variable properties are fixed-width (eg. timestamp, priority),
+	the content header frame is packed with a single precompiled struct.
+	frame_size_max is the negotiated maximum frame size, or 0 for no limit.
+	"""
+
+	def __init__(self, exchange, routing_key, mandatory=False, immediate=False,
+	             properties={}, variable=(), frame_size_max=0):
+		self.frame_size_max = frame_size_max
+		self.variable = tuple(variable)
+		method_payload = MethodPayload(Publish(
+			exchange=exchange, routing_key=routing_key, mandatory=mandatory, immediate=immediate,
+		)).pack()
+		self.method_payload = method_payload
+		self.method_frames = {} # cache of method frames by channel
+
+		types = dict(BasicProperties.property_map)
+		for name in self.variable:
+			if name not in types or types[name] == PropertyBit:
+				raise TypeError("{!r} is not a valid variable property".format(name))
+			if name in properties:
+				raise TypeError("{!r} is given as both a fixed and a variable property".format(name))
+		# use placeholder values for the variable properties to work out the flags and their positions
+		placeholders = {name: (0 if field_kind(types[name]) == STRUCT else b'') for name in self.variable}
+		placeholders.update(properties)
+		flags, value_list = BasicProperties(placeholders).pack_flags()
+
+		# split the packed values into constant segments between each variable value
+		self.segments = [flags]
+		self.variable_types = []
+		for name, value in value_list:
+			if name in self.variable:
+				self.variable_types.append((name, types[name]))
+				self.segments.append(b'')
+			else:
+				self.segments[-1] += value.pack()
+		self.variable_names = [name for name, datatype in self.variable_types]
+
+		if all(field_kind(datatype) == STRUCT for name, datatype in self.variable_types):
+			fmt = CONTENT_HEADER_START
+			for segment, (name, datatype) in zip(self.segments, self.variable_types + [(None, None)]):
+				fmt += '{}s'.format(len(segment))
+				if datatype is not None:
+					fmt += datatype.format_char
+			self.header_struct = struct.Struct(fmt + 'c')
+		else:
+			self.header_struct = None
+			self.header_start = struct.Struct(CONTENT_HEADER_START)
+
+	def method_frame(self, channel):
+		frame = self.method_frames.get(channel)
+		if frame is None:
+			frame = self.method_frames[channel] = (
+				FRAME_HEADER.pack(Frame.METHOD_TYPE, channel, len(self.method_payload))
+				+ self.method_payload + Frame.FRAME_END
+			)
+		return frame
+
+	def header_frame(self, channel, body_size, values):
+		missing = set(self.variable) - set(values)
+		if missing or len(values) != len(self.variable):
+			raise TypeError("Expected values for exactly properties {}, got {}".format(
+				', '.join(self.variable), ', '.join(values)
+			))
+		if self.header_struct:
+			# payload size is the struct size, minus the frame header and frame end
+			args = [Frame.HEADER_TYPE, channel, self.header_struct.size - Frame.OVERHEAD, CLASS_ID, 0, body_size]
+			for segment, name in zip(self.segments, self.variable_names):
+				args += [segment, values[name]]
+			args += [self.segments[-1], Frame.FRAME_END]
+			return self.header_struct.pack(*args)
+		parts = [self.segments[0]]
+		for (name, datatype), segment in zip(self.variable_types, self.segments[1:]):
+			parts += [datatype(values[name]).pack(), segment]
+		payload = b''.join(parts)
+		return self.header_start.pack(
+			Frame.HEADER_TYPE, channel, len(payload) + 12, CLASS_ID, 0, body_size,
+		) + payload + Frame.FRAME_END
+
+	def pack_buffers(self, channel, body, **values):
+		"""Returns a list of buffers which make up the method, header and body frames
+		for publishing body (a str or other buffer) on channel, with given variable properties.
+		As per Frame.pack_buffers(), the body is not copied."""
+		buffers = [self.method_frame(channel), self.header_frame(channel, len(body), values)]
+		chunk_size = self.frame_size_max - Frame.OVERHEAD if self.frame_size_max else 0
+		if not chunk_size or len(body) <= chunk_size:
+			chunks = [body] if body else []
+		else:
+			chunks = body_chunks(body, chunk_size)
+		for chunk in chunks:
+			buffers += [FRAME_HEADER.pack(Frame.BODY_TYPE, channel, len(chunk)), chunk, Frame.FRAME_END]
+		return buffers
+
+	def pack(self, channel, body, **values):
+		"""As pack_buffers(), but returns a single bytes"""
+		return b''.join(to_str(buf) for buf in self.pack_buffers(channel, body, **values))
@@ -1 +1,2 @@
-import test_common
+from . import test_common
+from . import test_publish
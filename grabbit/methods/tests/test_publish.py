@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from grabbit.frames import Frame
+from grabbit.frames.common import to_str
+from grabbit.frames.content import content_frames
+from grabbit.frames.frame import MethodPayload
+from grabbit.methods.basic import CLASS_ID, Publish
+from grabbit.methods.publish import PublishTemplate
+
+
+class PublishTemplateTests(TestCase):
+
+	properties = {'content_type': 'text/plain', 'delivery_mode': 2, 'headers': {'a': 1}}
+
+	def expected(self, channel, body, properties, frame_size_max=0):
+		method = Publish(exchange='ex', routing_key='key', mandatory=True, immediate=False)
+		frames = [Frame(Frame.METHOD_TYPE, channel, MethodPayload(method))]
+		frames += content_frames(channel, CLASS_ID, properties, body, frame_size_max)
+		return b''.join(frame.pack() for frame in frames)
+
+	def check(self, variable, values, body=b'hello', frame_size_max=0):
+		template = PublishTemplate('ex', 'key', mandatory=True, properties=self.properties,
+		                           variable=variable, frame_size_max=frame_size_max)
+		properties = self.properties.copy()
+		properties.update(values)
+		for channel in (1, 2, 1):
+			self.assertEquals(template.pack(channel, body, **values),
+			                  self.expected(channel, body, properties, frame_size_max))
+		return template
+
+	def test_fixed(self):
+		self.check((), {})
+
+	def test_struct_variable(self):
+		template = self.check(('priority', 'timestamp'), {'priority': 3, 'timestamp': 1234567890})
+		self.assertIsNotNone(template.header_struct)
+
+	def test_string_variable(self):
+		template = self.check(('message_id', 'timestamp'), {'message_id': 'abc', 'timestamp': 7})
+		self.assertIsNone(template.header_struct)
+
+	def test_empty_body(self):
+		self.check((), {}, body=b'')
+
+	def test_fragmented(self):
+		self.check(('timestamp',), {'timestamp': 1}, body=b'x' * 100, frame_size_max=30 + Frame.OVERHEAD)
+
+	def test_body_not_copied(self):
+		body = memoryview(b'x' * 100)
+		template = PublishTemplate('ex', 'key', frame_size_max=30 + Frame.OVERHEAD)
+		buffers = template.pack_buffers(1, body)
+		self.assertEquals(b''.join(to_str(buf) for buf in buffers[3::3]), b'x' * 100)
+		self.assertTrue(all(isinstance(buf, memoryview) for buf in buffers[3::3]))
+
+	def test_bad_variable(self):
+		self.assertRaises(TypeError, PublishTemplate, 'ex', 'key', variable=('nonexistent',))
+		self.assertRaises(TypeError, PublishTemplate, 'ex', 'key', properties={'priority': 1}, variable=('priority',))
+		template = PublishTemplate('ex', 'key', variable=('priority',))
+		self.assertRaises(TypeError, template.pack, 1, b'body')
+		self.assertRaises(TypeError, template.pack, 1, b'body', priority=1, timestamp=2)
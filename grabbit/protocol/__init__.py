@@ -0,0 +1,9 @@
+from .ack import AckManager
+from .channel import Channel, Message
+from .cluster import Cluster
+from .confirm import ConfirmPublisher, MessageNacked
+from .connection import Connection
+from .dispatch import Dispatcher
+from .pool import ChannelPool
+from .qos import QosController
+from .recovery import Recovery
@@ -0,0 +1,178 @@
+
+from bisect import bisect_right
+
+import gevent
+
+from grabbit.methods import basic
+
+
+class IntervalSet(object):
+	"""A set of integers, stored as a sorted list of non-overlapping, non-adjacent [start, end] intervals
+	(inclusive). Adding runs of consecutive integers (in any order) keeps it to one interval per run."""
+
+	def __init__(self, values=()):
+		self.intervals = []
+		self.count = 0
+		for value in values:
+			self.add(value)
+
+	def __len__(self):
+		return self.count
+
+	def __iter__(self):
+		for start, end in self.intervals:
+			for value in range(start, end + 1):
+				yield value
+
+	def __contains__(self, value):
+		index = bisect_right(self.intervals, [value, float('inf')]) - 1
+		return index >= 0 and self.intervals[index][1] >= value
+
+	def __repr__(self):
+		return "<{cls.__name__} {intervals}>".format(cls=type(self), intervals=', '.join(
+			str(start) if start == end else '{}-{}'.format(start, end) for start, end in self.intervals
+		))
+
+	def add(self, value):
+		"""Adds value, returning False if it was already present"""
+		intervals = self.intervals
+		if intervals and intervals[-1][1] == value - 1:
+			intervals[-1][1] = value # the usual case, adding the next value in order
+			self.count += 1
+			return True
+		index = bisect_right(intervals, [value, float('inf')]) # intervals before index start at or before value
+		if index and intervals[index - 1][1] >= value:
+			return False
+		joins_previous = index and intervals[index - 1][1] == value - 1
+		joins_next = index < len(intervals) and intervals[index][0] == value + 1
+		if joins_previous and joins_next:
+			intervals[index - 1][1] = intervals.pop(index)[1]
+		elif joins_previous:
+			intervals[index - 1][1] = value
+		elif joins_next:
+			intervals[index][0] = value
+		else:
+			intervals.insert(index, [value, value])
+		self.count += 1
+		return True
+
+	def first(self):
+		"""Returns the first interval as (start, end), or None if empty"""
+		return tuple(self.intervals[0]) if self.intervals else None
+
+	def highest(self, value):
+		"""Returns the highest value in the set which is at most value, or None if there isn't one"""
+		index = bisect_right(self.intervals, [value, float('inf')]) - 1
+		return min(self.intervals[index][1], value) if index >= 0 else None
+
+	def discard_to(self, value):
+		"""Removes all values up to and including value"""
+		intervals = self.intervals
+		while intervals and intervals[0][0] <= value:
+			start, end = intervals[0]
+			if end <= value:
+				intervals.pop(0)
+				self.count -= end - start + 1
+			else:
+				intervals[0][0] = value + 1
+				self.count -= value + 1 - start
+				break
+
+	def clear(self):
+		self.intervals = []
+		self.count = 0
+
+
+class AckManager(object):
+	"""Acks deliveries on a channel, coalescing acks into as few basic.Ack frames as possible.
+
+	Call ack() (or nack()) with each delivery's delivery_tag once it has been handled, in any order.
+	Every delivery on the channel must be acked or nacked this way eventually, since an Ack with multiple
+	set acks every unacked delivery up to its tag. Acks are held in an IntervalSet until max_pending
+	are waiting or max_delay seconds have passed since the first of them, and then sent as:
+		a single Ack(multiple=True) for the longest run of handled deliveries from the lowest unacked tag,
+			ending on the last of them which hasn't already been acked individually (as the broker
+			rejects an Ack for a tag it no longer has),
+		then, only if deliveries are still waiting behind one that hasn't been handled yet
+		(and max_delay has passed or max_pending are still waiting), an individual Ack for each of them.
+	So when deliveries are handled roughly in order, there is one Ack per max_pending deliveries.
+	Nacks are sent straight away, and individually.
+	"""
+
+	def __init__(self, channel, max_pending=100, max_delay=0.05):
+		self.channel = channel
+		self.max_pending = max_pending
+		self.max_delay = max_delay
+		self.acked = 0 # every tag up to this has been acked or nacked, and the broker told
+		self.done = IntervalSet() # tags above acked which have been acked or nacked
+		self.pending = IntervalSet() # tags in done which haven't been sent yet
+		self.sent = 0 # number of Ack and Nack methods sent, for stats
+		self._timer = None
+		channel.close_callbacks.append(self._closed)
+
+	def ack(self, delivery_tag):
+		"""Acks the delivery with delivery_tag, some time within max_delay"""
+		if delivery_tag <= self.acked or not self.done.add(delivery_tag):
+			return # already acked
+		self.pending.add(delivery_tag)
+		if len(self.pending) >= self.max_pending:
+			self.flush(gaps=False)
+		if self.pending and self._timer is None:
+			self._timer = gevent.spawn_later(self.max_delay, self._expired)
+
+	def nack(self, delivery_tag, requeue=True):
+		"""Nacks the delivery with delivery_tag immediately"""
+		if delivery_tag <= self.acked or not self.done.add(delivery_tag):
+			return
+		self.channel.send(basic.Nack(delivery_tag, multiple=False, requeue=requeue))
+		self.sent += 1
+		self._advance()
+
+	def flush(self, gaps=True):
+		"""Sends any pending acks now. If gaps is False, individual acks for deliveries after one which
+		hasn't been handled are only sent if there are still max_pending of them."""
+		if not self.pending:
+			return
+		first = self.done.first()
+		# the longest run of handled tags from the lowest, up to the last which hasn't been sent
+		end = self.pending.highest(first[1]) if first[0] == self.acked + 1 else None
+		if end is not None:
+			self.channel.send(basic.Ack(end, multiple=True))
+			self.sent += 1
+			self.pending.discard_to(end)
+		if self.pending and (gaps or len(self.pending) >= self.max_pending):
+			for tag in self.pending:
+				self.channel.send(basic.Ack(tag, multiple=False))
+				self.sent += 1
+			self.pending.clear()
+		self._advance()
+		if not self.pending and self._timer is not None:
+			self._timer.kill(block=False)
+			self._timer = None
+
+	def _advance(self):
+		# move acked past the run of done tags from it which have all been sent
+		first = self.done.first()
+		if first is None or first[0] != self.acked + 1:
+			return
+		end = first[1]
+		if self.pending:
+			end = min(end, self.pending.first()[0] - 1)
+		if end > self.acked:
+			self.done.discard_to(end)
+			self.acked = end
+
+	def _expired(self):
+		self._timer = None
+		if not self.channel.error:
+			self.flush()
+
+	def _closed(self, error):
+		# unacked deliveries are requeued by the broker, so there's nothing left to do,
+		# and delivery tags start again from 1 if the channel is reopened
+		if self._timer is not None and self._timer is not gevent.getcurrent():
+			self._timer.kill(block=False)
+		self._timer = None
+		self.acked = 0
+		self.done.clear()
+		self.pending.clear()
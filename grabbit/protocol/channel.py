@@ -0,0 +1,242 @@
+from itertools import islice
+
+from gevent.event import AsyncResult
+from gevent.lock import RLock, Semaphore
+from gevent.queue import Queue
+
+from grabbit.errors import AMQPError, ChannelClosed, ChannelError, ConnectionClosed, UnexpectedFrame
+from grabbit.frames import Frame
+from grabbit.frames.content import as_buffer, content_frames
+from grabbit.methods import basic, channel as channel_methods
+from grabbit.methods.common import CloseMethod
+
+
+def expects_response(method):
+	"""Whether the peer will reply to method, ie. it has a response and its no-wait flag (if any) isn't set"""
+	if method.response is None:
+		return False
+	# the spec names this flag "no-wait" in some classes and "nowait" in others
+	return not (getattr(method, 'nowait', False) or getattr(method, 'no_wait', False))
+
+
+class Message(object):
+	"""A method with content (eg. basic.Deliver) as received, with its properties and the whole body."""
+	__slots__ = ('method', 'properties', 'body')
+
+	def __init__(self, method, properties, body):
+		self.method = method
+		self.properties = properties
+		self.body = body
+
+	def __eq__(self, other):
+		return type(self) == type(other) and (self.method, self.properties, self.body) == (
+			other.method, other.properties, other.body
+		)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __repr__(self):
+		return "<{cls.__name__} {self.method!r} ({n} bytes)>".format(cls=type(self), self=self, n=len(self.body))
+
+
+class Channel(object):
+	"""One channel of a Connection. Channels are created with Connection.channel(), except for channel 0,
+	which carries the connection's own methods.
+
+	Frames for this channel are passed to it by the connection's reader greenlet. Methods with content
+	are assembled into a Message once the whole body has arrived.
+	Incoming methods and Messages are then:
+		the result of call(), if one is waiting for a response of that type,
+		passed to callbacks[type(method)] if there is one (from the reader greenlet, so it must not block),
+		otherwise, put on queue, to be taken with get() or by iterating over the channel.
+	A Close from the peer is answered immediately, and closes the channel with the given error.
+
+	Once the channel is closed, error is set, and it is raised by call(), send() and get(),
+	and each of close_callbacks is called with it (also from the reader greenlet, if the peer closed it).
+	A closed channel can be opened again, keeping its callbacks, with Connection.reopen().
+
+	Sends hold send_lock (a gevent RLock) while queueing their frames, as a message body which is read
+	from a file or iterable is sent a frame at a time (see send()), and nothing else may be sent on the
+	channel until it's done.
+
+	If the connection has a recorder (see recovery.Recovery), it is called with (channel, method, response)
+	for each method which succeeded: after its response for call(), or once sent for methods with no response.
+	"""
+
+	def __init__(self, connection, channel_id):
+		self.connection = connection
+		self.id = channel_id
+		self.callbacks = {} # {method class: callback(method or Message)}
+		self.close_callbacks = [] # callback(error) for each, called once the channel is closed
+		self._call_lock = Semaphore() # only one synchronous method may be in progress on a channel
+		self.send_lock = RLock()
+		self.reset()
+
+	def reset(self):
+		"""Clears the state of a closed channel, so that it can be opened again"""
+		self.queue = Queue()
+		self.error = None
+		self._response_types = None # response types call() is waiting for, or None
+		self._response = None # AsyncResult for call()
+		self._content = None # [method, properties, list of body chunks, bytes remaining] while receiving content
+
+	def __repr__(self):
+		return "<{cls.__name__} {self.id}{closed}>".format(
+			cls=type(self), self=self, closed=' closed' if self.error else ''
+		)
+
+	def send(self, method, properties={}, body=b''):
+		"""Send method without waiting for any response. Properties and body are the content of
+		methods which have content (eg. basic.Publish), and are ignored otherwise.
+		A body which isn't a buffer (a file or iterable, see content_frames()) is read and sent a frame at
+		a time, each once the last has been written, so only about one frame of it is held in memory."""
+		if self.error:
+			raise self.error
+		frames = [Frame(Frame.METHOD_TYPE, self.id, method)]
+		with self.send_lock:
+			if method.has_content:
+				content = content_frames(self.id, method.method_class, properties, body, self.connection.frame_size_max)
+				if as_buffer(body) is None:
+					self._send_streamed(frames, content)
+				else:
+					# slices of the body, so this copies nothing
+					self.connection.send_frames(frames + list(content))
+			else:
+				self.connection.send_frames(frames)
+		if self.connection.recorder is not None and not expects_response(method):
+			self.connection.recorder(self, method, None)
+
+	def _send_streamed(self, frames, content):
+		if self.error:
+			raise self.error # closed while we waited for send_lock
+		# the header is built (checking the body size and properties) and queued with the method and first
+		# body frame, so a body which can't be sent at all fails before anything is
+		frames.append(next(content))
+		frames.extend(islice(content, 1))
+		self.connection.send_frames(frames)
+		try:
+			for frame in content:
+				self.connection.writer.drain()
+				if self.error:
+					raise self.error # closed by the peer, which discards the rest
+				self.connection.send_frames([frame])
+		except AMQPError:
+			raise
+		except BaseException as ex:
+			# the peer is waiting for the rest of the body, and nothing else can be sent on the channel,
+			# so the connection is unusable
+			self.connection.lost(ConnectionClosed("Failed part-way through sending a message body: {!r}".format(ex)))
+			raise
+
+	def call(self, method, response=None, timeout=None):
+		"""Send method and wait for its response, which is returned. If the method has no response
+		(see expects_response()), returns None immediately.
+		response overrides the method's response type(s), eg. for methods the server sends first.
+		If the channel is closed while waiting, the error it was closed with is raised.
+		"""
+		if response is None:
+			if not expects_response(method):
+				self.send(method)
+				return None
+			response = method.response
+		response = response if isinstance(response, tuple) else (response,)
+		with self._call_lock:
+			if self.error:
+				raise self.error
+			self._response_types, self._response = response, AsyncResult()
+			try:
+				self.send(method)
+				result = self._response.get(timeout=timeout)
+			finally:
+				self._response_types = self._response = None
+		if self.connection.recorder is not None:
+			self.connection.recorder(self, method, result)
+		return result
+
+	def get(self, block=True, timeout=None):
+		"""Returns the next method or Message from queue. Raises the channel's error once it is closed
+		and queue is empty, and gevent.queue.Empty if no item is available in time."""
+		item = self.queue.get(block, timeout)
+		if item is StopIteration:
+			self.queue.put(item) # leave the marker for any other waiters
+			raise self.error
+		return item
+
+	def __iter__(self):
+		"""Yields each method or Message from queue until the channel is closed"""
+		while True:
+			try:
+				yield self.get()
+			except ChannelClosed:
+				return
+
+	def publish(self, exchange, routing_key, body, properties={}, mandatory=False, immediate=False):
+		self.send(basic.Publish(exchange=exchange, routing_key=routing_key,
+		                        mandatory=mandatory, immediate=immediate), properties, body)
+
+	def close(self, error=None, method=None):
+		"""Close the channel, optionally due to error (an AMQPError) caused by method (a Method class)"""
+		if self.error:
+			return
+		try:
+			self.call(channel_methods.Close(error=error, method=method))
+		except ChannelError:
+			pass # the peer closed it at the same time
+		self.closed(ChannelClosed())
+
+	def closed(self, error):
+		"""Marks the channel as closed with error, failing any waiting call() and get()"""
+		if self.error:
+			return
+		self.error = error
+		self._content = None
+		if self._response is not None:
+			self._response.set_exception(error)
+		self.queue.put(StopIteration)
+		self.connection.channel_closed(self)
+		for callback in self.close_callbacks:
+			callback(error)
+
+	def received(self, frame):
+		"""Called by the connection for each frame received for this channel"""
+		if frame.type == Frame.METHOD_TYPE:
+			method = frame.payload.method
+			if self._content is not None:
+				raise UnexpectedFrame("Method received part-way through content", method=type(method))
+			if method.has_content:
+				self._content = [method, None, [], None]
+			else:
+				self.dispatch(method)
+			return
+		content = self._content
+		if content is None or (frame.type == Frame.HEADER_TYPE) != (content[3] is None):
+			raise UnexpectedFrame("Content frame received out of order", frame_type=frame.type)
+		if frame.type == Frame.HEADER_TYPE:
+			content[1] = frame.payload.properties
+			content[3] = frame.payload.body_size
+		else:
+			content[2].append(frame.payload.value)
+			content[3] -= len(frame.payload.value)
+		if content[3] <= 0:
+			method, properties, chunks, remaining = content
+			self._content = None
+			self.dispatch(Message(method, properties, b''.join(chunks) if len(chunks) != 1 else chunks[0]))
+
+	def dispatch(self, item):
+		"""Deliver a method or Message to whoever is waiting for it. See class docstring."""
+		method = item.method if isinstance(item, Message) else item
+		if self._response_types is not None and isinstance(method, self._response_types):
+			self._response.set(item)
+			self._response_types = None
+			return
+		if isinstance(method, CloseMethod):
+			# closed by the peer. Reply, then close our end.
+			self.connection.send_frames([Frame(Frame.METHOD_TYPE, self.id, type(method).response())])
+			self.closed(method.error or ChannelClosed(method.reason or None))
+			return
+		callback = self.callbacks.get(type(method))
+		if callback is not None:
+			callback(item)
+		else:
+			self.queue.put(item)
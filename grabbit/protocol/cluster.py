@@ -0,0 +1,242 @@
+
+import random
+import time
+from contextlib import contextmanager
+
+import gevent
+
+from grabbit.errors import AMQPError, ConnectionClosed
+from grabbit.methods import basic
+
+from .connection import Connection
+from .pool import PLAIN, ChannelPool
+from .qos import smooth
+from .timers import get_wheel
+
+
+# round trips in a handshake: TCP connect, then ProtocolHeader/Start, StartOk/Tune and Open/OpenOk
+HANDSHAKE_ROUND_TRIPS = 4
+
+
+class Node(object):
+	"""One broker of a Cluster, with its connection (while connected) and health measurements:
+		rtt: moving average round trip time in seconds, from handshakes and probes (None until connected)
+		failures: connection attempts failed or connections lost since it was last connected
+		last_error: the error of the last of those
+		leases: channels leased from it so far, and active: those still checked out
+	"""
+
+	def __init__(self, host, port):
+		self.host = host
+		self.port = port
+		self.connection = None
+		self.pool = None
+		self.rtt = None
+		self.failures = 0
+		self.connects = 0
+		self.last_error = None
+		self.leases = 0
+		self.active = 0
+		self._probe = None # the channel probes are made on
+
+	def __repr__(self):
+		return "<{cls.__name__} {self.host}:{self.port} {state}>".format(
+			cls=type(self), self=self, state='connected' if self.connected else 'down',
+		)
+
+	@property
+	def connected(self):
+		return self.connection is not None and not self.connection.error
+
+
+def parse_address(address, default_port=5672):
+	"""Returns (host, port) for an address, which is "host", "host:port" or (host, port)"""
+	if isinstance(address, tuple):
+		return address
+	host, _, port = address.rpartition(':')
+	if not host:
+		return address, default_port
+	return host, int(port)
+
+
+class Cluster(object):
+	"""Connections to several brokers in a cluster, spreading work across those which are connected
+	and responsive, and reconnecting to any which fail.
+
+	addresses are each "host", "host:port" or (host, port). connection_kwargs are passed to each Connection.
+	connect() connects to every node at once, and fails only if none can be reached. Each node's rtt is
+	first estimated from its handshake (which takes HANDSHAKE_ROUND_TRIPS round trips), then updated every
+	probe_interval seconds by timing a basic.Qos (which changes nothing) on a channel kept for it, so that a
+	node that is overloaded or slow to respond is noticed even while it has no other traffic.
+	Probes are driven by timers on timer_wheel (see timers.get_wheel()).
+
+	lease() (and connection()) pick a node from those connected whose rtt is within rtt_tolerance times
+	the best node's (plus rtt_slack seconds, so that tiny differences on a local network don't count),
+	choosing the one with fewest active leases, and taking turns between those with equally few, so that work
+	is spread over every node that's about as responsive as the best.
+
+	When a node's connection is lost for any reason (eg. ConnectionForced, or a socket error) other than
+	close(), it is reconnected in the background, waiting reconnect_delay seconds doubled for each failure
+	in a row (with some jitter), up to reconnect_delay_max.
+	"""
+
+	def __init__(self, addresses, probe_interval=5, probe_timeout=5, rtt_tolerance=2.0, rtt_slack=0.002,
+	             reconnect_delay=0.5, reconnect_delay_max=30, smoothing=0.3, timer_wheel=None, **connection_kwargs):
+		if not addresses:
+			raise ValueError("At least one address is needed")
+		self.nodes = [Node(*parse_address(address)) for address in addresses]
+		self.probe_interval = probe_interval
+		self.probe_timeout = probe_timeout
+		self.rtt_tolerance = rtt_tolerance
+		self.rtt_slack = rtt_slack
+		self.reconnect_delay = reconnect_delay
+		self.reconnect_delay_max = reconnect_delay_max
+		self.smoothing = smoothing
+		self.timer_wheel = timer_wheel
+		self.connection_kwargs = connection_kwargs
+		self.closed = False
+		self._timers = {} # {node: Timer for its next probe}
+		self._reconnecting = {} # {node: greenlet}
+		self._turn = 0 # incremented by each choose(), to take turns between nodes
+
+	def connect(self):
+		"""Connects to every node, raising the last error if none could be connected to. Returns self."""
+		if self.timer_wheel is None:
+			self.timer_wheel = get_wheel()
+		gevent.joinall([gevent.spawn(self._connect, node) for node in self.nodes])
+		if not any(node.connected for node in self.nodes):
+			raise self.nodes[-1].last_error
+		for node in self.nodes:
+			if not node.connected:
+				self._reconnect_later(node)
+		return self
+
+	def choose(self):
+		"""Returns the Node to use next, see the class docstring"""
+		connected = [node for node in self.nodes if node.connected]
+		if not connected:
+			raise ConnectionClosed("No nodes are connected", nodes=len(self.nodes))
+		limit = min(node.rtt for node in connected) * self.rtt_tolerance + self.rtt_slack
+		turn, count = self._turn, len(self.nodes)
+		self._turn += 1
+		return min(
+			(node for node in connected if node.rtt <= limit),
+			key=lambda node: (node.active, (self.nodes.index(node) - turn) % count),
+		)
+
+	def connection(self):
+		"""Returns the Connection of the node to use next"""
+		node = self.choose()
+		node.leases += 1
+		return node.connection
+
+	@contextmanager
+	def lease(self, mode=PLAIN, timeout=None):
+		"""Leases a channel (or ConfirmPublisher, see ChannelPool) of mode from the node to use next,
+		for the duration of a with block"""
+		node = self.choose()
+		node.leases += 1
+		node.active += 1
+		try:
+			with node.pool.lease(mode, timeout) as lease:
+				yield lease
+		finally:
+			node.active -= 1
+
+	def close(self):
+		"""Closes every connection, and stops reconnecting"""
+		self.closed = True
+		for timer in self._timers.values():
+			timer.cancel()
+		gevent.killall(list(self._reconnecting.values()))
+		for node in self.nodes:
+			if node.connected:
+				node.connection.close()
+
+	def _connect(self, node):
+		"""Tries to connect to node, returning whether it did"""
+		kwargs = dict(self.connection_kwargs, host=node.host, port=node.port)
+		start = time.time()
+		connection = Connection(**kwargs)
+		try:
+			connection.connect()
+			rtt = (time.time() - start) / HANDSHAKE_ROUND_TRIPS
+			probe = connection.channel()
+			pool = ChannelPool(connection)
+		except (AMQPError, EnvironmentError) as ex:
+			if connection.sock is not None:
+				connection.lost(ConnectionClosed("Failed to set up connection"))
+			node.failures += 1
+			node.last_error = ex if isinstance(ex, AMQPError) else ConnectionClosed(
+				"Failed to connect to {}:{}: {!r}".format(node.host, node.port, ex)
+			)
+			return False
+		if self.closed:
+			connection.close()
+			return False
+		node.connection, node.pool, node._probe = connection, pool, probe
+		node.rtt = smooth(node.rtt, rtt, self.smoothing)
+		node.failures = 0
+		node.connects += 1
+		connection.close_callbacks.append(lambda error: self._lost(node, connection, error))
+		self._schedule_probe(node)
+		return True
+
+	def _lost(self, node, connection, error):
+		if node.connection is not connection:
+			return
+		node.last_error = error
+		node.failures += 1
+		timer = self._timers.pop(node, None)
+		if timer is not None:
+			timer.cancel()
+		if not self.closed:
+			self._reconnect_later(node)
+
+	def _reconnect_later(self, node):
+		delay = min(self.reconnect_delay * 2 ** max(0, node.failures - 1), self.reconnect_delay_max)
+		self._reconnecting[node] = gevent.spawn_later(delay * random.uniform(0.8, 1.2), self._reconnect, node)
+
+	def _reconnect(self, node):
+		del self._reconnecting[node]
+		if not self.closed and not self._connect(node):
+			self._reconnect_later(node)
+
+	def _schedule_probe(self, node):
+		self._timers[node] = self.timer_wheel.schedule(self.probe_interval, gevent.spawn, self._probe_rtt, node)
+
+	def _probe_rtt(self, node):
+		connection, channel = node.connection, node._probe
+		timeout = gevent.Timeout(self.probe_timeout)
+		start = time.time()
+		try:
+			with timeout:
+				if channel is None:
+					channel = node._probe = connection.channel()
+					start = time.time()
+				channel.call(basic.Qos(0, 0, **{'global': False}))
+			rtt = time.time() - start
+		except gevent.Timeout as ex:
+			if ex is not timeout:
+				raise
+			rtt = self.probe_timeout # it's at least this slow
+			# a late reply would answer the next probe early, so that's made on a new channel
+			if channel is not None:
+				gevent.spawn(close_quietly, channel)
+				if node._probe is channel:
+					node._probe = None
+		except AMQPError:
+			return # lost, and being reconnected
+		if node.connection is not connection:
+			return # reconnected meanwhile, which scheduled a probe of its own
+		node.rtt = smooth(node.rtt, rtt, self.smoothing)
+		if node.connected and not self.closed:
+			self._schedule_probe(node)
+
+
+def close_quietly(channel):
+	"""Closes channel, ignoring errors, eg. from the connection being lost meanwhile"""
+	try:
+		channel.close()
+	except AMQPError:
+		pass
@@ -0,0 +1,166 @@
+
+import time
+from collections import deque
+
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+
+from grabbit.errors import ChannelClosed
+from grabbit.methods import basic, confirm
+
+
+class MessageNacked(Exception):
+	"""The broker could not take responsibility for a published message (it sent a basic.Nack for it),
+	so it may have been lost. delivery_tag is the message's publish sequence number."""
+	def __init__(self, delivery_tag):
+		super(MessageNacked, self).__init__("Message {} was nacked".format(delivery_tag))
+		self.delivery_tag = delivery_tag
+
+
+class OutstandingTags(object):
+	"""Tracks the publish sequence numbers (the delivery tags of the broker's Acks and Nacks) of messages
+	which haven't been confirmed yet, and a value (eg. a future) for each.
+	Tags are allocated in increasing order from 1, as the broker numbers published messages, so they are
+	kept as a deque of values starting from tag lowest, with None for tags resolved out of order.
+	Each tag is added and removed from the deque once, so resolving N tags costs O(N) in total,
+	however many confirms (multiple or not) they arrive in.
+	"""
+
+	def __init__(self):
+		self.values = deque() # value for each tag from lowest, or None if resolved
+		self.lowest = 1
+		self.count = 0 # values which aren't None
+
+	def __len__(self):
+		return self.count
+
+	@property
+	def next_tag(self):
+		return self.lowest + len(self.values)
+
+	def add(self, value):
+		"""Returns the tag of the next message published, and keeps value for it until it is resolved"""
+		tag = self.next_tag
+		self.values.append(value)
+		self.count += 1
+		return tag
+
+	def resolve(self, tag, multiple=False):
+		"""Returns a list of (tag, value) for the outstanding tags a confirm of tag resolves, in order,
+		and forgets them. A multiple confirm of tag 0 resolves all outstanding tags."""
+		values = self.values
+		resolved = []
+		if multiple:
+			count = len(values) if tag == 0 else min(tag - self.lowest + 1, len(values))
+			for n in range(self.lowest, self.lowest + count):
+				value = values.popleft()
+				if value is not None:
+					resolved.append((n, value))
+			self.lowest += max(count, 0)
+		else:
+			index = tag - self.lowest
+			if 0 <= index < len(values) and values[index] is not None:
+				resolved.append((tag, values[index]))
+				values[index] = None
+		self.count -= len(resolved)
+		while values and values[0] is None:
+			values.popleft()
+			self.lowest += 1
+		return resolved
+
+	def discard_last(self, tag):
+		"""Forgets tag, the last one added, eg. as its message wasn't published after all"""
+		if tag != self.next_tag - 1 or self.values[-1] is None:
+			raise ValueError("Tag {} isn't the last outstanding tag".format(tag))
+		self.values.pop()
+		self.count -= 1
+
+	def pending(self):
+		"""Returns the values of all outstanding tags, in order"""
+		return [value for value in self.values if value is not None]
+
+
+class ConfirmPublisher(object):
+	"""Publishes on a channel in confirm mode (a RabbitMQ extension), returning a future for each message.
+
+	Creating it puts channel into confirm mode. publish() returns an AsyncResult, which is set to the
+	message's publish sequence number once the broker acks it, or fails with MessageNacked if it nacks it,
+	or the channel's error if the channel is closed first. Publishes are pipelined: any number may be
+	waiting for confirms, up to max_in_flight if it is not 0, beyond which publish() blocks until
+	earlier messages are confirmed.
+
+	If the channel is reopened in confirm mode (eg. by recovery.Recovery), the broker numbers messages from 1
+	again, and so does the ConfirmPublisher.
+	"""
+
+	def __init__(self, channel, max_in_flight=0):
+		self.channel = channel
+		self.max_in_flight = max_in_flight
+		self.outstanding = OutstandingTags()
+		self._in_flight = Semaphore(max_in_flight) if max_in_flight else None
+		channel.callbacks[basic.Ack] = self._confirmed
+		channel.callbacks[basic.Nack] = self._confirmed
+		channel.close_callbacks.append(self._closed)
+		channel.call(confirm.Select(no_wait=False))
+
+	def publish(self, exchange, routing_key, body, properties={}, mandatory=False, immediate=False):
+		"""Publishes a message, returning an AsyncResult for its confirm"""
+		in_flight = self._in_flight
+		if in_flight is not None:
+			in_flight.acquire()
+			if in_flight is not self._in_flight:
+				# the channel was closed while we waited
+				raise self.channel.error or ChannelClosed("Channel was closed while waiting to publish")
+		if self.channel.error:
+			self._release(1)
+			raise self.channel.error
+		result = AsyncResult()
+		# tags must be taken in the order messages are sent, and sending a streamed body yields
+		with self.channel.send_lock:
+			tag = self.outstanding.add(result)
+			try:
+				self.channel.publish(exchange, routing_key, body, properties, mandatory, immediate)
+			except Exception:
+				# unless the channel was closed (which fails every outstanding result), the message wasn't sent,
+				# so the broker won't number it. Nothing can have been added since, as we hold send_lock.
+				if not result.ready():
+					self.outstanding.discard_last(tag)
+					self._release(1)
+				raise
+		return result
+
+	def wait(self, timeout=None):
+		"""Waits until every message published so far is confirmed, or timeout. Returns whether they were.
+		Doesn't raise for nacked messages, check each publish()'s result for that."""
+		deadline = None if timeout is None else time.time() + timeout
+		for result in self.outstanding.pending():
+			if not result.wait(None if deadline is None else max(0, deadline - time.time())):
+				return False
+		return True
+
+	def _confirmed(self, method):
+		resolved = self.outstanding.resolve(method.delivery_tag, method.multiple)
+		if isinstance(method, basic.Ack):
+			for tag, result in resolved:
+				result.set(tag)
+		else:
+			for tag, result in resolved:
+				result.set_exception(MessageNacked(tag))
+		self._release(len(resolved))
+
+	def _closed(self, error):
+		for tag, result in self.outstanding.resolve(0, multiple=True):
+			result.set_exception(error)
+		# tags start again from 1 if the channel is reopened, with every slot free
+		self.outstanding = OutstandingTags()
+		in_flight = self._in_flight
+		if in_flight is not None:
+			self._in_flight = Semaphore(self.max_in_flight)
+			# wake any publish() waiting for a slot, to raise the error
+			for _ in range(self.max_in_flight):
+				in_flight.release()
+
+	def _release(self, count):
+		if self._in_flight is not None:
+			for _ in range(count):
+				self._in_flight.release()
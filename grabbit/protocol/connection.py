@@ -0,0 +1,303 @@
+
+import gevent
+from gevent import socket
+
+from grabbit.compat import integer_types, to_bytes
+from grabbit.errors import AMQPError, ConnectionClosed
+from grabbit.frames import Frame, FrameReader
+from grabbit.frames.datatypes import ProtocolHeader
+from grabbit.methods import channel as channel_methods, connection as connection_methods
+
+from .channel import Channel
+from .timers import get_wheel
+from .writer import Writer, get_profile, set_nodelay
+
+
+# bytes read from the socket at a time. Several frames are usually decoded from each read.
+RECV_SIZE = 65536
+# the highest channel number, used when the server doesn't limit it
+CHANNEL_MAX = 65535
+# seconds to wait for queued frames to be written when closing
+CLOSE_TIMEOUT = 5
+# heartbeat_delays without anything received from the server before the connection is considered lost
+HEARTBEATS_MISSED_MAX = 2
+
+CLIENT_PROPERTIES = {
+	'product': 'grabbit',
+	'capabilities': {
+		'publisher_confirms': True,
+		'consumer_cancel_notify': True,
+	},
+}
+
+
+def negotiate(client, server):
+	"""Returns the agreed value of a limit from Tune, where 0 means no limit"""
+	if client and server:
+		return min(client, server)
+	return client or server
+
+
+class Connection(object):
+	"""A connection to a broker, which channels are opened on.
+
+	connect() opens the socket and performs the handshake: Start/StartOk (with PLAIN authentication),
+	Tune/TuneOk and Open/OpenOk. channel_max and frame_size_max are the client's limits, and the smaller
+	of these and the server's are used. heartbeat_delay is in seconds: if the server also wants heartbeats,
+	the smaller of the two is used, and 0 disables heartbeats.
+
+	With heartbeats, a heartbeat frame is sent whenever nothing else has been sent for half of heartbeat_delay,
+	and the connection is lost if nothing has been received for HEARTBEATS_MISSED_MAX heartbeat_delays.
+	Rather than each connection having a greenlet for this, they are driven by timers on timer_wheel
+	(by default one shared by the whole process, see timers.get_wheel()), which only compare counts of reads
+	and writes, so a connection which is busy in both directions does no heartbeat work besides that.
+
+	After connecting, a single reader greenlet reads and decodes all frames, and passes each to the Channel
+	for its channel number in channels (see Channel for what happens to it then). Channel 0 carries the
+	connection's own methods. Frames sent from any greenlet are written by a Writer, which coalesces them
+	into as few writes as possible, and interleaves channels' frames so that a large message on one
+	channel doesn't hold up the others (see Writer).
+	write_profile is the Writer's WriteProfile, or the name of one of writer.PROFILES: 'latency' (the default)
+	or 'throughput'.
+
+	If the connection is lost or closed by the server, every channel is closed with the error
+	(a ConnectionClosed if there was no more specific error), which is also kept as error,
+	and then each of close_callbacks is called with it. connect() may then be called again to reconnect,
+	and channels reopened with reopen() (see recovery.Recovery, which does this).
+	"""
+
+	def __init__(self, host='localhost', port=5672, virtual_host='/', username='guest', password='guest',
+	             channel_max=0, frame_size_max=131072, heartbeat_delay=0, client_properties={},
+	             connect_timeout=None, lazy=False, write_profile='latency', timer_wheel=None):
+		self.host = host
+		self.port = port
+		self.virtual_host = virtual_host
+		self.username = username
+		self.password = password
+		self.channel_max = channel_max
+		self.frame_size_max = frame_size_max
+		self.heartbeat_delay = heartbeat_delay
+		self.client_properties = dict(CLIENT_PROPERTIES, **client_properties)
+		self.connect_timeout = connect_timeout
+		self.lazy = lazy
+		self.write_profile = get_profile(write_profile)
+		self.timer_wheel = timer_wheel
+		self.reads = 0 # number of reads from the socket, for detecting when the server has gone quiet
+		self.server_properties = None
+		self.sock = None
+		self.reader = None
+		self.writer = None
+		self.control = None
+		self.error = None
+		self.channels = {}
+		self.close_callbacks = [] # callback(error) for each, called once the connection is closed
+		self.recorder = None # callback(channel, method, response) for methods which succeed, see Channel
+		self._reader = None
+		self._next_channel_id = 1
+		self._heartbeat_timers = {} # {'send' or 'receive': Timer}
+
+	def __repr__(self):
+		return "<{cls.__name__} {self.host}:{self.port}{closed}>".format(
+			cls=type(self), self=self, closed=' closed' if self.error else ''
+		)
+
+	def connect(self):
+		"""Connects and performs the handshake. Returns self.
+		Can be called again once the connection is lost, to reconnect (without any channels)."""
+		self.sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+		self.sock.settimeout(None)
+		self.error = None
+		self.channels = {}
+		set_nodelay(self.sock, self.write_profile.nodelay)
+		self.writer = Writer(self.sock, self.write_profile, on_error=self.lost)
+		self.reader = FrameReader(lazy=self.lazy)
+		self.control = self.channels[0] = Channel(self, 0)
+		self._reader = gevent.spawn(self._read_loop)
+		try:
+			self._handshake()
+		except AMQPError as ex:
+			self.lost(ex)
+			raise
+		except Exception as ex:
+			error = ConnectionClosed("Handshake failed: {!r}".format(ex))
+			self.lost(error)
+			raise error
+		return self
+
+	def _handshake(self):
+		self.writer.write([ProtocolHeader()])
+		start = self.control.get(timeout=self.connect_timeout)
+		if not isinstance(start, connection_methods.Start):
+			raise ConnectionClosed("Expected connection.Start", method=type(start))
+		if 'PLAIN' not in start.security_mechanisms:
+			raise ConnectionClosed("Server does not support PLAIN authentication",
+			                       mechanisms=start.security_mechanisms)
+		self.server_properties = start.server_properties
+		tune = self.control.call(connection_methods.StartOk(
+			client_properties=self.client_properties,
+			security_mechanism='PLAIN',
+			security_response=b'\0' + to_bytes(self.username) + b'\0' + to_bytes(self.password),
+			locale='en_US',
+		), response=(connection_methods.Tune, connection_methods.Secure), timeout=self.connect_timeout)
+		if not isinstance(tune, connection_methods.Tune):
+			raise ConnectionClosed("Server sent a security challenge, which PLAIN authentication does not use")
+		self.channel_max = negotiate(self.channel_max, tune.channel_max) or CHANNEL_MAX
+		self.frame_size_max = negotiate(self.frame_size_max, tune.frame_size_max)
+		if self.heartbeat_delay:
+			self.heartbeat_delay = negotiate(self.heartbeat_delay, tune.heartbeat_delay)
+		self.control.send(connection_methods.TuneOk(self.channel_max, self.frame_size_max, self.heartbeat_delay))
+		self.reader.frame_size_max = self.frame_size_max
+		if self.heartbeat_delay:
+			if self.timer_wheel is None:
+				self.timer_wheel = get_wheel()
+			self._check_sent(None)
+			self._check_received(None, 0)
+		self.control.call(connection_methods.Open(self.virtual_host), timeout=self.connect_timeout)
+
+	def _check_sent(self, writes):
+		# sends a heartbeat if nothing has been written since the last check (writes), and nothing is queued
+		# (which a heartbeat wouldn't get ahead of anyway)
+		if self.error:
+			return
+		writer = self.writer
+		expected = writer.writes
+		if writes == expected and not writer.size:
+			try:
+				writer.write([Frame(Frame.HEARTBEAT_TYPE, 0)])
+			except ConnectionClosed:
+				return
+			expected += 1 # don't count the heartbeat's own write as activity
+		self._heartbeat_timers['send'] = self.timer_wheel.schedule(
+			self.heartbeat_delay / 2.0, self._check_sent, expected,
+		)
+
+	def _check_received(self, reads, missed):
+		# counts the checks since the last read, which happen every heartbeat_delay
+		if self.error:
+			return
+		missed = missed + 1 if reads == self.reads else 0
+		if missed >= HEARTBEATS_MISSED_MAX:
+			# lost() waits for the writer to flush, which mustn't hold up the timer wheel
+			gevent.spawn(self.lost, ConnectionClosed("Missed heartbeats from server", missed=missed))
+			return
+		self._heartbeat_timers['receive'] = self.timer_wheel.schedule(
+			self.heartbeat_delay, self._check_received, self.reads, missed,
+		)
+
+	def _read_loop(self):
+		reader = self.reader
+		try:
+			while True:
+				data = self.sock.recv(RECV_SIZE)
+				if not data:
+					self.lost(ConnectionClosed("Connection closed by peer"))
+					return
+				self.reads += 1
+				reader.feed(data)
+				for frame in reader:
+					self.received(frame)
+		except gevent.GreenletExit:
+			pass
+		except AMQPError as ex:
+			self.abort(ex)
+		except Exception as ex:
+			self.lost(ConnectionClosed("Error reading from socket: {!r}".format(ex)))
+
+	def received(self, frame):
+		"""Called by the reader greenlet for each frame received"""
+		if isinstance(frame, ProtocolHeader):
+			raise ConnectionClosed("Server does not support protocol version", header=frame)
+		if frame.type == Frame.HEARTBEAT_TYPE:
+			return
+		channel = self.channels.get(frame.channel)
+		if channel is not None:
+			channel.received(frame)
+
+	def send_frames(self, frames, priority=None):
+		"""Queues the given frames to be sent with no other frames for their channel between them.
+		priority overrides whether they are sent ahead of other frames, see writer.is_priority()."""
+		if self.error:
+			raise self.error
+		self.writer.write(frames, priority)
+
+	def channel(self):
+		"""Opens and returns a new Channel"""
+		if self.error:
+			raise self.error
+		channel_id = self._allocate_channel_id()
+		channel = self.channels[channel_id] = Channel(self, channel_id)
+		try:
+			channel.call(channel_methods.Open())
+		except BaseException:
+			self.channels.pop(channel_id, None)
+			raise
+		return channel
+
+	def reopen(self, channel):
+		"""Opens a closed Channel of this connection again, with the same id, callbacks and close_callbacks,
+		eg. after reconnecting"""
+		if self.error:
+			raise self.error
+		if channel.id in self.channels:
+			raise ValueError("Channel {} is already open".format(channel.id))
+		channel.reset()
+		self.channels[channel.id] = channel
+		try:
+			channel.call(channel_methods.Open())
+		except BaseException:
+			self.channels.pop(channel.id, None)
+			raise
+
+	def _allocate_channel_id(self):
+		# channel ids are allocated in turn, so a recently closed channel's id isn't re-used straight away
+		for _ in range(self.channel_max):
+			channel_id = self._next_channel_id
+			self._next_channel_id = channel_id % self.channel_max + 1
+			if channel_id not in self.channels:
+				return channel_id
+		raise ValueError("All {} channels are in use".format(self.channel_max))
+
+	def channel_closed(self, channel):
+		"""Called by a Channel once it is closed"""
+		if self.channels.get(channel.id) is channel:
+			del self.channels[channel.id]
+		if channel.id == 0:
+			self.lost(channel.error)
+
+	def close(self, error=None, method=None):
+		"""Closes the connection, optionally due to error (an AMQPError) caused by method (a Method class)"""
+		if self.error:
+			return
+		try:
+			self.control.call(connection_methods.Close(error=error, method=method))
+		except AMQPError:
+			pass # the peer closed it at the same time
+		self.lost(ConnectionClosed())
+
+	def abort(self, error):
+		"""Closes the connection due to error without waiting for the peer to reply,
+		eg. when the peer has broken the protocol. The peer is only sent a Close for errors with a reply code."""
+		if isinstance(error.code, integer_types):
+			try:
+				self.send_frames([Frame(Frame.METHOD_TYPE, 0, connection_methods.Close(error=error))], priority=True)
+			except Exception:
+				pass # we're closing anyway
+		self.lost(error)
+
+	def lost(self, error):
+		"""Marks the connection as closed with error, closing all channels and the socket"""
+		if self.error:
+			return
+		self.error = error
+		for timer in self._heartbeat_timers.values():
+			timer.cancel()
+		for channel in list(self.channels.values()):
+			channel.closed(error)
+		if self.writer is not None:
+			self.writer.close(CLOSE_TIMEOUT) # eg. our CloseOk to the peer's Close
+		if self.sock is not None:
+			self.sock.close()
+		if self._reader is not None and self._reader is not gevent.getcurrent():
+			self._reader.kill(block=False)
+		for callback in self.close_callbacks:
+			callback(error)
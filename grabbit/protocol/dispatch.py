@@ -0,0 +1,181 @@
+
+import multiprocessing
+
+import gevent
+from gevent.queue import Queue
+from gevent.threadpool import ThreadPool
+
+from grabbit.errors import AMQPError
+from grabbit.methods import basic
+
+from .ack import AckManager
+
+
+def routing_key(message):
+	"""The default key for Dispatcher: a delivery's routing key"""
+	return message.method.routing_key
+
+
+class Dispatcher(object):
+	"""Handles the deliveries on a channel concurrently, while handling those with the same key
+	in the order they arrived.
+
+	Each basic.Deliver is put in one of partitions queues by the hash of key(message) (by default its
+	routing key, see routing_key()), and each partition's messages are passed to handler(message)
+	one at a time, in order. So up to partitions messages are handled at once, never two with the same key.
+	Handlers are run in a greenlet per partition, for IO-bound work, or if processes is set, in a
+	multiprocessing pool of that many processes, for CPU-bound work. Messages are then pickled,
+	handler must be a module-level function, and what it returns is discarded.
+
+	Each message is acked once its handler returns, through acks (an AckManager, which coalesces them),
+	or nacked (and requeued, if requeue is set) if it raises. A requeued message is redelivered after
+	those behind it, so ordering only holds for messages which are handled successfully.
+	Counts of messages handled and failed are kept, and the last handler error in last_error.
+
+	The channel's prefetch_count is set (with a global basic.Qos) to partitions * partition_size, so the broker
+	can't send more than the partitions can hold. As keys may not be spread evenly, once any partition has
+	partition_size messages waiting, prefetch_count is lowered to 1, which stops deliveries until every
+	partition is down to half of partition_size, and it's set back. So the Dispatcher takes over the channel's
+	Qos, and shouldn't be used with a QosController.
+
+	Deliveries are taken with channel.callbacks, so consumers should be started after creating the Dispatcher.
+	If the channel is closed, messages waiting in partitions are dropped (the broker will redeliver them), and
+	if it's reopened (eg. by recovery.Recovery), the Dispatcher carries on with the new deliveries.
+	"""
+
+	def __init__(self, channel, handler, key=routing_key, partitions=16, partition_size=64, processes=0,
+	             requeue=True, acks=None):
+		if not 0 < partitions * partition_size <= 65535:
+			raise ValueError("Need 0 < partitions * partition_size <= 65535, not {} * {}".format(
+				partitions, partition_size,
+			))
+		self.channel = channel
+		self.handler = handler
+		self.key = key
+		self.partition_size = partition_size
+		self.prefetch_count = partitions * partition_size
+		self.requeue = requeue
+		self.acks = acks or AckManager(channel)
+		self.partitions = [Queue() for _ in range(partitions)] # of (generation, message), or None to stop
+		self.handled = 0
+		self.failed = 0
+		self.last_error = None
+		self.throttled = False # whether prefetch_count has been lowered, as a partition is full
+		self.throttles = 0 # times it has been
+		self.closed = False
+		self._generation = 0 # incremented when the channel is closed, so older deliveries aren't acked
+		self._qos_sent = None
+		self._qos_greenlet = None
+		self._processes = self._threads = None
+		if processes:
+			self._processes = multiprocessing.Pool(processes)
+			self._threads = ThreadPool(partitions) # to wait for the processes without blocking
+		# global is a keyword, so can't be given as an ordinary kwarg
+		channel.call(basic.Qos(0, self.prefetch_count, **{'global': True}))
+		self._qos_sent = self.prefetch_count
+		self._workers = [gevent.spawn(self._work, partition) for partition in self.partitions]
+		channel.callbacks[basic.Deliver] = self._delivered
+		channel.close_callbacks.append(self._closed)
+
+	@property
+	def waiting(self):
+		"""The number of messages waiting in partitions"""
+		return sum(partition.qsize() for partition in self.partitions)
+
+	def close(self):
+		"""Stops taking deliveries, and waits for those already taken to be handled and acked.
+		Consumers should be cancelled first, or later deliveries are left on the channel's queue."""
+		if self.closed:
+			return
+		self.closed = True
+		if self.channel.callbacks.get(basic.Deliver) == self._delivered:
+			del self.channel.callbacks[basic.Deliver]
+		for partition in self.partitions:
+			partition.put(None)
+		gevent.joinall(self._workers)
+		if not self.channel.error:
+			self.acks.flush()
+		if self._processes is not None:
+			self._processes.close()
+			self._processes.join()
+			self._threads.kill()
+
+	def _delivered(self, message):
+		# called from the reader greenlet, so mustn't block
+		partition = self.partitions[hash(self.key(message)) % len(self.partitions)]
+		partition.put((self._generation, message))
+		if partition.qsize() >= self.partition_size and not self.throttled:
+			self.throttled = True
+			self.throttles += 1
+			self._qos_changed()
+		elif self._qos_sent is None:
+			self._qos_changed() # the channel was reopened, and may have some other Qos
+
+	def _work(self, partition):
+		while True:
+			item = partition.get()
+			if item is None:
+				return
+			generation, message = item
+			try:
+				self._handle(message)
+			except Exception as ex:
+				self.failed += 1
+				self.last_error = ex
+				if generation == self._generation:
+					self.acks.nack(message.method.delivery_tag, self.requeue)
+			else:
+				self.handled += 1
+				if generation == self._generation:
+					self.acks.ack(message.method.delivery_tag)
+			low = self.partition_size // 2
+			if self.throttled and all(partition.qsize() <= low for partition in self.partitions):
+				self.throttled = False
+				self._qos_changed()
+
+	def _handle(self, message):
+		if self._processes is None:
+			self.handler(message)
+			return
+		error = self._threads.apply(apply_in, (self._processes, self.handler, message))
+		if error is not None:
+			raise error
+
+	def _qos_changed(self):
+		if self._qos_greenlet is None:
+			self._qos_greenlet = gevent.spawn(self._update_qos)
+
+	def _update_qos(self):
+		# sends Qos until the last one sent is what's wanted, as that may change while sending
+		try:
+			while not self.channel.error:
+				prefetch_count = 1 if self.throttled else self.prefetch_count
+				if prefetch_count == self._qos_sent:
+					break
+				self.channel.call(basic.Qos(0, prefetch_count, **{'global': True}))
+				self._qos_sent = prefetch_count
+		except AMQPError:
+			pass # the channel was closed, see _closed()
+		finally:
+			self._qos_greenlet = None
+
+	def _closed(self, error):
+		# unacked deliveries are requeued by the broker, so those waiting are dropped
+		self._generation += 1
+		self._qos_sent = None
+		self.throttled = False
+		for partition in self.partitions:
+			while not partition.empty():
+				if partition.get_nowait() is None:
+					partition.put(None) # close() is waiting for it
+					break
+
+
+def apply_in(pool, handler, message):
+	"""Calls handler(message) in a process of pool, returning the exception it raised, if any.
+	Run in a thread, as waiting for the pool would block the gevent hub (which also reports errors raised
+	in its threads, so they're returned instead)."""
+	try:
+		pool.apply(handler, (message,))
+	except Exception as ex:
+		return ex
@@ -0,0 +1,166 @@
+
+from contextlib import contextmanager
+
+import gevent
+from gevent.event import Event
+
+from grabbit.errors import AMQPError, ChannelClosed
+from grabbit.methods import tx
+
+from .confirm import ConfirmPublisher
+
+
+# the kinds of channel a ChannelPool keeps, see ChannelPool
+PLAIN, CONFIRM, TX = MODES = ('plain', 'confirm', 'tx')
+
+
+class ChannelPool(object):
+	"""Lends out open channels of one Connection, so that an operation doesn't have to wait for
+	a channel to be opened and closed around it, or share a channel that another's error could close.
+
+	checkout(mode) returns an idle channel of that mode, opening one if there are none and fewer than max_size
+	(by default the connection's channel_max) are open. Once max_size are open, an idle channel of another mode
+	is closed to make room, or else checkout() waits for one to be checked in with checkin().
+	lease() does both around a with block. The modes are kept apart, as a channel can't leave them:
+		PLAIN: a Channel
+		CONFIRM: a ConfirmPublisher (with max_in_flight) on a channel in confirm mode, see ConfirmPublisher
+		TX: a Channel in transaction mode (tx.Select). Uncommitted work is rolled back (tx.Rollback) on checkin,
+			so that the next borrower's tx.Commit can't commit it.
+	prefill is {mode: count} of channels to open straight away, by default one PLAIN channel.
+
+	When a channel is closed by an error, whether idle or checked out, a replacement of the same mode
+	is opened in the background, unless the connection is closed. Checking in a closed channel only
+	forgets it, so callers can check in whatever they checked out, error or not.
+	"""
+
+	def __init__(self, connection, max_size=0, prefill=None, max_in_flight=0):
+		if max_size > connection.channel_max:
+			raise ValueError("max_size {} is more than the connection's channel_max {}".format(
+				max_size, connection.channel_max,
+			))
+		self.connection = connection
+		self.max_size = max_size or connection.channel_max
+		self.max_in_flight = max_in_flight
+		self.idle = {mode: [] for mode in MODES} # {mode: [channel or ConfirmPublisher]}
+		self.size = 0 # channels open or being opened for the pool, whether idle or checked out
+		self.replaced = 0 # channels replaced after being closed by an error
+		self.closed = False
+		self._modes = {} # {channel or ConfirmPublisher: mode} for every one open
+		self._leased = set() # those which are checked out
+		self._available = Event() # set when a channel is checked in or closed
+		if prefill is None:
+			prefill = {PLAIN: 1}
+		for mode, count in prefill.items():
+			for _ in range(count):
+				self.idle[mode].append(self._open(mode))
+
+	def checkout(self, mode=PLAIN, timeout=None):
+		"""Returns an idle channel (or ConfirmPublisher) of mode, waiting up to timeout if max_size
+		are checked out, after which gevent.Timeout is raised"""
+		if mode not in MODES:
+			raise ValueError("Unknown channel mode {!r}, expected one of: {}".format(mode, ', '.join(MODES)))
+		with gevent.Timeout(timeout):
+			while True:
+				if self.closed:
+					raise ChannelClosed("Channel pool is closed")
+				if self.connection.error:
+					raise self.connection.error
+				if self.idle[mode]:
+					lease = self.idle[mode].pop()
+				elif self.size < self.max_size:
+					lease = self._open(mode)
+				else:
+					lease = None
+				if lease is not None:
+					self._leased.add(lease)
+					return lease
+				others = [other for other in MODES if self.idle[other]]
+				if others:
+					# make room by closing an idle channel of another mode, once it's closed we'll have a slot
+					channel_of(self.idle[others[0]].pop()).close()
+					continue
+				self._available.clear()
+				self._available.wait()
+
+	def checkin(self, lease):
+		"""Returns a channel (or ConfirmPublisher) from checkout() to the pool"""
+		if lease not in self._leased:
+			if channel_of(lease).error:
+				return # closed while checked out, and already forgotten
+			raise ValueError("{!r} is not checked out from this pool".format(lease))
+		self._leased.remove(lease)
+		if self.closed:
+			channel_of(lease).close()
+			return
+		mode = self._modes[lease]
+		if mode == TX:
+			try:
+				lease.call(tx.Rollback())
+			except AMQPError:
+				return # closed, and forgotten (and replaced) by _closed()
+		self.idle[mode].append(lease)
+		self._available.set()
+
+	@contextmanager
+	def lease(self, mode=PLAIN, timeout=None):
+		"""Checks out a channel (or ConfirmPublisher) of mode for the duration of a with block"""
+		lease = self.checkout(mode, timeout)
+		try:
+			yield lease
+		finally:
+			self.checkin(lease)
+
+	def close(self):
+		"""Closes every idle channel, and every checked out one once it's checked in"""
+		self.closed = True
+		for mode in MODES:
+			idle, self.idle[mode] = self.idle[mode], []
+			for lease in idle:
+				channel_of(lease).close()
+		self._available.set()
+
+	def _open(self, mode):
+		self.size += 1
+		try:
+			channel = self.connection.channel()
+			if mode == CONFIRM:
+				lease = ConfirmPublisher(channel, self.max_in_flight)
+			else:
+				lease = channel
+				if mode == TX:
+					channel.call(tx.Select())
+		except BaseException:
+			self.size -= 1
+			self._available.set()
+			raise
+		self._modes[lease] = mode
+		channel.close_callbacks.append(lambda error: self._closed(lease, error))
+		return lease
+
+	def _closed(self, lease, error):
+		# called from the reader greenlet, so mustn't block
+		mode = self._modes.pop(lease)
+		if lease in self._leased:
+			self._leased.remove(lease)
+		elif lease in self.idle[mode]:
+			self.idle[mode].remove(lease)
+		self.size -= 1
+		self._available.set()
+		if not isinstance(error, ChannelClosed) and not self.closed and not self.connection.error:
+			gevent.spawn(self._replace, mode)
+
+	def _replace(self, mode):
+		if self.size >= self.max_size or self.closed:
+			return
+		try:
+			lease = self._open(mode)
+		except AMQPError:
+			return # eg. the connection was lost. The next checkout() will raise it.
+		self.replaced += 1
+		self.idle[mode].append(lease)
+		self._available.set()
+
+
+def channel_of(lease):
+	"""Returns the Channel of a channel or ConfirmPublisher from a ChannelPool"""
+	return lease.channel if isinstance(lease, ConfirmPublisher) else lease
@@ -0,0 +1,158 @@
+
+import math
+import time
+from collections import deque
+
+import gevent
+
+from grabbit.errors import AMQPError
+from grabbit.methods import basic
+
+
+def smooth(average, sample, weight):
+	"""Returns the exponentially weighted moving average of average (None for no samples yet) and sample"""
+	return sample if average is None else average + weight * (sample - average)
+
+
+class ConsumerStats(object):
+	"""Handler measurements for one consumer, see QosController"""
+	__slots__ = ('service_time', 'completed', 'throughput')
+
+	def __init__(self):
+		self.service_time = None # moving average of seconds from started() to finished()
+		self.completed = 0 # finished() calls since the last update
+		self.throughput = 0.0 # messages finished per second over the last update interval
+
+	def as_dict(self):
+		return {name: getattr(self, name) for name in self.__slots__}
+
+
+class QosController(object):
+	"""Adjusts a channel's prefetch_count (with basic.Qos) to keep just enough deliveries in flight to cover
+	the time each one takes to be handled and acked, at the rate the channel's consumers handle them.
+
+	Call started(message) when a handler starts on a delivery and finished(message) when it's done
+	(or use handle()). Every interval seconds, update() works out, for each consumer:
+		throughput: deliveries finished per second
+		service_time: the moving average time a handler takes
+	and the channel's round trip time, measured by timing each Qos call. By Little's law, the deliveries which
+	need to be in flight to sustain each consumer's throughput are throughput * (rtt + service_time), and the
+	new prefetch_count is headroom times the sum of these over consumers, between min_prefetch and max_prefetch.
+	When the prefetch limit itself is what's holding throughput down, this grows it by headroom each interval
+	until it isn't. It is only lowered by at most half at a time, and a new Qos is only sent if prefetch_count
+	changes by at least change_threshold (a fraction), or the bounds require it.
+	Intervals in which nothing was finished leave it alone.
+
+	Qos is sent with global set, which RabbitMQ applies to the channel as a whole (and so to existing consumers)
+	rather than only to consumers started afterwards.
+
+	Decisions are kept as metrics: see metrics(), and decisions, a list of the most recent (time, prefetch_count,
+	target) for each Qos sent. clock is the time function used for all measurements.
+	"""
+
+	def __init__(self, channel, min_prefetch=1, max_prefetch=1000, interval=1.0, headroom=1.5,
+	             change_threshold=0.1, smoothing=0.3, start=True, clock=time.time):
+		if not 0 < min_prefetch <= max_prefetch <= 65535:
+			raise ValueError("Need 0 < min_prefetch <= max_prefetch <= 65535, not {}, {}".format(min_prefetch, max_prefetch))
+		self.channel = channel
+		self.min_prefetch = min_prefetch
+		self.max_prefetch = max_prefetch
+		self.interval = interval
+		self.headroom = headroom
+		self.change_threshold = change_threshold
+		self.smoothing = smoothing
+		self.clock = clock
+		self.prefetch_count = None
+		self.target = None # the prefetch_count wanted at the last update, before limits
+		self.rtt = None # moving average round trip time, in seconds
+		self.consumers = {} # {consumer tag: ConsumerStats}
+		self.updates = 0
+		self.decisions = deque(maxlen=100)
+		self._started = {} # {delivery tag: start time}
+		self._last_update = clock()
+		self._greenlet = None
+		self.set_prefetch(min_prefetch, min_prefetch)
+		if start:
+			self._greenlet = gevent.spawn(self._run)
+			channel.close_callbacks.append(lambda error: self.stop())
+
+	def started(self, message):
+		"""Call when a handler starts on message (a basic.Deliver Message)"""
+		self._started[message.method.delivery_tag] = self.clock()
+
+	def finished(self, message):
+		"""Call when a handler has finished with message"""
+		start = self._started.pop(message.method.delivery_tag, None)
+		if start is None:
+			return
+		stats = self.consumers.get(message.method.consumer_tag)
+		if stats is None:
+			stats = self.consumers[message.method.consumer_tag] = ConsumerStats()
+		stats.service_time = smooth(stats.service_time, self.clock() - start, self.smoothing)
+		stats.completed += 1
+
+	def handle(self, message, handler):
+		"""Calls handler(message) between started() and finished(), returning its result"""
+		self.started(message)
+		try:
+			return handler(message)
+		finally:
+			self.finished(message)
+
+	def update(self):
+		"""Measures the last interval's throughput, and sends a new Qos if needed. Called every interval seconds."""
+		now = self.clock()
+		elapsed = now - self._last_update
+		self._last_update = now
+		self.updates += 1
+		if elapsed <= 0 or not any(stats.completed for stats in self.consumers.values()):
+			return
+		in_flight = 0.0
+		for stats in self.consumers.values():
+			stats.throughput = stats.completed / elapsed
+			stats.completed = 0
+			if stats.service_time is not None:
+				in_flight += stats.throughput * ((self.rtt or 0) + stats.service_time)
+		target = int(math.ceil(self.headroom * in_flight))
+		prefetch = max(target, self.prefetch_count // 2)
+		prefetch = min(max(prefetch, self.min_prefetch), self.max_prefetch)
+		if abs(prefetch - self.prefetch_count) >= max(1, self.change_threshold * self.prefetch_count) \
+				or prefetch in (self.min_prefetch, self.max_prefetch) and prefetch != self.prefetch_count:
+			self.set_prefetch(prefetch, target)
+		else:
+			self.target = target
+
+	def set_prefetch(self, prefetch_count, target):
+		"""Sends a Qos for prefetch_count, measuring its round trip time"""
+		start = self.clock()
+		# global is a keyword, so can't be given as an ordinary kwarg
+		self.channel.call(basic.Qos(0, prefetch_count, **{'global': True}))
+		self.rtt = smooth(self.rtt, self.clock() - start, self.smoothing)
+		self.prefetch_count = prefetch_count
+		self.target = target
+		self.decisions.append((start, prefetch_count, target))
+
+	def metrics(self):
+		"""Returns the controller's current measurements and decision as a dict"""
+		return {
+			'prefetch_count': self.prefetch_count,
+			'target': self.target,
+			'rtt': self.rtt,
+			'updates': self.updates,
+			'qos_sent': len(self.decisions),
+			'in_progress': len(self._started),
+			'consumers': {tag: stats.as_dict() for tag, stats in self.consumers.items()},
+		}
+
+	def stop(self):
+		if self._greenlet is not None and self._greenlet is not gevent.getcurrent():
+			self._greenlet.kill(block=False)
+		self._greenlet = None
+
+	def _run(self):
+		try:
+			while not self.channel.error:
+				gevent.sleep(self.interval)
+				self.update()
+		except AMQPError:
+			pass # the channel was closed while sending Qos, and stop() is called
@@ -0,0 +1,309 @@
+
+import time
+from collections import OrderedDict, deque
+
+import gevent
+
+from grabbit.errors import AMQPError, ChannelClosed, ConnectionClosed, NotFound
+from grabbit.methods import basic, confirm, exchange, queue
+
+
+def with_fields(method, **changes):
+	"""Returns a copy of method with the given fields (including flags) changed"""
+	names = method.names() + [name for bitnames in method.bitnames() if bitnames for name in bitnames]
+	values = {name: getattr(method, name) for name in names}
+	values.update(changes)
+	return type(method)(**values)
+
+
+class ChannelState(object):
+	"""What Recovery replays for one channel"""
+	__slots__ = ('confirm', 'qos', 'consumers')
+
+	def __init__(self):
+		self.confirm = False
+		self.qos = OrderedDict() # {global: basic.Qos}
+		self.consumers = OrderedDict() # {consumer tag: basic.Consume, with that tag}
+
+
+class Recovery(object):
+	"""Records the topology a Connection declares, and the consumers and Qos of its channels, and when the
+	connection is lost (other than by close()), reconnects it and replays them.
+
+	Recorded (once they succeed, from any channel of the connection):
+		exchange.Declare and exchange.Bind, queue.Declare and queue.Bind, removed again by the matching
+			Delete or Unbind. Passive declares aren't recorded, as they don't create anything.
+		per channel, basic.Qos (the last for each value of global), confirm.Select and basic.Consume,
+			removed by basic.Cancel. A channel's state is forgotten if it's closed other than by losing
+			the connection.
+	Replaying, after connect() succeeds:
+		the channels with any recorded state are reopened with Connection.reopen(), so they keep their callbacks;
+		topology is declared on a temporary channel, with nowait set, except for queues with server-generated
+		names, which must wait for their new name (see queue_names). Closing the channel then waits for
+		the broker to have handled them all.
+		on each reopened channel, at the same time: confirm.Select (no_wait), each Qos, each Consume
+		(no_wait, with its original consumer tag), then the channel's Qos again, so that once it returns,
+		the consumers are known to be registered.
+	So recovery takes about one round trip per step, however much there is to replay. Connecting is retried
+	every reconnect_delay seconds, doubling for each failure up to reconnect_delay_max.
+
+	Consumers cancelled by the broker (a basic.Cancel, eg. on a mirrored queue failing over) are subscribed
+	again straight away, with the same consumer tag, if their queue still exists (checked with a passive
+	queue.Declare on a channel of its own). If it doesn't, the consumer is forgotten.
+
+	The time from the connection being lost until consumers are registered again is kept in
+	recovery_times (the most recent 100), and passed to each of recovered_callbacks.
+	"""
+
+	def __init__(self, connection, reconnect_delay=0.1, reconnect_delay_max=10):
+		self.connection = connection
+		self.reconnect_delay = reconnect_delay
+		self.reconnect_delay_max = reconnect_delay_max
+		self.exchanges = OrderedDict() # {name: exchange.Declare}
+		self.queues = OrderedDict() # {name: queue.Declare}, with an empty name if the server generated it
+		self.bindings = OrderedDict() # {(queue, exchange, routing key): queue.Bind}
+		self.exchange_bindings = OrderedDict() # {(destination, source, routing key): exchange.Bind}
+		self.channels = OrderedDict() # {Channel: ChannelState}
+		self.queue_names = {} # {original server-generated name: current name}
+		self.recovery_times = deque(maxlen=100)
+		self.recovered_callbacks = [] # callback(seconds taken) for each, called after each recovery
+		self.failures = 0 # failed attempts to recover since the last success
+		self.last_error = None
+		self.closed = False
+		self._greenlet = None
+		self._replaying = False
+		self._recording = {
+			exchange.Declare: self._exchange_declared,
+			exchange.Delete: self._exchange_deleted,
+			exchange.Bind: self._exchange_bound,
+			queue.Declare: self._queue_declared,
+			queue.Delete: self._queue_deleted,
+			queue.Bind: self._queue_bound,
+			queue.Unbind: self._queue_unbound,
+			basic.Qos: self._qos,
+			basic.Consume: self._consumed,
+			basic.Cancel: self._cancelled,
+			confirm.Select: self._confirm_selected,
+		}
+		connection.recorder = self.record
+		connection.close_callbacks.append(self._lost)
+
+	def record(self, channel, method, response):
+		"""Called by channels of the connection for each method which succeeds"""
+		recorder = self._recording.get(type(method))
+		if recorder is not None and not self._replaying:
+			recorder(channel, method, response)
+
+	def close(self):
+		"""Stops recording and recovering, and closes the connection"""
+		self.closed = True
+		self.connection.recorder = None
+		if self._greenlet is not None:
+			self._greenlet.kill()
+		self.connection.close()
+
+	# recording
+
+	def _exchange_declared(self, channel, method, response):
+		if not method.passive:
+			self.exchanges[method.name] = method
+
+	def _exchange_deleted(self, channel, method, response):
+		self.exchanges.pop(method.name, None)
+		for key in list(self.exchange_bindings):
+			if method.name in key[:2]:
+				del self.exchange_bindings[key]
+		for key in list(self.bindings):
+			if key[1] == method.name:
+				del self.bindings[key]
+
+	def _exchange_bound(self, channel, method, response):
+		self.exchange_bindings[method.destination, method.source, method.routing_key] = method
+
+	def _queue_declared(self, channel, method, response):
+		if method.passive:
+			return
+		if not method.name and response is not None:
+			self.queue_names[response.name] = response.name
+			self.queues[response.name] = method
+		elif method.name:
+			self.queues[method.name] = method
+
+	def _queue_deleted(self, channel, method, response):
+		self.queues.pop(method.name, None)
+		for key in list(self.bindings):
+			if key[0] == method.name:
+				del self.bindings[key]
+		for state in self.channels.values():
+			for tag, consume in list(state.consumers.items()):
+				if consume.queue == method.name:
+					del state.consumers[tag]
+
+	def _queue_bound(self, channel, method, response):
+		self.bindings[method.queue, method.exchange, method.routing_key] = method
+
+	def _queue_unbound(self, channel, method, response):
+		routing_key = getattr(method, 'routing_key', None)
+		for key in list(self.bindings):
+			if key[:2] == (method.queue, method.exchange) and routing_key in (None, key[2]):
+				del self.bindings[key]
+
+	def _channel_state(self, channel):
+		state = self.channels.get(channel)
+		if state is None:
+			state = self.channels[channel] = ChannelState()
+			channel.close_callbacks.append(lambda error: self._channel_closed(channel))
+			cancelled = channel.callbacks.get(basic.Cancel)
+			channel.callbacks[basic.Cancel] = lambda method: self._cancelled_by_server(channel, method, cancelled)
+		return state
+
+	def _channel_closed(self, channel):
+		if not self.connection.error:
+			self.channels.pop(channel, None) # closed on its own, so not to be recovered
+
+	def _qos(self, channel, method, response):
+		# global is a keyword, so can't be an ordinary attribute name
+		self._channel_state(channel).qos[getattr(method, 'global')] = method
+
+	def _confirm_selected(self, channel, method, response):
+		self._channel_state(channel).confirm = True
+
+	def _consumed(self, channel, method, response):
+		tag = response.consumer_tag if response is not None else method.consumer_tag
+		if tag:
+			self._channel_state(channel).consumers[tag] = with_fields(method, consumer_tag=tag)
+
+	def _cancelled(self, channel, method, response):
+		state = self.channels.get(channel)
+		if state is not None:
+			state.consumers.pop(method.consumer_tag, None)
+
+	def _cancelled_by_server(self, channel, method, callback):
+		# called from the reader greenlet
+		if callback is not None:
+			callback(method)
+		state = self.channels.get(channel)
+		consume = state and state.consumers.get(method.consumer_tag)
+		if consume is not None:
+			gevent.spawn(self._resubscribe, channel, consume)
+
+	def _resubscribe(self, channel, consume):
+		# the broker usually cancels a consumer because its queue was deleted, and consuming from a missing
+		# queue would close the channel, and so its other consumers, so check it exists on a channel of its own
+		try:
+			probe = self.connection.channel()
+			try:
+				probe.call(queue.Declare(name=consume.queue, passive=True, durable=False, exclusive=False,
+				                         autodelete=False, nowait=False, arguments={}))
+			except NotFound as ex:
+				self.last_error = ex
+				state = self.channels.get(channel)
+				if state is not None:
+					state.consumers.pop(consume.consumer_tag, None)
+				return
+			probe.close()
+			channel.call(consume)
+		except AMQPError as ex:
+			self.last_error = ex # eg. the queue was deleted since, which closes the channel
+
+	# recovering
+
+	def _lost(self, error):
+		if self.closed or self._greenlet is not None:
+			return # a failed attempt to recover, which will be retried
+		self._greenlet = gevent.spawn(self._recover, time.time())
+
+	def _recover(self, lost_at):
+		delay = self.reconnect_delay
+		try:
+			while not self.closed:
+				try:
+					self.connection.connect()
+					self.replay()
+				except (AMQPError, EnvironmentError) as ex:
+					self.failures += 1
+					self.last_error = ex
+					if not self.connection.error:
+						self.connection.lost(ConnectionClosed("Recovery failed: {!r}".format(ex)))
+					gevent.sleep(delay)
+					delay = min(delay * 2, self.reconnect_delay_max)
+					continue
+				break
+		finally:
+			self._greenlet = None
+		if self.closed:
+			return
+		self.failures = 0
+		elapsed = time.time() - lost_at
+		self.recovery_times.append(elapsed)
+		for callback in self.recovered_callbacks:
+			callback(elapsed)
+
+	def replay(self):
+		"""Replays everything recorded on the (newly reconnected) connection"""
+		channels = [(channel, state) for channel, state in self.channels.items()
+		            if state.confirm or state.qos or state.consumers]
+		self._replaying = True
+		try:
+			wait_all([gevent.spawn(self.connection.reopen, channel) for channel, state in channels])
+			self._replay_topology()
+			wait_all([gevent.spawn(self._replay_channel, channel, state) for channel, state in channels])
+		finally:
+			self._replaying = False
+
+	def _replay_topology(self):
+		if not (self.exchanges or self.queues or self.bindings or self.exchange_bindings):
+			return
+		channel = self.connection.channel()
+		for name, method in self.exchanges.items():
+			channel.send(with_fields(method, nowait=True))
+		renamed = {}
+		for name, method in list(self.queues.items()):
+			if method.name:
+				channel.send(with_fields(method, nowait=True))
+				continue
+			# the server generates a new name, which we have to wait for
+			renamed[name] = channel.call(method).name
+		self._rename_queues(renamed)
+		for method in self.bindings.values():
+			channel.send(with_fields(method, nowait=True))
+		for method in self.exchange_bindings.values():
+			channel.send(with_fields(method, nowait=True))
+		channel.close()
+		if not isinstance(channel.error, ChannelClosed):
+			raise channel.error # the broker refused one of them
+
+	def _rename_queues(self, renamed):
+		"""Updates what's recorded for server-named queues which were given new names, {old: new}"""
+		if not renamed:
+			return
+		for original, current in self.queue_names.items():
+			if current in renamed:
+				self.queue_names[original] = renamed[current]
+		for name in renamed:
+			self.queues[renamed[name]] = self.queues.pop(name)
+		for key, method in list(self.bindings.items()):
+			if method.queue in renamed:
+				del self.bindings[key]
+				method = with_fields(method, queue=renamed[method.queue])
+				self.bindings[method.queue, method.exchange, method.routing_key] = method
+		for state in self.channels.values():
+			for tag, consume in state.consumers.items():
+				if consume.queue in renamed:
+					state.consumers[tag] = with_fields(consume, queue=renamed[consume.queue])
+
+	def _replay_channel(self, channel, state):
+		if state.confirm:
+			channel.send(confirm.Select(no_wait=True))
+		for method in state.qos.values():
+			channel.call(method)
+		for consume in state.consumers.values():
+			channel.send(with_fields(consume, no_wait=True))
+		if state.consumers:
+			# waiting for a reply to something the broker handles after the consumes means they're done
+			channel.call(list(state.qos.values())[-1] if state.qos else basic.Qos(0, 0, **{'global': False}))
+
+
+def wait_all(greenlets):
+	"""Waits for greenlets, raising the first error any of them raised"""
+	gevent.joinall(greenlets, raise_error=True)
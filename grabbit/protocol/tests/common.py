@@ -0,0 +1,165 @@
+
+import itertools
+import unittest
+
+import gevent
+from gevent import socket
+
+from grabbit.frames import Frame, FrameReader
+from grabbit.frames.content import content_frames
+from grabbit.frames.datatypes import ProtocolHeader
+from grabbit.methods import basic, confirm, connection, queue
+from grabbit.protocol import Connection, Message
+from grabbit.protocol.channel import expects_response
+
+
+class FakeServer(object):
+	"""A minimal broker to test against. It listens on a local port, performs the handshake with
+	each connection, and replies to each method by calling handlers[type(method)](server, channel, method),
+	which returns a list of methods to send back on that channel. Methods with no handler get their
+	response with no arguments, if that's possible and expects_response() says they want one.
+	All methods and Messages received are recorded in received as (channel, item),
+	and heartbeats are counted in heartbeats.
+	Channels put into confirm mode have each message published on them acked, with one multiple Ack
+	per channel for all the messages read from the socket at once, unless auto_confirm is False.
+	"""
+
+	def __init__(self, handlers={}, tune=None):
+		self.listener = socket.socket()
+		self.listener.bind(('127.0.0.1', 0))
+		self.listener.listen(16)
+		self.port = self.listener.getsockname()[1]
+		self.tune = tune or connection.Tune(0, 131072, 0)
+		self.handlers = {
+			connection.StartOk: lambda server, channel, method: [server.tune],
+			connection.Open: lambda server, channel, method: [connection.OpenOk()],
+			queue.Declare: lambda server, channel, method: [
+				queue.DeclareOk(method.name or 'amq.gen-{}'.format(next(server.counter)), 0, 0),
+			],
+			basic.Consume: lambda server, channel, method: [
+				basic.ConsumeOk(method.consumer_tag or 'amq.ctag-{}'.format(next(server.counter))),
+			],
+			basic.Cancel: lambda server, channel, method: [basic.CancelOk(method.consumer_tag)],
+		}
+		self.handlers.update(handlers)
+		self.counter = itertools.count(1)
+		self.received = []
+		self.heartbeats = 0
+		self.auto_confirm = True
+		self.socks = []
+		self.greenlets = [gevent.spawn(self._accept_loop)]
+
+	def connect(self, **kwargs):
+		"""Returns a connected Connection to this server"""
+		return Connection('127.0.0.1', self.port, **kwargs).connect()
+
+	def _accept_loop(self):
+		while True:
+			sock, address = self.listener.accept()
+			self.socks.append(sock)
+			self.greenlets.append(gevent.spawn(self._serve, sock))
+
+	def _serve(self, sock):
+		reader = FrameReader()
+		content = {} # {channel: [method, properties, body chunks, remaining]}
+		published = {} # {channel: number of messages published} for channels in confirm mode
+		while True:
+			try:
+				data = sock.recv(65536)
+			except socket.error:
+				return # closed by drop() or stop()
+			if not data:
+				return
+			reader.feed(data)
+			confirmed = set()
+			for frame in reader:
+				if isinstance(frame, ProtocolHeader):
+					self.send(0, connection.Start(0, 9, {'product': 'fake'}, 'PLAIN AMQPLAIN', 'en_US'), sock=sock)
+					continue
+				elif frame.type == Frame.METHOD_TYPE:
+					method = frame.payload.method
+					if method.has_content:
+						content[frame.channel] = [method, None, [], None]
+					else:
+						self._handle(sock, frame.channel, method)
+						if isinstance(method, confirm.Select):
+							published[frame.channel] = 0
+				elif frame.type == Frame.HEARTBEAT_TYPE:
+					self.heartbeats += 1
+				elif frame.type == Frame.HEADER_TYPE:
+					content[frame.channel][1:] = [frame.payload.properties, [], frame.payload.body_size]
+				elif frame.type == Frame.BODY_TYPE:
+					content[frame.channel][2].append(frame.payload.value)
+					content[frame.channel][3] -= len(frame.payload.value)
+				if frame.type in (Frame.HEADER_TYPE, Frame.BODY_TYPE) and content[frame.channel][3] <= 0:
+					method, properties, chunks, remaining = content.pop(frame.channel)
+					self.received.append((frame.channel, Message(method, properties, b''.join(chunks))))
+					if frame.channel in published:
+						published[frame.channel] += 1
+						confirmed.add(frame.channel)
+			if self.auto_confirm:
+				for channel in confirmed:
+					self.send(channel, basic.Ack(published[channel], multiple=True), sock=sock)
+
+	def _handle(self, sock, channel, method):
+		self.received.append((channel, method))
+		handler = self.handlers.get(type(method))
+		if handler is not None:
+			responses = handler(self, channel, method)
+		elif expects_response(method) and not isinstance(method.response, tuple):
+			try:
+				responses = [method.response()]
+			except TypeError:
+				responses = [] # response has required fields
+		else:
+			responses = []
+		if method.response is not None and not expects_response(method):
+			responses = [] # no-wait is set
+		for response in responses:
+			self.send(channel, response, sock=sock)
+		if isinstance(method, connection.Close):
+			sock.close()
+
+	def send(self, channel, method, properties={}, body=b'', sock=None):
+		"""Sends a method (with content, for methods which have it) on the most recent connection"""
+		sock = sock or self.socks[-1]
+		frames = [Frame(Frame.METHOD_TYPE, channel, method)]
+		if method.has_content:
+			frames += content_frames(channel, method.method_class, properties, body, self.tune.frame_size_max)
+		sock.sendall(b''.join(frame.pack() for frame in frames))
+
+	def methods(self, method_type):
+		"""Returns (channel, method) for each received method of the given type"""
+		return [(channel, item) for channel, item in self.received if isinstance(item, method_type)]
+
+	def drop(self):
+		"""Closes every connection without any handshake"""
+		for sock in self.socks:
+			sock.close()
+
+	def stop(self):
+		gevent.killall(self.greenlets)
+		for sock in self.socks:
+			sock.close()
+		self.listener.close()
+
+
+class ProtocolTestCase(unittest.TestCase):
+	"""Runs each test against a new FakeServer, failing any test that takes more than TIMEOUT seconds"""
+	TIMEOUT = 10
+	handlers = {}
+	tune = None
+
+	def setUp(self):
+		self.server = FakeServer(self.handlers, self.tune)
+		self.timeout = gevent.Timeout(self.TIMEOUT)
+		self.timeout.start()
+
+	def tearDown(self):
+		self.timeout.cancel()
+		self.server.stop()
+
+	def wait_for(self, condition):
+		"""Yields to other greenlets until condition() is true"""
+		while not condition():
+			gevent.sleep(0.001)
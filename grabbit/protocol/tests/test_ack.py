@@ -0,0 +1,123 @@
+
+from unittest import TestCase, main
+
+import gevent
+
+from grabbit.methods import basic
+from grabbit.protocol import AckManager
+from grabbit.protocol.ack import IntervalSet
+
+from .common import ProtocolTestCase
+
+
+class IntervalSetTests(TestCase):
+
+	def test_add(self):
+		values = IntervalSet()
+		for value in [5, 1, 2, 9, 4, 3, 10, 7]:
+			self.assertTrue(values.add(value))
+		self.assertFalse(values.add(3))
+		self.assertEquals(values.intervals, [[1, 5], [7, 7], [9, 10]])
+		self.assertEquals(len(values), 8)
+		self.assertEquals(list(values), [1, 2, 3, 4, 5, 7, 9, 10])
+		self.assertTrue(values.add(8))
+		self.assertEquals(values.intervals, [[1, 5], [7, 10]])
+		self.assertEquals((3 in values, 6 in values, 11 in values, 0 in values), (True, False, False, False))
+		self.assertEquals(repr(IntervalSet([1, 2, 4])), '<IntervalSet 1-2, 4>')
+
+	def test_discard_to(self):
+		values = IntervalSet([1, 2, 3, 5, 6, 8])
+		self.assertEquals(values.first(), (1, 3))
+		self.assertEquals((values.highest(4), values.highest(6), values.highest(100), values.highest(0)), (3, 6, 8, None))
+		values.discard_to(5)
+		self.assertEquals((values.intervals, len(values)), ([[6, 6], [8, 8]], 2))
+		values.discard_to(10)
+		self.assertEquals((values.intervals, len(values), values.first()), ([], 0, None))
+
+
+class AckManagerTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(AckManagerTests, self).setUp()
+		self.conn = self.server.connect()
+		self.channel = self.conn.channel()
+
+	def acks(self):
+		"""Returns the Acks and Nacks the server has received, once the client has sent everything"""
+		self.conn.writer.flush()
+		gevent.sleep(0.01)
+		return [method for _, method in self.server.received if isinstance(method, (basic.Ack, basic.Nack))]
+
+	def test_in_order(self):
+		manager = AckManager(self.channel, max_pending=10, max_delay=10)
+		for tag in range(1, 26):
+			manager.ack(tag)
+		self.assertEquals(self.acks(), [basic.Ack(10, multiple=True), basic.Ack(20, multiple=True)])
+		manager.flush()
+		self.assertEquals(self.acks()[2:], [basic.Ack(25, multiple=True)])
+		self.assertEquals((manager.acked, len(manager.done), manager.sent), (25, 0, 3))
+
+	def test_out_of_order(self):
+		manager = AckManager(self.channel, max_pending=4, max_delay=0.05)
+		for tag in [2, 1, 4, 5]:
+			manager.ack(tag)
+		# 1-2 are acked together, then 4-5 wait for 3
+		self.assertEquals(self.acks(), [basic.Ack(2, multiple=True)])
+		gevent.sleep(0.1)
+		# until max_delay passes, when they're acked individually
+		self.assertEquals(self.acks()[1:], [basic.Ack(4, multiple=False), basic.Ack(5, multiple=False)])
+		for tag in [6, 3, 7]:
+			manager.ack(tag)
+		manager.flush()
+		self.assertEquals(self.acks()[3:], [basic.Ack(7, multiple=True)])
+		self.assertEquals((manager.acked, len(manager.done), len(manager.pending)), (7, 0, 0))
+
+	def test_stuck_behind_gap(self):
+		manager = AckManager(self.channel, max_pending=3, max_delay=10)
+		for tag in [2, 3, 4]:
+			manager.ack(tag)
+		# max_pending are waiting behind 1, so they're acked individually without waiting for max_delay
+		self.assertEquals(self.acks(), [basic.Ack(tag, multiple=False) for tag in [2, 3, 4]])
+		manager.ack(1)
+		manager.flush()
+		# 4 has already been acked, so the broker would reject Ack(4, multiple=True)
+		self.assertEquals(self.acks()[3:], [basic.Ack(1, multiple=True)])
+		self.assertEquals((manager.acked, len(manager.done), len(manager.pending)), (4, 0, 0))
+		# filling a gap below tags which were acked individually, with another pending above them
+		for tag in [6, 7, 8]:
+			manager.ack(tag)
+		manager.ack(9)
+		manager.ack(5)
+		manager.flush()
+		self.assertEquals(self.acks()[4:], [basic.Ack(tag, multiple=False) for tag in [6, 7, 8]] + [
+			basic.Ack(9, multiple=True),
+		])
+		self.assertEquals((manager.acked, len(manager.done)), (9, 0))
+
+	def test_nack(self):
+		manager = AckManager(self.channel, max_pending=10, max_delay=10)
+		manager.ack(1)
+		manager.nack(3, requeue=False)
+		manager.ack(2)
+		manager.ack(2) # ignored
+		manager.ack(4)
+		manager.flush()
+		self.assertEquals(self.acks(), [basic.Nack(3, multiple=False, requeue=False), basic.Ack(4, multiple=True)])
+		self.assertEquals(manager.acked, 4)
+
+	def test_closed(self):
+		manager = AckManager(self.channel, max_pending=10, max_delay=0.01)
+		manager.ack(1)
+		self.channel.close()
+		gevent.sleep(0.02)
+		self.assertEquals(self.acks(), [])
+		self.assertEquals(len(manager.pending), 0)
+		# delivery tags start from 1 again on the reopened channel
+		self.conn.reopen(self.channel)
+		manager.ack(1)
+		manager.flush()
+		self.assertEquals(self.acks(), [basic.Ack(1, multiple=True)])
+
+
+if __name__ == '__main__':
+	main()
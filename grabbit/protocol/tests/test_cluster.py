@@ -0,0 +1,114 @@
+
+from unittest import main
+
+import gevent
+
+from grabbit.errors import ConnectionClosed, ConnectionForced
+from grabbit.methods import basic, channel as channel_methods, connection
+from grabbit.protocol.cluster import Cluster, parse_address
+from grabbit.protocol.timers import TimerWheel
+
+from .common import FakeServer, ProtocolTestCase
+
+
+class ClusterTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(ClusterTests, self).setUp()
+		self.other = FakeServer()
+		self.addCleanup(self.other.stop)
+
+	def cluster(self, addresses=None, **kwargs):
+		addresses = addresses or [('127.0.0.1', self.server.port), ('127.0.0.1', self.other.port)]
+		cluster = Cluster(addresses, reconnect_delay=0.01, **kwargs).connect()
+		self.addCleanup(cluster.close)
+		return cluster
+
+	def leased_from(self, cluster, count):
+		"""Returns the index of the node each of count leases used"""
+		nodes = []
+		for _ in range(count):
+			with cluster.lease() as channel:
+				nodes.append([node.connection for node in cluster.nodes].index(channel.connection))
+		return nodes
+
+	def test_parse_address(self):
+		self.assertEquals(parse_address('host'), ('host', 5672))
+		self.assertEquals(parse_address('host:1234'), ('host', 1234))
+		self.assertEquals(parse_address(('host', 1234)), ('host', 1234))
+		self.assertRaises(ValueError, Cluster, [])
+
+	def test_spread(self):
+		cluster = self.cluster()
+		self.assertTrue(all(node.connected and node.rtt > 0 for node in cluster.nodes))
+		cluster.rtt_slack = 1
+		self.assertEquals(self.leased_from(cluster, 4), [0, 1, 0, 1])
+		# nested leases go to the node with fewer active
+		with cluster.lease():
+			self.assertEquals(self.leased_from(cluster, 2), [1, 1])
+		self.assertEquals(
+			set(cluster.connection() for _ in range(2)), set(node.connection for node in cluster.nodes),
+		)
+		self.assertEquals([node.leases for node in cluster.nodes], [4, 5])
+
+	def test_slow_node(self):
+		cluster = self.cluster(rtt_tolerance=2, rtt_slack=0)
+		cluster.nodes[0].rtt, cluster.nodes[1].rtt = 0.05, 0.01
+		self.assertEquals(self.leased_from(cluster, 3), [1, 1, 1])
+		cluster.nodes[0].rtt = 0.02
+		self.assertEquals(sorted(self.leased_from(cluster, 2)), [0, 1])
+
+	def test_reconnect(self):
+		cluster = self.cluster()
+		first = cluster.nodes[0].connection
+		self.server.drop()
+		self.wait_for(lambda: first.error)
+		self.assertEquals(cluster.nodes[0].failures, 1)
+		self.assertEquals(self.leased_from(cluster, 2), [1, 1])
+		self.wait_for(lambda: cluster.nodes[0].connected)
+		self.assertEquals((cluster.nodes[0].connects, cluster.nodes[0].failures), (2, 0))
+		# closed by the broker
+		second = cluster.nodes[1].connection
+		self.other.send(0, connection.Close(error=ConnectionForced("restarting")))
+		self.wait_for(lambda: cluster.nodes[1].connection is not second and cluster.nodes[1].connected)
+		self.assertIsInstance(cluster.nodes[1].last_error, ConnectionForced)
+
+	def test_unreachable(self):
+		self.other.stop()
+		cluster = self.cluster()
+		self.assertEquals([node.connected for node in cluster.nodes], [True, False])
+		self.wait_for(lambda: cluster.nodes[1].failures > 2)
+		self.assertIsInstance(cluster.nodes[1].last_error, ConnectionClosed)
+		self.assertEquals(self.leased_from(cluster, 2), [0, 0])
+		self.server.stop()
+		self.assertRaises(ConnectionClosed, self.cluster)
+
+	def test_probe(self):
+		cluster = self.cluster(probe_interval=0.01, timer_wheel=TimerWheel(resolution=0.005))
+		self.wait_for(lambda: len(self.server.methods(basic.Qos)) >= 2 and len(self.other.methods(basic.Qos)) >= 2)
+		cluster.close()
+		self.assertFalse(any(node.connected for node in cluster.nodes))
+		self.assertEquals(len(cluster.timer_wheel), 0)
+
+	def test_probe_timeout(self):
+		def qos_handler(server, channel, method):
+			if len(server.methods(basic.Qos)) == 1:
+				# the first reply is late, after the probe has timed out
+				gevent.spawn_later(0.1, server.send, channel, basic.QosOk())
+				return []
+			return [basic.QosOk()]
+		self.server.handlers[basic.Qos] = qos_handler
+		cluster = self.cluster(probe_interval=0.01, probe_timeout=0.05, timer_wheel=TimerWheel(resolution=0.005))
+		self.wait_for(lambda: len(self.server.methods(basic.Qos)) >= 4)
+		# later probes are on a new channel, so the late reply isn't taken for theirs
+		channels = [channel for channel, method in self.server.methods(basic.Qos)]
+		self.assertNotEquals(channels[0], channels[1])
+		self.assertEquals(len(set(channels[1:])), 1)
+		self.wait_for(lambda: (channels[0], channel_methods.Close) in [
+			(channel, type(method)) for channel, method in self.server.received
+		])
+		self.wait_for(lambda: cluster.nodes[0].rtt < 0.025)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,128 @@
+
+from io import BytesIO
+from unittest import TestCase, main
+
+import gevent
+
+from grabbit.errors import ChannelClosed, NotFound
+from grabbit.methods import basic, channel as channel_methods, confirm
+from grabbit.protocol import ConfirmPublisher, Message, MessageNacked
+from grabbit.protocol.confirm import OutstandingTags
+
+from .common import ProtocolTestCase
+
+
+class OutstandingTagsTests(TestCase):
+
+	def test_resolve(self):
+		tags = OutstandingTags()
+		self.assertEquals([tags.add(value) for value in 'abcdef'], [1, 2, 3, 4, 5, 6])
+		self.assertEquals(tags.resolve(3), [(3, 'c')])
+		self.assertEquals(tags.resolve(3), []) # already resolved
+		self.assertEquals(tags.resolve(4, multiple=True), [(1, 'a'), (2, 'b'), (4, 'd')])
+		self.assertEquals((len(tags), tags.lowest, tags.pending()), (2, 5, ['e', 'f']))
+		self.assertEquals(tags.resolve(6), [(6, 'f')])
+		self.assertEquals(tags.resolve(5), [(5, 'e')])
+		self.assertEquals((len(tags), len(tags.values), tags.lowest, tags.next_tag), (0, 0, 7, 7))
+		self.assertEquals(tags.resolve(6, multiple=True), [])
+		self.assertEquals(tags.add('g'), 7)
+
+	def test_resolve_all(self):
+		tags = OutstandingTags()
+		for value in range(5):
+			tags.add(value)
+		tags.resolve(2)
+		self.assertEquals(tags.resolve(0, multiple=True), [(1, 0), (3, 2), (4, 3), (5, 4)])
+		self.assertEquals(len(tags), 0)
+		self.assertEquals(tags.add(5), 6)
+
+	def test_discard_last(self):
+		tags = OutstandingTags()
+		tags.add('a')
+		self.assertRaises(ValueError, tags.discard_last, 1 + tags.add('b'))
+		tags.discard_last(2)
+		self.assertEquals((len(tags), tags.next_tag, tags.add('c')), (1, 2, 2))
+
+
+class ConfirmPublisherTests(ProtocolTestCase):
+
+	def test_publish(self):
+		conn = self.server.connect()
+		publisher = ConfirmPublisher(conn.channel())
+		results = [publisher.publish('ex', 'key', str(n).encode()) for n in range(100)]
+		self.assertTrue(publisher.wait())
+		self.assertEquals([result.get() for result in results], list(range(1, 101)))
+		self.assertEquals(len(publisher.outstanding), 0)
+		self.assertEquals(len(self.server.methods(confirm.Select)), 1)
+
+	def test_streamed(self):
+		# a body read from a file is sent a frame at a time, and a publish started meanwhile must still
+		# take the next tag, as the broker numbers messages in the order they arrive
+		conn = self.server.connect()
+		publisher = ConfirmPublisher(conn.channel())
+		small = gevent.spawn_later(0, publisher.publish, 'ex', 'key', b'small')
+		large = publisher.publish('ex', 'key', BytesIO(b'x' * 400000))
+		self.assertEquals((large.get(timeout=1), small.get().get(timeout=1)), (1, 2))
+		self.assertEquals([len(message.body) for _, message in self.server.methods(Message)], [400000, 5])
+
+	def test_nack(self):
+		self.server.auto_confirm = False
+		conn = self.server.connect()
+		channel = conn.channel()
+		publisher = ConfirmPublisher(channel)
+		results = [publisher.publish('ex', 'key', b'body') for _ in range(4)]
+		self.wait_for(lambda: len(self.server.received) >= 2 + 4)
+		self.server.send(channel.id, basic.Nack(2, multiple=True, requeue=False))
+		self.server.send(channel.id, basic.Ack(4, multiple=False))
+		self.wait_for(lambda: results[3].ready())
+		for result in results[:2]:
+			self.assertRaises(MessageNacked, result.get)
+		self.assertEquals(results[1].exception.delivery_tag, 2)
+		self.assertFalse(results[2].ready())
+		self.assertEquals(results[3].get(), 4)
+		self.assertFalse(publisher.wait(timeout=0.01))
+
+	def test_max_in_flight(self):
+		self.server.auto_confirm = False
+		conn = self.server.connect()
+		channel = conn.channel()
+		publisher = ConfirmPublisher(channel, max_in_flight=2)
+		publisher.publish('ex', 'key', b'1')
+		publisher.publish('ex', 'key', b'2')
+		third = gevent.spawn(publisher.publish, 'ex', 'key', b'3')
+		gevent.sleep(0.01)
+		self.assertFalse(third.ready())
+		self.server.send(channel.id, basic.Ack(1, multiple=False))
+		third.get()
+		self.assertEquals(len(publisher.outstanding), 2)
+		self.server.send(channel.id, basic.Ack(3, multiple=True))
+		self.assertEquals(third.value.get(), 3)
+
+	def test_publish_failed(self):
+		# a message which can't be sent isn't numbered by the broker, so mustn't take a tag or a slot
+		conn = self.server.connect()
+		publisher = ConfirmPublisher(conn.channel(), max_in_flight=1)
+		self.assertRaises(TypeError, publisher.publish, 'ex', 'key', b'1', {'bogus': 1})
+		self.assertEquals(len(publisher.outstanding), 0)
+		result = publisher.publish('ex', 'key', b'2')
+		self.assertEquals(result.get(timeout=1), 1)
+
+	def test_channel_closed(self):
+		self.server.auto_confirm = False
+		conn = self.server.connect()
+		channel = conn.channel()
+		publisher = ConfirmPublisher(channel, max_in_flight=1)
+		result = publisher.publish('ex', 'key', b'1')
+		blocked = gevent.spawn(self.assertRaises, NotFound, publisher.publish, 'ex', 'key', b'2')
+		gevent.sleep(0.01)
+		self.server.send(channel.id, channel_methods.Close(error=NotFound("no exchange"), method=basic.Publish))
+		self.assertRaises(NotFound, result.get)
+		blocked.get()
+		channel = conn.channel()
+		publisher = ConfirmPublisher(channel)
+		channel.close()
+		self.assertRaises(ChannelClosed, publisher.publish, 'ex', 'key', b'1')
+
+
+if __name__ == '__main__':
+	main()
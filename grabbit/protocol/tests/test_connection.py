@@ -0,0 +1,264 @@
+
+from io import BytesIO
+from unittest import main
+
+import gevent
+from gevent.pool import Pool
+
+from grabbit.errors import ChannelClosed, ConnectionClosed, ConnectionForced, FrameError, NotFound, UnexpectedFrame
+from grabbit.frames import Frame
+from grabbit.frames.content import content_frames
+from grabbit.methods import basic, channel as channel_methods, connection, queue
+from grabbit.protocol import Message
+from grabbit.protocol.timers import TimerWheel
+
+from .common import ProtocolTestCase
+from .test_timers import Clock
+
+
+def consume(name, no_wait=False):
+	return basic.Consume(queue=name, consumer_tag='', no_local=False, no_ack=False, exclusive=False,
+	                     no_wait=no_wait, arguments={})
+
+def declare(name, passive=False, nowait=False):
+	return queue.Declare(name=name, passive=passive, durable=False, exclusive=False, autodelete=False,
+	                     nowait=nowait, arguments={})
+
+def deliver(tag, consumer_tag='ctag'):
+	return basic.Deliver(consumer_tag, tag, redelivered=False, exchange='ex', routing_key='key')
+
+
+class ReadFile(BytesIO):
+	"""A file which calls on_read() before each read()"""
+	def __init__(self, data, on_read):
+		BytesIO.__init__(self, data)
+		self.on_read = on_read
+
+	def read(self, size=-1):
+		self.on_read()
+		return BytesIO.read(self, size)
+
+
+class ConnectionTests(ProtocolTestCase):
+
+	tune = connection.Tune(100, 4096, 0)
+
+	def test_handshake(self):
+		conn = self.server.connect(channel_max=200, frame_size_max=0, username='user', password='secret')
+		self.assertEquals((conn.channel_max, conn.frame_size_max), (100, 4096))
+		self.assertEquals(conn.server_properties, {'product': b'fake'})
+		self.assertEquals(conn.reader.frame_size_max, 4096)
+		(_, start_ok), = self.server.methods(connection.StartOk)
+		self.assertEquals((start_ok.security_mechanism, start_ok.security_response), (b'PLAIN', b'\0user\0secret'))
+		self.assertEquals(self.server.methods(connection.TuneOk), [(0, connection.TuneOk(100, 4096, 0))])
+		conn.close()
+		self.assertEquals(self.server.methods(connection.Close), [(0, connection.Close())])
+		self.assertIsInstance(conn.error, ConnectionClosed)
+
+	def test_call(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		self.assertEquals(channel.id, 1)
+		self.assertEquals(channel.call(declare('q')), queue.DeclareOk('q', 0, 0))
+		self.assertIsNone(channel.call(declare('q', nowait=True)))
+		channel.close()
+		self.assertEquals(list(conn.channels), [0])
+		self.assertRaises(ChannelClosed, channel.send, declare('q'))
+		self.assertEquals([method for channel_id, method in self.server.received if channel_id == channel.id], [
+			channel_methods.Open(), declare('q'), declare('q', nowait=True), channel_methods.Close(),
+		])
+
+	def test_concurrent_channels(self):
+		conn = self.server.connect()
+		def declare_on_new_channel(n):
+			channel = conn.channel()
+			results = [channel.call(declare('q{}-{}'.format(n, i))).name for i in range(5)]
+			channel.close()
+			return results
+		results = Pool(50).map(declare_on_new_channel, range(200))
+		self.assertEquals(results, [['q{}-{}'.format(n, i).encode() for i in range(5)] for n in range(200)])
+		# at most 50 were open at a time, and channel ids are allocated in turn
+		self.assertEquals(max(channel for channel, _ in self.server.received), 100)
+
+	def test_deliveries(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		consume_ok = channel.call(consume('q'))
+		body = bytes(bytearray(n % 256 for n in range(10000))) # several frames
+		for tag in range(1, 4):
+			self.server.send(channel.id, deliver(tag, consume_ok.consumer_tag), {'message_id': str(tag)}, body[:tag * 3000])
+		self.server.send(channel.id, deliver(4, consume_ok.consumer_tag), {}, b'')
+		messages = [channel.get() for _ in range(4)]
+		self.assertEquals([message.method.delivery_tag for message in messages], [1, 2, 3, 4])
+		self.assertEquals([message.body for message in messages], [body[:3000], body[:6000], body[:9000], b''])
+		self.assertEquals(messages[0].properties.message_id, b'1')
+
+	def test_streamed_body(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		writes = []
+		body = bytes(bytearray(n % 256 for n in range(40000)))
+		# another send on the channel waits until the body has been sent
+		ack = gevent.spawn_later(0, channel.send, basic.Ack(1, multiple=False))
+		publish = basic.Publish(exchange='ex', routing_key='key', mandatory=False, immediate=False)
+		channel.send(publish, {}, ReadFile(body, lambda: writes.append(conn.writer.writes)))
+		ack.get()
+		self.wait_for(lambda: self.server.methods(basic.Ack))
+		received = [method for channel_id, method in self.server.received if channel_id == channel.id][1:]
+		self.assertEquals(received, [
+			Message(publish, {}, body), basic.Ack(1, multiple=False),
+		])
+		# each frame (of a little under 4096 bytes) is read once the last has been written
+		self.assertEquals(writes, sorted(writes))
+		self.assertGreater(writes[-1] - writes[0], 5)
+
+	def test_streamed_body_failed(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		reads = []
+		def on_read():
+			reads.append(1)
+			if len(reads) > 2:
+				raise IOError("Read failed")
+		publish = basic.Publish(exchange='ex', routing_key='key', mandatory=False, immediate=False)
+		self.assertRaises(IOError, channel.send, publish, {}, ReadFile(b'x' * 10000, on_read))
+		# the rest of the body can't be sent, so neither can anything else
+		self.assertIsInstance(conn.error, ConnectionClosed)
+		self.assertIsInstance(channel.error, ConnectionClosed)
+
+	def test_callbacks(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		acks = []
+		channel.callbacks[basic.Ack] = acks.append
+		self.server.send(channel.id, basic.Ack(5, multiple=True))
+		self.server.send(channel.id, deliver(1))
+		self.assertIsInstance(channel.get(), Message)
+		self.assertEquals(acks, [basic.Ack(5, multiple=True)])
+
+	def test_server_closes_channel(self):
+		def declare_handler(server, channel, method):
+			if method.passive:
+				return [channel_methods.Close(error=NotFound("no queue"), method=queue.Declare)]
+			return [queue.DeclareOk(method.name, 0, 0)]
+		self.server.handlers[queue.Declare] = declare_handler
+		conn = self.server.connect()
+		channel = conn.channel()
+		getter = gevent.spawn(self.assertRaises, NotFound, channel.get)
+		with self.assertRaises(NotFound) as context:
+			channel.call(declare('missing', passive=True))
+		self.assertEquals(context.exception.reason, b'no queue')
+		getter.get()
+		self.assertRaises(NotFound, channel.call, declare('q'))
+		self.assertNotIn(channel.id, conn.channels)
+		self.wait_for(lambda: self.server.methods(channel_methods.CloseOk))
+		# the connection is still usable
+		self.assertEquals(conn.channel().call(declare('q')).name, b'q')
+
+	def test_server_closes_connection(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		self.server.send(0, connection.Close(error=ConnectionForced("restarting")))
+		self.assertRaises(ConnectionForced, channel.get)
+		self.assertIsInstance(conn.error, ConnectionForced)
+		self.wait_for(lambda: self.server.methods(connection.CloseOk))
+
+	def test_connection_lost(self):
+		self.server.handlers[queue.Declare] = lambda server, channel, method: server.drop() or []
+		conn = self.server.connect()
+		channel = conn.channel()
+		self.assertRaises(ConnectionClosed, channel.call, declare('q'))
+		self.assertRaises(ConnectionClosed, conn.channel)
+		self.assertEquals(conn.channels, {})
+
+	def test_peer_closes_socket(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		sent = []
+		send_frames = conn.send_frames
+		conn.send_frames = lambda frames, priority=None: sent.append(frames) or send_frames(frames, priority)
+		self.server.drop()
+		self.assertRaises(ConnectionClosed, channel.get)
+		self.assertEquals(conn.error, ConnectionClosed("Connection closed by peer"))
+		# no Close is sent for an error without a reply code
+		conn.abort(ConnectionClosed("Server does not support protocol version"))
+		self.assertEquals(sent, [])
+
+	def test_unexpected_frame(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		# a header frame with no method before it
+		self.server.socks[-1].sendall(b''.join(
+			frame.pack() for frame in content_frames(channel.id, basic.CLASS_ID, {}, b'x')
+		))
+		self.assertRaises(UnexpectedFrame, channel.get)
+		self.wait_for(lambda: self.server.methods(connection.Close))
+		close = self.server.methods(connection.Close)[0][1]
+		self.assertEquals(close.code, 505)
+
+	def test_unknown_frame_type(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		self.server.socks[-1].sendall(b'\x09\x00\x01\x00\x00\x00\x00' + Frame.FRAME_END)
+		self.assertRaises(FrameError, channel.get)
+		self.wait_for(lambda: self.server.methods(connection.Close))
+		close = self.server.methods(connection.Close)[0][1]
+		self.assertEquals(close.code, 501)
+
+	def test_channel_max(self):
+		self.server.tune = connection.Tune(3, 4096, 0)
+		conn = self.server.connect()
+		channels = [conn.channel() for _ in range(3)]
+		self.assertRaises(ValueError, conn.channel)
+		channels[1].close()
+		self.assertEquals(conn.channel().id, 2)
+
+
+class HeartbeatTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(HeartbeatTests, self).setUp()
+		self.clock = Clock()
+		self.wheel = TimerWheel(resolution=1, clock=self.clock)
+		self.conn = self.server.connect(heartbeat_delay=10, timer_wheel=self.wheel)
+		self.channel = self.conn.channel()
+
+	def run_to(self, now):
+		self.clock.now = 1000.0 + now
+		self.wheel.run_pending()
+		gevent.sleep(0.01)
+
+	def test_negotiate(self):
+		self.assertEquals(self.server.methods(connection.TuneOk)[0][1].heartbeat_delay, 10)
+		self.conn.close()
+		self.server.tune = connection.Tune(0, 131072, 5)
+		self.assertEquals(self.server.connect(heartbeat_delay=10, timer_wheel=self.wheel).heartbeat_delay, 5)
+		self.assertEquals(self.server.connect(timer_wheel=self.wheel).heartbeat_delay, 0)
+
+	def test_idle(self):
+		self.assertEquals(len(self.wheel), 2)
+		self.run_to(5) # the handshake was sent since the last check
+		self.assertEquals(self.server.heartbeats, 0)
+		self.run_to(10)
+		self.assertEquals(self.server.heartbeats, 1)
+		self.run_to(15)
+		self.assertEquals(self.server.heartbeats, 2)
+		# nothing received for 2 heartbeat_delays
+		self.run_to(20)
+		self.assertEquals(self.conn.error, None)
+		self.run_to(30)
+		self.assertIsInstance(self.conn.error, ConnectionClosed)
+		self.assertRaises(ConnectionClosed, self.channel.get)
+		self.assertEquals(len(self.wheel), 0)
+
+	def test_busy(self):
+		for now in range(5, 60, 5):
+			self.channel.call(declare('q'))
+			self.run_to(now)
+		self.assertEquals((self.server.heartbeats, self.conn.error), (0, None))
+		self.conn.close()
+		self.assertEquals(len(self.wheel), 0)
+
+
+if __name__ == '__main__':
+	main()
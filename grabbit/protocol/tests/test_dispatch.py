@@ -0,0 +1,132 @@
+
+import pickle
+from unittest import main
+
+import gevent
+from gevent.event import Event
+
+from grabbit.methods import basic
+from grabbit.protocol import Dispatcher, Message
+
+from .common import ProtocolTestCase
+
+
+def deliver(tag, routing_key):
+	return basic.Deliver(consumer_tag='c1', delivery_tag=tag, redelivered=False, exchange='ex', routing_key=routing_key)
+
+
+def check_body(message):
+	"""A handler for a process pool, which fails for messages with the body b'bad'"""
+	if message.body == b'bad':
+		raise ValueError("Bad message")
+
+
+class DispatcherTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(DispatcherTests, self).setUp()
+		self.conn = self.server.connect()
+		self.channel = self.conn.channel()
+		self.sent = 0
+
+	def send(self, keys, body=b'body'):
+		"""Delivers a message for each of keys, with delivery tags following on from the last"""
+		for key in keys:
+			self.sent += 1
+			self.server.send(self.channel.id, deliver(self.sent, key), {}, body)
+
+	def qos_sent(self):
+		return [method.prefetch_count for _, method in self.server.methods(basic.Qos)]
+
+	def test_ordering(self):
+		handled = []
+		running = set()
+		overlapped = []
+		def handler(message):
+			key = message.method.routing_key
+			self.assertNotIn(key, running)
+			running.add(key)
+			overlapped.append(len(running))
+			gevent.sleep(0.001 * (message.method.delivery_tag % 3))
+			running.remove(key)
+			handled.append((key, message.method.delivery_tag))
+		# str and bytes hashes vary between runs, but ints' don't, so these keys are in separate partitions
+		by_number = lambda message: int(message.method.routing_key)
+		dispatcher = Dispatcher(self.channel, handler, key=by_number, partitions=4, partition_size=20)
+		self.assertEquals(self.qos_sent(), [80])
+		self.send([key for _ in range(10) for key in (b'1', b'2', b'3')])
+		self.wait_for(lambda: len(handled) == 30)
+		for key in (b'1', b'2', b'3'):
+			tags = [tag for handled_key, tag in handled if handled_key == key]
+			self.assertEquals(tags, sorted(tags))
+		self.assertGreater(max(overlapped), 1)
+		dispatcher.close()
+		self.assertEquals((dispatcher.handled, dispatcher.acks.acked), (30, 30))
+		self.assertNotIn(basic.Deliver, self.channel.callbacks)
+
+	def test_throttled(self):
+		release = Event()
+		dispatcher = Dispatcher(self.channel, lambda message: release.wait(), partitions=2, partition_size=4)
+		self.send([b'a'] * 5)
+		# the first is being handled, so the rest fill its partition
+		self.wait_for(lambda: len(self.qos_sent()) == 2)
+		self.assertEquals((self.qos_sent(), dispatcher.throttled, dispatcher.waiting), ([8, 1], True, 4))
+		release.set()
+		self.wait_for(lambda: len(self.qos_sent()) == 3)
+		self.assertEquals((self.qos_sent(), dispatcher.throttles), ([8, 1, 8], 1))
+		dispatcher.close()
+
+	def test_failed(self):
+		def handler(message):
+			if message.body == b'bad':
+				raise ValueError("Bad message")
+		dispatcher = Dispatcher(self.channel, handler, requeue=False)
+		self.send([b'a'])
+		self.send([b'a'], body=b'bad')
+		self.send([b'a'])
+		self.wait_for(lambda: dispatcher.handled + dispatcher.failed == 3)
+		dispatcher.close()
+		self.assertEquals((dispatcher.handled, dispatcher.failed), (2, 1))
+		self.assertIsInstance(dispatcher.last_error, ValueError)
+		self.conn.writer.flush()
+		gevent.sleep(0.01)
+		acks = [method for _, method in self.server.received if isinstance(method, (basic.Ack, basic.Nack))]
+		self.assertEquals(acks, [basic.Nack(2, multiple=False, requeue=False), basic.Ack(3, multiple=True)])
+
+	def test_processes(self):
+		message = Message(deliver(1, b'a'), {}, b'body')
+		self.assertEquals(pickle.loads(pickle.dumps(message, 2)), message)
+		dispatcher = Dispatcher(self.channel, check_body, processes=2)
+		self.send([b'a', b'b', b'c'])
+		self.send([b'a'], body=b'bad')
+		self.wait_for(lambda: dispatcher.handled + dispatcher.failed == 4)
+		dispatcher.close()
+		self.assertEquals((dispatcher.handled, dispatcher.failed), (3, 1))
+		self.assertIsInstance(dispatcher.last_error, ValueError)
+
+	def test_channel_closed(self):
+		release = Event()
+		handled = []
+		def handler(message):
+			release.wait()
+			handled.append(message.method.delivery_tag)
+		dispatcher = Dispatcher(self.channel, handler, partitions=1, partition_size=4)
+		self.send([b'a'] * 3)
+		self.wait_for(lambda: dispatcher.waiting == 2)
+		self.channel.close()
+		self.assertEquals(dispatcher.waiting, 0)
+		release.set()
+		gevent.sleep(0.01)
+		# the one being handled isn't acked, as the broker has requeued it
+		self.assertEquals((handled, dispatcher.acks.acked), ([1], 0))
+		# once reopened, new deliveries are handled, and Qos is set again
+		self.conn.reopen(self.channel)
+		self.sent = 0
+		self.send([b'a'])
+		self.wait_for(lambda: len(handled) == 2)
+		dispatcher.close()
+		self.assertEquals((dispatcher.acks.acked, self.qos_sent()), (1, [4, 4]))
+
+
+if __name__ == '__main__':
+	main()
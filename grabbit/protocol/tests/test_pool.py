@@ -0,0 +1,97 @@
+
+from unittest import main
+
+import gevent
+
+from grabbit.errors import ChannelClosed, ConnectionClosed, NotFound
+from grabbit.methods import channel as channel_methods, confirm, queue, tx
+from grabbit.protocol import ChannelPool, ConfirmPublisher
+from grabbit.protocol.pool import CONFIRM, TX
+
+from .common import ProtocolTestCase
+from .test_connection import declare
+
+
+class ChannelPoolTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(ChannelPoolTests, self).setUp()
+		self.conn = self.server.connect(channel_max=3)
+
+	def opened(self):
+		return len(self.server.methods(channel_methods.Open))
+
+	def test_reuse(self):
+		pool = ChannelPool(self.conn)
+		self.assertEquals((self.opened(), pool.size, pool.max_size), (1, 1, 3))
+		for _ in range(3):
+			with pool.lease() as channel:
+				self.assertEquals(channel.call(declare('q')).name, b'q')
+		# each lease used the channel opened up front
+		self.assertEquals(self.opened(), 1)
+		self.assertRaises(ValueError, pool.checkin, channel)
+		self.assertRaises(ValueError, pool.checkout, 'other')
+		self.assertRaises(ValueError, ChannelPool, self.conn, max_size=4)
+
+	def test_modes(self):
+		pool = ChannelPool(self.conn, prefill={})
+		publisher = pool.checkout(CONFIRM)
+		self.assertIsInstance(publisher, ConfirmPublisher)
+		self.assertTrue(publisher.publish('ex', 'key', b'body').get(timeout=1))
+		channel = pool.checkout(TX)
+		self.assertEquals((len(self.server.methods(confirm.Select)), len(self.server.methods(tx.Select))), (1, 1))
+		pool.checkin(publisher)
+		channel.publish('ex', 'key', b'uncommitted')
+		pool.checkin(channel)
+		# so the next borrower's commit doesn't include it
+		self.assertEquals(self.server.methods(tx.Rollback), [(channel.id, tx.Rollback())])
+		self.assertEquals(pool.checkout(CONFIRM), publisher)
+		self.assertEquals(pool.checkout(TX), channel)
+
+	def test_bounded(self):
+		pool = ChannelPool(self.conn, max_size=2, prefill={TX: 1})
+		first = pool.checkout()
+		# the idle tx channel is closed to make room
+		second = pool.checkout()
+		self.assertEquals((pool.size, pool.idle[TX]), (2, []))
+		self.assertRaises(gevent.Timeout, pool.checkout, timeout=0.01)
+		waiter = gevent.spawn(pool.checkout)
+		gevent.sleep(0.01)
+		pool.checkin(first)
+		self.assertEquals(waiter.get(timeout=1), first)
+		self.assertEquals(pool.size, 2)
+		pool.checkin(second)
+
+	def test_replace(self):
+		self.server.handlers[queue.Declare] = lambda server, channel, method: [
+			channel_methods.Close(error=NotFound("no queue"), method=queue.Declare),
+		]
+		pool = ChannelPool(self.conn)
+		with pool.lease() as channel:
+			self.assertRaises(NotFound, channel.call, declare('q', passive=True))
+		# a replacement is opened in the background
+		self.wait_for(lambda: pool.idle['plain'])
+		self.assertEquals((pool.size, pool.replaced, self.opened()), (1, 1, 2))
+		self.assertNotEquals(pool.checkout(), channel)
+
+	def test_close(self):
+		pool = ChannelPool(self.conn)
+		channel = pool.checkout()
+		pool.close()
+		self.assertRaises(ChannelClosed, pool.checkout)
+		pool.checkin(channel)
+		self.assertIsInstance(channel.error, ChannelClosed)
+		self.assertEquals((pool.size, pool.replaced), (0, 0))
+
+	def test_connection_lost(self):
+		pool = ChannelPool(self.conn)
+		channel = pool.checkout()
+		self.server.drop()
+		self.assertRaises(ConnectionClosed, channel.get)
+		self.assertRaises(ConnectionClosed, pool.checkout)
+		pool.checkin(channel)
+		self.assertEquals((pool.size, pool.replaced), (0, 0))
+
+
+if __name__ == '__main__':
+	main()
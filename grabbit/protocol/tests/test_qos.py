@@ -0,0 +1,121 @@
+
+from unittest import main
+
+import gevent
+
+from grabbit.methods import basic
+from grabbit.protocol import Message, QosController
+
+from .common import ProtocolTestCase
+
+
+class Clock(object):
+	"""A clock for QosController which only moves when told to"""
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self):
+		return self.now
+
+
+def delivery(consumer_tag, delivery_tag):
+	return Message(basic.Deliver(
+		consumer_tag=consumer_tag, delivery_tag=delivery_tag, exchange='ex', routing_key='key', redelivered=False,
+	), {}, b'')
+
+
+class QosControllerTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(QosControllerTests, self).setUp()
+		self.conn = self.server.connect()
+		self.channel = self.conn.channel()
+		self.clock = Clock()
+		self.tags = iter(range(1, 100000))
+
+	def controller(self, **kwargs):
+		return QosController(self.channel, start=False, clock=self.clock, **kwargs)
+
+	def handle(self, controller, consumer_tags, count, service_time):
+		"""Runs count deliveries for each consumer through controller, each taking service_time,
+		with the consumers handling theirs at the same time"""
+		for _ in range(count):
+			messages = [delivery(consumer_tag, next(self.tags)) for consumer_tag in consumer_tags]
+			for message in messages:
+				controller.started(message)
+			self.clock.now += service_time
+			for message in messages:
+				controller.finished(message)
+
+	def qos_sent(self):
+		return [method.prefetch_count for _, method in self.server.methods(basic.Qos)]
+
+	def test_grows_to_cover_latency(self):
+		controller = self.controller(min_prefetch=2, max_prefetch=100, headroom=2)
+		self.assertEquals(self.qos_sent(), [2])
+		self.assertEquals(getattr(self.server.methods(basic.Qos)[0][1], 'global'), True)
+		controller.rtt = 0.125
+		# 16 messages/s taking 1/16s each, with 1/8s rtt: 3 in flight, doubled for headroom
+		self.handle(controller, [b'c1'], 32, 0.0625)
+		controller.update()
+		self.assertEquals((controller.prefetch_count, controller.target), (6, 6))
+		metrics = controller.metrics()
+		self.assertEquals((metrics['qos_sent'], metrics['updates'], metrics['in_progress']), (2, 1, 0))
+		self.assertEquals(metrics['consumers'][b'c1'], {'throughput': 16, 'service_time': 0.0625, 'completed': 0})
+		# a second consumer adds its own share
+		controller.rtt = 0.125
+		self.handle(controller, [b'c1', b'c2'], 32, 0.0625)
+		controller.update()
+		self.assertEquals(controller.metrics()['consumers'][b'c2']['throughput'], 16)
+		self.assertEquals(self.qos_sent(), [2, 6, 12])
+
+	def test_limits(self):
+		controller = self.controller(min_prefetch=1, max_prefetch=20, headroom=1)
+		controller.rtt = 1
+		self.handle(controller, [b'c1'], 64, 1 / 64.0)
+		controller.update()
+		self.assertEquals((controller.prefetch_count, controller.target), (20, 65))
+		# lowered by at most half per update
+		self.handle(controller, [b'c1'], 1, 1)
+		controller.rtt = 0
+		controller.update()
+		self.assertEquals(controller.prefetch_count, 10)
+		# an idle interval changes nothing
+		self.clock.now += 1
+		controller.update()
+		self.assertEquals(self.qos_sent(), [1, 20, 10])
+		self.assertRaises(ValueError, self.controller, min_prefetch=0)
+
+	def test_threshold(self):
+		controller = self.controller(min_prefetch=1, max_prefetch=1000, headroom=1, change_threshold=0.5)
+		for rtt, expected in [(1, 9), (1.25, 9), (2, 17)]:
+			controller.rtt = rtt
+			self.handle(controller, [b'c1'], 8, 0.125)
+			controller.update()
+			self.assertEquals(controller.prefetch_count, expected)
+		# 11 wasn't enough of a change from 9 to send
+		self.assertEquals((self.qos_sent(), controller.target), ([1, 9, 17], 17))
+
+	def test_periodic(self):
+		controller = QosController(self.channel, min_prefetch=1, max_prefetch=100, interval=0.01)
+		message = delivery('c1', 1)
+		controller.handle(message, lambda message: gevent.sleep(0.005))
+		self.wait_for(lambda: controller.updates >= 2)
+		self.assertEquals(len(controller.consumers), 1)
+		self.assertTrue(controller.rtt is not None)
+		self.channel.close()
+		self.assertEquals(controller._greenlet, None)
+
+	def test_connection_lost(self):
+		controller = QosController(self.channel, interval=0.01, clock=self.clock)
+		greenlet = controller._greenlet
+		self.server.handlers[basic.Qos] = lambda server, channel, method: server.drop() or []
+		# enough finished to raise prefetch_count, so the next update sends a Qos
+		self.handle(controller, ['c1'], 10, 1.0)
+		self.wait_for(greenlet.ready)
+		self.assertTrue(greenlet.successful())
+		self.assertEquals(self.qos_sent(), [1, 2])
+
+
+if __name__ == '__main__':
+	main()
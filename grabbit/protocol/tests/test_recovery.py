@@ -0,0 +1,158 @@
+
+from unittest import main
+
+from grabbit.errors import ConnectionClosed, NotFound
+from grabbit.methods import basic, channel as channel_methods, confirm, exchange, queue
+from grabbit.protocol import ConfirmPublisher, Recovery
+from grabbit.protocol.recovery import with_fields
+
+from .common import ProtocolTestCase
+from .test_connection import consume, declare, deliver
+
+
+def declare_exchange(name, passive=False):
+	return exchange.Declare(name=name, type='topic', passive=passive, durable=False, autodelete=False,
+	                        internal=False, nowait=False, arguments={})
+
+def bind(queue_name, exchange_name, routing_key):
+	return queue.Bind(queue=queue_name, exchange=exchange_name, routing_key=routing_key, nowait=False, arguments={})
+
+
+class RecoveryTests(ProtocolTestCase):
+
+	def setUp(self):
+		super(RecoveryTests, self).setUp()
+		self.conn = self.server.connect()
+		self.recovery = Recovery(self.conn)
+		self.addCleanup(self.recovery.close)
+
+	def since_drop(self, method_type):
+		"""Returns the methods of method_type received since drop()"""
+		return [method for _, method in self.server.received[self.dropped_at:] if isinstance(method, method_type)]
+
+	def drop(self):
+		"""Drops the connection, and waits for it to be recovered"""
+		recoveries = len(self.recovery.recovery_times)
+		self.dropped_at = len(self.server.received)
+		self.server.drop()
+		self.wait_for(lambda: len(self.recovery.recovery_times) > recoveries)
+
+	def test_with_fields(self):
+		method = with_fields(basic.Qos(0, 10, **{'global': True}), prefetch_count=20)
+		self.assertEquals((method.prefetch_count, getattr(method, 'global')), (20, True))
+
+	def test_replay(self):
+		channel = self.conn.channel()
+		channel.call(declare_exchange('ex'))
+		channel.call(declare_exchange('other', passive=True))
+		channel.call(declare('q'))
+		generated = channel.call(declare('')).name
+		channel.call(bind('q', 'ex', 'a'))
+		channel.call(bind(generated, 'ex', 'b'))
+		consumer = self.conn.channel()
+		consumer.call(basic.Qos(0, 10, **{'global': False}))
+		tags = [consumer.call(consume(name)).consumer_tag for name in ('q', generated)]
+		delivered = []
+		consumer.callbacks[basic.Deliver] = delivered.append
+		recovered = []
+		self.recovery.recovered_callbacks.append(recovered.append)
+		self.drop()
+		self.assertEquals(recovered, list(self.recovery.recovery_times))
+		self.assertEquals(consumer.error, None)
+		self.assertIsInstance(channel.error, ConnectionClosed) # it had nothing to recover
+		# topology is replayed with nowait, except the server-named queue
+		self.assertEquals([method.name for method in self.since_drop(exchange.Declare)], [b'ex'])
+		declares = self.since_drop(queue.Declare)
+		self.assertEquals([(method.name, method.nowait) for method in declares], [(b'q', True), (b'', False)])
+		new_name = self.recovery.queue_names[generated]
+		self.assertNotEquals(new_name, generated)
+		self.assertEquals(
+			[(method.queue, method.routing_key, method.nowait) for method in self.since_drop(queue.Bind)],
+			[(b'q', b'a', True), (new_name, b'b', True)],
+		)
+		# then the consumer's Qos, its consumers with their old tags, and the Qos again
+		self.assertEquals([method.prefetch_count for method in self.since_drop(basic.Qos)], [10, 10])
+		self.assertEquals(
+			[(method.queue, method.consumer_tag, method.no_wait) for method in self.since_drop(basic.Consume)],
+			[(b'q', tags[0], True), (new_name, tags[1], True)],
+		)
+		# and deliveries reach the same channel's callbacks
+		self.server.send(consumer.id, deliver(1, tags[0]), {}, b'body')
+		self.wait_for(lambda: delivered)
+		# it all happens again on the next recovery, with the new queue name
+		self.drop()
+		self.assertEquals(len(self.recovery.recovery_times), 2)
+		self.assertEquals(self.since_drop(basic.Consume)[0].consumer_tag, tags[0])
+
+	def test_removed(self):
+		self.server.handlers[queue.Delete] = lambda server, channel, method: [queue.DeleteOk(0)]
+		channel = self.conn.channel()
+		channel.call(declare('q'))
+		channel.call(declare('deleted'))
+		channel.call(bind('q', 'ex', 'a'))
+		channel.call(bind('deleted', 'ex', 'a'))
+		channel.call(queue.Delete(name='deleted', if_unused=False, if_empty=False, nowait=False))
+		tag = channel.call(consume('q')).consumer_tag
+		channel.call(basic.Cancel(tag, no_wait=False))
+		closed = self.conn.channel()
+		closed.call(basic.Qos(0, 10, **{'global': False}))
+		closed.close()
+		publisher = self.conn.channel()
+		publisher.call(confirm.Select(no_wait=False))
+		self.drop()
+		self.assertEquals([method.name for method in self.since_drop(queue.Declare)], [b'q'])
+		self.assertEquals([method.queue for method in self.since_drop(queue.Bind)], [b'q'])
+		self.assertEquals(self.since_drop(basic.Consume) + self.since_drop(basic.Qos), [])
+		# nothing waits for the nowait Select, but it's sent
+		self.wait_for(lambda: self.since_drop(confirm.Select))
+		self.assertEquals(self.since_drop(confirm.Select), [confirm.Select(no_wait=True)])
+		self.assertEquals((publisher.error, channel.error is not None, closed.error is not None), (None, True, True))
+
+	def test_confirms(self):
+		publisher = ConfirmPublisher(self.conn.channel(), max_in_flight=2)
+		self.assertEquals(publisher.publish('ex', 'key', b'1').get(timeout=1), 1)
+		self.drop()
+		# the broker numbers messages from 1 again on the reopened channel, and every slot is free
+		self.assertEquals(publisher._in_flight.counter, 2)
+		results = [publisher.publish('ex', 'key', body) for body in (b'2', b'3')]
+		self.assertEquals([result.get(timeout=1) for result in results], [1, 2])
+		self.assertEquals(len(publisher.outstanding), 0)
+
+	def test_cancelled_by_server(self):
+		channel = self.conn.channel()
+		tag = channel.call(consume('q')).consumer_tag
+		cancelled = []
+		channel.callbacks[basic.Cancel] = cancelled.append
+		self.recovery.channels.clear()
+		tag = channel.call(consume('q')).consumer_tag
+		self.server.send(channel.id, basic.Cancel(tag, no_wait=True))
+		self.wait_for(lambda: len(self.server.methods(basic.Consume)) == 3)
+		self.assertEquals(self.server.methods(basic.Consume)[-1][1].consumer_tag, tag)
+		# the channel's own callback is called too
+		self.assertEquals(cancelled, [basic.Cancel(tag, no_wait=True)])
+
+	def test_cancelled_queue_deleted(self):
+		def declare_handler(server, channel, method):
+			if method.passive and method.name == b'gone':
+				return [channel_methods.Close(error=NotFound("no queue"), method=queue.Declare)]
+			return [queue.DeclareOk(method.name, 0, 0)]
+		self.server.handlers[queue.Declare] = declare_handler
+		channel = self.conn.channel()
+		gone = channel.call(consume('gone')).consumer_tag
+		kept = channel.call(consume('q')).consumer_tag
+		self.server.send(channel.id, basic.Cancel(gone, no_wait=True))
+		self.wait_for(lambda: isinstance(self.recovery.last_error, NotFound))
+		# the consumer is forgotten, without consuming from the missing queue on its channel
+		self.assertEquals(len(self.server.methods(basic.Consume)), 2)
+		self.assertEquals((channel.error, list(self.recovery.channels[channel].consumers)), (None, [kept]))
+
+	def test_close(self):
+		channel = self.conn.channel()
+		channel.call(consume('q'))
+		self.recovery.close()
+		self.assertEquals((self.conn.recorder, list(self.recovery.recovery_times)), (None, []))
+		self.assertTrue(self.conn.error)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,90 @@
+
+import time
+from unittest import TestCase, main, skipIf
+
+from grabbit.compat import PY2
+from grabbit.protocol.timers import TimerWheel
+
+
+class Clock(object):
+	"""A clock which only moves when told to"""
+	def __init__(self):
+		self.now = 1000.0
+
+	def __call__(self):
+		return self.now
+
+
+class TimerWheelTests(TestCase):
+
+	def setUp(self):
+		self.clock = Clock()
+		self.wheel = TimerWheel(resolution=1, slots=4, levels=3, clock=self.clock)
+		self.fired = []
+		self.timers = []
+
+	def tearDown(self):
+		for timer in list(self.timers):
+			timer.cancel()
+		self.wheel.run_pending()
+
+	def schedule(self, *delays):
+		self.timers = [self.wheel.schedule(delay, self.fired.append, delay) for delay in delays]
+		return self.timers
+
+	def run_to(self, now):
+		self.clock.now = 1000.0 + now
+		self.wheel.run_pending()
+
+	def test_levels(self):
+		# with 4 slots of 1s, 3 levels cover up to 4s, 16s and 64s
+		self.schedule(1, 3, 5, 17, 63, 2.5, 0)
+		self.assertEquals(len(self.wheel), 7)
+		self.assertEquals([len([timer for slot in wheel for timer in slot]) for wheel in self.wheel.wheels], [4, 1, 2])
+		self.run_to(1)
+		self.assertEquals(self.fired, [1, 0])
+		self.run_to(4)
+		self.assertEquals(self.fired[2:], [3, 2.5])
+		for now in range(5, 70):
+			self.run_to(now)
+			self.assertTrue(self.fired[-1] <= now)
+		self.assertEquals(self.fired[4:], [5, 17, 63])
+		self.assertEquals(len(self.wheel), 0)
+		self.assertRaises(ValueError, self.wheel.schedule, 64, self.fired.append)
+
+	def test_cancel(self):
+		timers = self.schedule(2, 10)
+		timers[1].cancel()
+		timers[1].cancel()
+		self.assertEquals(len(self.wheel), 1)
+		self.run_to(20)
+		self.assertEquals(self.fired, [2])
+		self.assertEquals(len(self.wheel), 0)
+
+	def test_schedule_from_callback(self):
+		def reschedule(count):
+			self.fired.append(self.clock.now - 1000)
+			if count:
+				self.timers.append(self.wheel.schedule(3, reschedule, count - 1))
+		self.timers = [self.wheel.schedule(3, reschedule, 3)]
+		for now in range(1, 20):
+			self.run_to(now)
+		self.assertEquals(self.fired, [3, 6, 9, 12])
+
+	def test_idle(self):
+		self.schedule(1)
+		self.run_to(1)
+		# time passed with nothing scheduled is skipped rather than ticked through
+		self.clock.now += 10000
+		self.schedule(2)
+		self.assertEquals(self.wheel.tick, 10001)
+		self.run_to(10003)
+		self.assertEquals(self.fired, [1, 2])
+
+	@skipIf(PY2, "python 2 has no monotonic clock")
+	def test_monotonic(self):
+		self.assertIs(TimerWheel().clock, time.monotonic)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,188 @@
+
+import socket
+import unittest
+
+import gevent
+
+from grabbit.errors import ConnectionClosed
+from grabbit.frames import Frame
+from grabbit.frames.datatypes import ProtocolHeader
+from grabbit.methods import basic, channel as channel_methods, tx
+from grabbit.protocol.writer import QUANTUM, WriteProfile, Writer, get_profile, is_priority
+
+from .common import ProtocolTestCase
+
+
+class FakeSocket(object):
+	"""Records each sendall(), calling on_send() after each. Has no sendmsg(),
+	so send_buffers() joins small buffers into one sendall()."""
+	family = socket.AF_UNIX
+
+	def __init__(self, error=None, on_send=None):
+		self.sent = []
+		self.error = error
+		self.on_send = on_send
+
+	def sendall(self, data):
+		if self.error:
+			raise self.error
+		self.sent.append(data)
+		if self.on_send:
+			self.on_send()
+
+
+def body(channel, data):
+	return Frame(Frame.BODY_TYPE, channel, data)
+
+def ack(channel, tag):
+	return Frame(Frame.METHOD_TYPE, channel, basic.Ack(tag, multiple=False))
+
+def packed(*frames):
+	return b''.join(frame.pack() for frame in frames)
+
+
+class WriterTests(unittest.TestCase):
+
+	def setUp(self):
+		self.timeout = gevent.Timeout(10)
+		self.timeout.start()
+
+	def tearDown(self):
+		self.timeout.cancel()
+
+	def test_coalesce(self):
+		sock = FakeSocket()
+		writer = Writer(sock)
+		frames = [body(1, str(n).encode()) for n in range(10)]
+		gevent.joinall([gevent.spawn(writer.write, [frame]) for frame in frames])
+		writer.write([body(2, b'end')])
+		self.assertTrue(writer.flush())
+		self.assertEquals(sock.sent, [packed(*frames) + packed(body(2, b'end'))])
+		writer.write([body(1, b'again')])
+		writer.flush()
+		self.assertEquals(sock.sent[1:], [packed(body(1, b'again'))])
+		self.assertEquals((writer.writes, writer.size), (2, 0))
+
+	def test_interleave(self):
+		sock = FakeSocket()
+		writer = Writer(sock)
+		large = [body(1, bytes(bytearray([n])) * QUANTUM) for n in range(3)]
+		small = [body(2, b'a'), body(2, b'b')]
+		writer.write(large)
+		writer.write(small)
+		writer.write([body(3, b'c')])
+		writer.write([body(2, b'd')])
+		writer.flush()
+		# channel 2 fits both its units in one turn, channel 1 gets a frame per turn
+		self.assertEquals(b''.join(sock.sent), packed(
+			large[0], small[0], small[1], body(2, b'd'), body(3, b'c'), large[1], large[2],
+		))
+
+	def test_priority(self):
+		large = [body(1, bytes(bytearray([n])) * QUANTUM) for n in range(3)]
+		def on_send():
+			if len(sock.sent) == 1:
+				# channel 1 is part-way through large, so its ack must wait until after it
+				writer.write([ack(1, 1)])
+				writer.write([ack(2, 1)])
+		sock = FakeSocket(on_send=on_send)
+		writer = Writer(sock, WriteProfile(flush_bytes=1))
+		writer.write(large)
+		writer.write([Frame(Frame.HEARTBEAT_TYPE, 0)])
+		writer.flush()
+		self.assertEquals(b''.join(sock.sent), packed(
+			Frame(Frame.HEARTBEAT_TYPE, 0), large[0], ack(2, 1), large[1], large[2], ack(1, 1),
+		))
+		# priority can be overridden
+		writer.write([body(1, b'x')])
+		writer.write([ack(1, 2)], priority=False)
+		writer.write([body(2, b'y')], priority=True)
+		writer.flush()
+		self.assertEquals(sock.sent[-1], packed(body(2, b'y'), body(1, b'x'), ack(1, 2)))
+
+	def test_priority_channel_order(self):
+		# an ack never overtakes frames already queued on its channel, eg. the tx.Commit before it
+		sock = FakeSocket()
+		writer = Writer(sock)
+		commit = Frame(Frame.METHOD_TYPE, 1, tx.Commit())
+		writer.write([body(2, b'x')])
+		writer.write([commit])
+		writer.write([ack(1, 1)])
+		writer.write([ack(3, 1)])
+		writer.flush()
+		self.assertEquals(sock.sent, [packed(ack(3, 1), body(2, b'x'), commit, ack(1, 1))])
+
+	def test_is_priority(self):
+		self.assertTrue(is_priority(Frame(Frame.HEARTBEAT_TYPE, 0)))
+		self.assertTrue(is_priority(ack(1, 1)))
+		self.assertTrue(is_priority(Frame(Frame.METHOD_TYPE, 1, channel_methods.CloseOk())))
+		self.assertFalse(is_priority(Frame(Frame.METHOD_TYPE, 1, channel_methods.Close())))
+		self.assertFalse(is_priority(body(1, b'x')))
+
+	def test_flush_delay(self):
+		sock = FakeSocket()
+		writer = Writer(sock, WriteProfile(flush_delay=0.05, flush_bytes=20))
+		writer.write([body(1, b'abc')])
+		gevent.sleep(0.01)
+		self.assertEquals(sock.sent, [])
+		writer.write([body(1, b'defghijk')]) # reaches flush_bytes
+		gevent.sleep(0.001)
+		self.assertEquals(sock.sent, [packed(body(1, b'abc'), body(1, b'defghijk'))])
+		writer.write([body(1, b'x')])
+		self.assertFalse(writer.flush(timeout=0.01))
+		self.assertTrue(writer.flush())
+		self.assertEquals(sock.sent[1:], [packed(body(1, b'x'))])
+
+	def test_pending_max(self):
+		sock = FakeSocket()
+		writer = Writer(sock, WriteProfile(flush_delay=10, pending_max=20))
+		writer.write([body(1, b'abc')])
+		self.assertEquals(sock.sent, [])
+		writer.write([body(1, b'def')]) # blocks until written
+		self.assertEquals(sock.sent, [packed(body(1, b'abc'), body(1, b'def'))])
+
+	def test_error(self):
+		errors = []
+		writer = Writer(FakeSocket(error=socket.error('broken')), on_error=errors.append)
+		writer.write([body(1, b'abc')])
+		self.assertRaises(ConnectionClosed, writer.flush)
+		self.assertEquals(errors, [writer.error])
+		self.assertRaises(ConnectionClosed, writer.write, [body(1, b'def')])
+		writer.close()
+
+	def test_close(self):
+		sock = FakeSocket()
+		writer = Writer(sock, 'throughput')
+		writer.write([ProtocolHeader()])
+		writer.close()
+		self.assertEquals(sock.sent, [ProtocolHeader().pack()])
+		self.assertRaises(ConnectionClosed, writer.write, [body(1, b'def')])
+
+	def test_profiles(self):
+		self.assertIs(get_profile('latency'), get_profile('latency'))
+		profile = WriteProfile(nodelay=False)
+		self.assertIs(get_profile(profile), profile)
+		self.assertRaises(ValueError, get_profile, 'fast')
+
+
+class ConnectionWriteTests(ProtocolTestCase):
+
+	def test_nodelay(self):
+		for profile, nodelay in (('latency', True), ('throughput', False)):
+			conn = self.server.connect(write_profile=profile)
+			self.assertEquals(bool(conn.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)), nodelay)
+			conn.close()
+
+	def test_publish_coalesced(self):
+		conn = self.server.connect()
+		channel = conn.channel()
+		writes = conn.writer.writes
+		gevent.joinall([gevent.spawn(channel.publish, 'ex', 'key', b'body') for _ in range(100)])
+		conn.writer.flush()
+		self.assertEquals(conn.writer.writes, writes + 1)
+		self.wait_for(lambda: len(self.server.received) >= 100 + 2)
+		self.assertEquals([item.body for _, item in self.server.received[-100:]], [b'body'] * 100)
+
+
+if __name__ == '__main__':
+	unittest.main()
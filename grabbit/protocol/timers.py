@@ -0,0 +1,139 @@
+
+import sys
+
+import gevent
+
+from grabbit.compat import monotonic
+
+
+class Timer(object):
+	"""A callback scheduled on a TimerWheel, see TimerWheel.schedule()"""
+	__slots__ = ('wheel', 'expires', 'callback', 'args', 'active')
+
+	def __init__(self, wheel, expires, callback, args):
+		self.wheel = wheel
+		self.expires = expires # in ticks
+		self.callback = callback
+		self.args = args
+		self.active = True
+
+	def cancel(self):
+		"""Stops the timer from firing, if it hasn't already"""
+		if self.active:
+			self.active = False
+			self.wheel.count -= 1
+
+
+class TimerWheel(object):
+	"""Runs callbacks after a delay, to within resolution seconds, from a single greenlet however many
+	timers there are. Scheduling and cancelling a timer are O(1), and each tick only touches the timers
+	which are due (or close to it), so many long timers which are mostly cancelled or rescheduled before
+	they fire (like heartbeats) cost very little.
+
+	Timers are kept in levels of slots, each level's slots covering slots times as long as the one below:
+	level 0 has a slot per tick, level 1 a slot per slots ticks, and so on, giving a range of
+	resolution * slots ** levels seconds. Each tick runs the timers in the current level 0 slot, and whenever
+	a level's slots have all been passed, the timers in the next slot of the level above are moved down.
+
+	The greenlet only runs while there are active timers (count). Callbacks are run in it, so they must not
+	block; errors they raise are reported like those of a greenlet, and otherwise ignored.
+
+	clock is the time function used, by default a monotonic clock (except on python 2, which has none),
+	so that changes to the system clock don't stall timers or fire them early.
+	"""
+
+	def __init__(self, resolution=0.1, slots=64, levels=4, clock=monotonic):
+		self.resolution = resolution
+		self.slots = slots
+		self.levels = levels
+		self.clock = clock
+		self.count = 0 # active timers
+		self.tick = 0 # ticks since start
+		self.start = clock()
+		self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+		self._greenlet = None
+
+	def __len__(self):
+		return self.count
+
+	def schedule(self, delay, callback, *args):
+		"""Calls callback(*args) after delay seconds (rounded up to the next tick). Returns a Timer."""
+		if not self.count:
+			# nothing is scheduled (except possibly cancelled timers), so skip the ticks passed while idle
+			self.wheels = [[[] for _ in range(self.slots)] for _ in range(self.levels)]
+			self.tick = self._current_tick()
+		if self._greenlet is None:
+			self._greenlet = gevent.spawn(self._run)
+		ticks = self._current_tick() - self.tick + max(1, int(-(-delay // self.resolution)))
+		if ticks >= self.slots ** self.levels:
+			raise ValueError("Delay {}s is beyond the timer wheel's range of {}s".format(
+				delay, self.slots ** self.levels * self.resolution,
+			))
+		timer = Timer(self, self.tick + ticks, callback, args)
+		self._place(timer)
+		self.count += 1
+		return timer
+
+	def _current_tick(self):
+		return int((self.clock() - self.start) / self.resolution)
+
+	def _place(self, timer):
+		# put timer in the lowest level whose range covers it, in the slot for its expiry
+		delta = timer.expires - self.tick
+		span = 1
+		for level in range(self.levels):
+			if delta < span * self.slots:
+				self.wheels[level][timer.expires // span % self.slots].append(timer)
+				return
+			span *= self.slots
+
+	def advance(self):
+		"""Moves on one tick, running the timers which are due"""
+		self.tick += 1
+		tick = self.tick
+		span = self.slots
+		for level in range(1, self.levels):
+			if tick % span:
+				break
+			index = tick // span % self.slots
+			timers, self.wheels[level][index] = self.wheels[level][index], []
+			for timer in timers:
+				if timer.active:
+					self._place(timer)
+			span *= self.slots
+		index = tick % self.slots
+		timers, self.wheels[0][index] = self.wheels[0][index], []
+		for timer in timers:
+			if not timer.active:
+				continue
+			timer.active = False
+			self.count -= 1
+			try:
+				timer.callback(*timer.args)
+			except Exception:
+				gevent.get_hub().handle_error(timer, *sys.exc_info())
+
+	def run_pending(self):
+		"""Advances through every tick up to now"""
+		current = self._current_tick()
+		while self.tick < current and self.count:
+			self.advance()
+
+	def _run(self):
+		try:
+			while self.count:
+				self.run_pending()
+				gevent.sleep(max(0, self.start + (self.tick + 1) * self.resolution - self.clock()))
+		finally:
+			self._greenlet = None
+
+
+_wheel = None
+
+
+def get_wheel():
+	"""Returns the TimerWheel shared by everything in this process which doesn't have its own"""
+	global _wheel
+	if _wheel is None:
+		_wheel = TimerWheel()
+	return _wheel
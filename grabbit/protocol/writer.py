@@ -0,0 +1,252 @@
+
+import socket
+from collections import deque
+
+import gevent
+from gevent.event import Event
+
+from grabbit.compat import PY2
+from grabbit.errors import ConnectionClosed
+from grabbit.frames import Frame
+from grabbit.frames.common import to_str
+from grabbit.frames.frame import SEND_COALESCE_SIZE, send_buffers
+from grabbit.methods import basic, channel as channel_methods, connection as connection_methods
+
+
+# bytes taken from each channel in turn when filling a write. A frame is never split, so a channel
+# sending a large body gets one frame (of up to frame_size_max bytes) per turn.
+QUANTUM = 16384
+# methods which are sent as priority frames, see is_priority()
+PRIORITY_METHODS = {basic.Ack, basic.Nack, basic.Reject, channel_methods.CloseOk, connection_methods.CloseOk}
+
+
+class WriteProfile(object):
+	"""How a Writer trades latency for throughput.
+		nodelay: whether to set TCP_NODELAY, so the kernel sends each write straight away
+			instead of waiting to fill a packet.
+		flush_delay: seconds to wait for more frames after the first is queued before writing them.
+			With 0, frames are written once every greenlet that's ready to run has had its turn,
+			ie. everything queued during one iteration of the event loop is written together.
+		flush_bytes: write as soon as this many bytes are queued, without waiting out flush_delay.
+		pending_max: write() blocks while more than this many bytes are queued, so that fast senders
+			can't queue unlimited data ahead of a slow socket.
+	"""
+	__slots__ = ('nodelay', 'flush_delay', 'flush_bytes', 'pending_max')
+
+	def __init__(self, nodelay=True, flush_delay=0, flush_bytes=65536, pending_max=4 * 2**20):
+		self.nodelay = nodelay
+		self.flush_delay = flush_delay
+		self.flush_bytes = flush_bytes
+		self.pending_max = pending_max
+
+	def __repr__(self):
+		return "<{cls.__name__} {attrs}>".format(cls=type(self), attrs=', '.join(
+			'{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__
+		))
+
+
+PROFILES = {
+	# write at the end of each event loop iteration, and have the kernel send immediately
+	'latency': WriteProfile(nodelay=True, flush_delay=0),
+	# collect frames for up to 5ms (or 256KB) and let the kernel fill packets
+	'throughput': WriteProfile(nodelay=False, flush_delay=0.005, flush_bytes=262144),
+}
+
+
+def get_profile(profile):
+	"""Returns the WriteProfile for profile, which is a WriteProfile or the name of one in PROFILES"""
+	if isinstance(profile, WriteProfile):
+		return profile
+	try:
+		return PROFILES[profile]
+	except KeyError:
+		raise ValueError("Unknown write profile {!r}, expected one of: {}".format(profile, ', '.join(sorted(PROFILES))))
+
+
+def set_nodelay(sock, nodelay):
+	"""Sets TCP_NODELAY on sock, if it's a TCP socket"""
+	if sock.family in (socket.AF_INET, socket.AF_INET6):
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+
+
+def coalesce(buffers):
+	"""Joins each run of consecutive small buffers into one, leaving large ones (eg. message bodies) as they are.
+	Many small buffers are much slower to send with sendmsg() than the same bytes in one."""
+	result = []
+	small = []
+	for buf in buffers:
+		if len(buf) < SEND_COALESCE_SIZE:
+			# python 2's join() only takes strs
+			small.append(to_str(buf) if PY2 else buf)
+			continue
+		if small:
+			result.append(b''.join(small))
+			small = []
+		result.append(buf)
+	if small:
+		result.append(b''.join(small))
+	return result
+
+
+def is_priority(frame):
+	"""Whether frame should take its turn before other channels' frames. These are frames which keep the
+	connection alive or that the peer is waiting on: heartbeats, acknowledgements and replies to the peer
+	closing a channel or the connection. They're never sent ahead of frames already queued on their own
+	channel, as eg. an ack must not overtake the tx.Commit before it.
+	Our own Close is not a priority, so that a graceful close doesn't discard frames queued before it.
+	"""
+	if frame.type == Frame.METHOD_TYPE:
+		return type(frame.payload.method) in PRIORITY_METHODS
+	return frame.type == Frame.HEARTBEAT_TYPE
+
+
+class Writer(object):
+	"""Writes frames to a socket from its own greenlet, coalescing the frames sent by any number of greenlets
+	into as few writes as possible (one send_buffers(), so one sendmsg() where available, per write of up to
+	flush_bytes). When to write is set by a WriteProfile.
+
+	Frames are queued in units, each a list of frames which must be sent in order with no other frames on the
+	same channel between them, eg. a method and its content. Each write is filled with:
+		priority units (see is_priority()), in the order they were queued. A priority unit for a channel which
+			already has units queued is queued after them instead, so each channel's frames stay in order.
+		then frames from each channel with queued units in turn, up to QUANTUM bytes (or one frame) each.
+	So a large message body on one channel is interleaved frame by frame with other channels' frames,
+	and can only delay them, and heartbeats and other channels' acks, by about one frame per channel.
+
+	write() only queues the frames, so errors writing to the socket are not raised to the sender.
+	Instead, on_error(error) is called with a ConnectionClosed, and error is set and raised by any later write().
+	"""
+
+	def __init__(self, sock, profile='latency', on_error=None):
+		self.sock = sock
+		self.profile = get_profile(profile)
+		self.on_error = on_error
+		self.error = None
+		self.size = 0 # bytes queued
+		self.writes = 0 # number of times buffers have been written, for stats and tests
+		# {channel: deque of (buffers, size)}. A unit of up to QUANTUM bytes is one entry,
+		# as it's always taken whole, and a larger one has an entry for each frame.
+		self._queues = {}
+		self._round = deque() # channels with queued units, in the order they'll be sent from
+		self._priority = deque() # (buffers, size) for each queued priority unit
+		self._ready = Event() # there is something to write
+		self._full = Event() # at least flush_bytes are queued
+		self._flushed = Event() # nothing is queued or being written
+		self._flushed.set()
+		self._greenlet = gevent.spawn(self._run)
+
+	def write(self, frames, priority=None):
+		"""Queues a unit of frames (or a ProtocolHeader) to be written in order. priority defaults to
+		is_priority() of the first frame."""
+		if self.error:
+			raise self.error
+		first = frames[0]
+		if isinstance(first, Frame):
+			packed = [frame.pack_buffers() for frame in frames]
+			channel = first.channel
+			if priority is None:
+				priority = is_priority(first)
+		else:
+			packed = [[first.pack()]] # a ProtocolHeader
+			channel = 0
+		buffers = [buf for frame_buffers in packed for buf in frame_buffers]
+		size = sum(map(len, buffers))
+		if priority and channel not in self._queues:
+			self._priority.append((buffers, size))
+		else:
+			queue = self._queues.get(channel)
+			if queue is None:
+				queue = self._queues[channel] = deque()
+				self._round.append(channel)
+			if size <= QUANTUM:
+				queue.append((buffers, size))
+			else:
+				queue.extend((frame_buffers, sum(map(len, frame_buffers))) for frame_buffers in packed)
+		if not self.size:
+			# the first write since the last flush, the events are already set otherwise
+			self._flushed.clear()
+			self._ready.set()
+		self.size += size
+		if self.size >= self.profile.flush_bytes and not self._full.is_set():
+			self._full.set()
+		if self.size > self.profile.pending_max:
+			self._full.set() # don't wait out flush_delay while we're blocked
+			self.flush()
+
+	def flush(self, timeout=None):
+		"""Waits until everything queued so far has been written, or timeout.
+		Returns whether it was, and raises error if writing failed."""
+		flushed = self._flushed.wait(timeout)
+		if self.error:
+			raise self.error
+		return flushed
+
+	def drain(self):
+		"""As flush(), but writes what's queued straight away instead of waiting out flush_delay,
+		eg. between the frames of a message body which is sent a frame at a time"""
+		if self.size:
+			self._full.set()
+		return self.flush()
+
+	def close(self, timeout=None):
+		"""Writes anything still queued (waiting up to timeout), then stops. Never raises."""
+		if self._greenlet is gevent.getcurrent():
+			return # we're already stopping due to an error writing
+		if not self.error:
+			try:
+				self.flush(timeout)
+			except ConnectionClosed:
+				pass
+		self.error = self.error or ConnectionClosed("Writer is closed")
+		self._flushed.set()
+		self._greenlet.kill(block=False)
+
+	def _next_buffers(self, limit):
+		"""Takes about limit bytes of queued frames, in the order described in the class docstring,
+		and returns their buffers"""
+		result = []
+		size = 0
+		while size < limit:
+			while self._priority:
+				buffers, frame_size = self._priority.popleft()
+				result += buffers
+				size += frame_size
+			if not self._round:
+				break
+			channel = self._round.popleft()
+			queue = self._queues[channel]
+			taken = 0
+			while queue and taken < QUANTUM:
+				buffers, frame_size = queue.popleft()
+				result += buffers
+				taken += frame_size
+			size += taken
+			if queue:
+				self._round.append(channel)
+			else:
+				del self._queues[channel]
+		self.size -= size
+		return result
+
+	def _run(self):
+		profile = self.profile
+		try:
+			while True:
+				self._ready.wait()
+				if profile.flush_delay:
+					self._full.wait(profile.flush_delay)
+				else:
+					gevent.sleep(0) # let every other ready greenlet queue its frames first
+				self._full.clear()
+				while self.size:
+					send_buffers(self.sock, coalesce(self._next_buffers(profile.flush_bytes)))
+					self.writes += 1
+				self._ready.clear()
+				self._flushed.set()
+		except gevent.GreenletExit:
+			pass
+		except Exception as ex:
+			self.error = ConnectionClosed("Error writing to socket: {!r}".format(ex))
+			self._flushed.set()
+			if self.on_error:
+				self.on_error(self.error)